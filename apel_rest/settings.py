@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.6/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import sys
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 
@@ -133,20 +134,138 @@ REST_FRAMEWORK = {
 # incoming messages for later processing
 QPATH = '/var/spool/apel/cloud'
 
+# Defines the maximum number of messages
+# that can be submitted in a single batch
+MAX_BATCH_MESSAGES = 1000
+
+# Defines the maximum size (in bytes) of a
+# submitted body, once it has been decompressed
+MAX_MESSAGE_SIZE = 100 * 1024 * 1024
+
 # Defines the database settings
 # used by the REST API
 CLOUD_DB_CONF = '/etc/apel/clouddb.cfg'
 
+# Defines the pool of database connections
+# kept open by each REST API process.
+# The maximum number of connections per process.
+DB_POOL_SIZE = 10
+# How long (in seconds) a request will wait for a free connection.
+DB_POOL_TIMEOUT = 10
+# How long (in seconds) an unused connection is kept open.
+DB_POOL_MAX_IDLE = 300
+# How long (in seconds) a connection can be unused before
+# it is checked with a ping before being reused.
+DB_POOL_PING_INTERVAL = 30
+
+# Defines the caches used for tokens, IAM keys, providers and summaries.
+# Entries are kept in the 'local' (per process) cache for at most
+# LOCAL_TIMEOUT seconds, in front of the 'shared' cache, which should be
+# shared by every REST API process and replica, e.g. memcached with
+#  'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#  'LOCATION': 'memcached:11211',
+# By default, the shared cache is also kept in memory, so is not shared,
+# and each process validates tokens, and fetches providers, itself.
+CACHES = {
+    'default': {
+        'BACKEND': 'api.utils.TieredCache.TieredCache',
+        'OPTIONS': {
+            'LOCAL_CACHE': 'local',
+            'SHARED_CACHE': 'shared',
+            'LOCAL_TIMEOUT': 30,
+        },
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'local',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
+# The tests clear the caches, so must never use a configured shared cache.
+if sys.argv[1:2] == ['test']:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test-shared',
+    }
+
+# Defines how long (in seconds) the list of providers
+# retrieved from PROVIDERS_URL is used before it is refreshed.
+PROVIDERS_CACHE_TTL = 600
+# Defines how long (in seconds) after PROVIDERS_CACHE_TTL an out of
+# date list of providers can still be used while it is refreshed,
+# or while PROVIDERS_URL cannot be contacted.
+PROVIDERS_CACHE_MAX_STALE = 86400
+
+# Defines the longest (in seconds) a validated token is cached for.
+# Tokens are never cached beyond when they expire.
+TOKEN_CACHE_TIMEOUT = 300
+# Defines how long (in seconds) a rejected token is remembered for,
+# so that it is not checked with the IAM on every request.
+TOKEN_REJECTED_CACHE_TIMEOUT = 30
+# Defines how a token is checked with its IAM, once its signature has
+# been verified. One of:
+#  'introspect': every token is introspected before it is accepted.
+#  'local': tokens issued less than TOKEN_REVOCATION_WINDOW seconds ago
+#           are accepted without being introspected.
+#  'async': tokens are accepted straight away, and introspected in the
+#           background, so a revoked token is only accepted briefly.
+TOKEN_VERIFICATION_POLICY = 'introspect'
+# Defines how long (in seconds) after being issued a token
+# is accepted without introspection, when using 'local'.
+TOKEN_REVOCATION_WINDOW = 300
+# Defines how many threads, per process, introspect tokens in the
+# background, and how many tokens can wait for them, when using 'async'.
+# Tokens accepted while that many are waiting are not introspected.
+TOKEN_INTROSPECTION_WORKERS = 4
+TOKEN_INTROSPECTION_QUEUE_SIZE = 1000
+
+# Defines how long (in seconds) an IAM public key is cached for
+# if the IAM does not say how long it can be cached for.
+JWK_CACHE_TIMEOUT = 3600
+# Defines the longest (in seconds) an IAM public key is cached for,
+# regardless of what the IAM says.
+JWK_CACHE_MAX_TIMEOUT = 86400
+# Defines how often (in seconds) an IAM public key can be fetched
+# again because a token was signed by a key we have not seen before.
+JWK_REFRESH_INTERVAL = 60
+
 # Defines the maximum results per page
 # returned from the REST API
 RESULTS_PER_PAGE = 100
 
+# Defines how long (in seconds) a page of summaries is cached for.
+# Cached pages are also replaced once the summaries are updated.
+SUMMARY_CACHE_TIMEOUT = 3600
+# Defines how often (in seconds) the LastUpdated table
+# is checked to see if the summaries have been updated.
+SUMMARY_CACHE_CHECK_INTERVAL = 60
+# Defines how long (in seconds) the ID of a user, group or
+# service named in a summary request is cached for.
+DIMENSION_CACHE_TIMEOUT = 86400
+
+# Defines how many summaries are read from the
+# database at a time when streaming an export
+EXPORT_FETCH_SIZE = 1000
+
 # Defines what field to return
-# in the REST API
+# in the REST API. Only these fields can be
+# grouped by, or aggregated, with groupby and agg.
 RETURN_HEADERS = ["VOGroup",
+                  "VO",
                   "SiteName",
                   "UpdateTime",
                   "WallDuration",
+                  "CpuDuration",
+                  "NetworkInbound",
+                  "NetworkOutbound",
+                  "PublicIPCount",
+                  "Memory",
+                  "Disk",
+                  "NumberOfVMs",
                   "EarliestStartTime",
                   "LatestStartTime",
                   "Day",
@@ -3,6 +3,8 @@
 from django.conf.urls import patterns, include, url
 
 from django.contrib import admin
+from api.views.CloudRecordSummaryExportView import \
+    CloudRecordSummaryExportView
 from api.views.CloudRecordSummaryView import CloudRecordSummaryView
 from api.views.CloudRecordView import CloudRecordView
 admin.autodiscover()
@@ -21,4 +23,8 @@ urlpatterns = patterns('',
 
                        url(r'^api/v1/cloud/record/summary$',
                            CloudRecordSummaryView.as_view(),
-                           name='CloudRecordSummaryView'))
+                           name='CloudRecordSummaryView'),
+
+                       url(r'^api/v1/cloud/record/summary/export$',
+                           CloudRecordSummaryExportView.as_view(),
+                           name='CloudRecordSummaryExportView'))
@@ -6,14 +6,15 @@ from django.test import TestCase
 from mock import Mock
 
 from api.tests import PROVIDERS
-from api.views.CloudRecordView import CloudRecordView
+from api.views.CloudRecordView import CloudRecordView, PROVIDER_CACHE
 
 
 class CloudRecordHelperTest(TestCase):
     """Tests the helper methods of the CloudRecordView class."""
 
     def setUp(self):
-        """Prevent logging from appearing in test output."""
+        """Empty the provider cache and prevent logging in test output."""
+        PROVIDER_CACHE.clear()
         logging.disable(logging.CRITICAL)
 
     def test_signer_is_valid(self):
@@ -67,5 +68,7 @@ class CloudRecordHelperTest(TestCase):
         # used in the _signer_is_valid method we are testing
         # now we are mocking a failure of the CMDB to respond as expected
         CloudRecordView._get_provider_json_indigo_cmdb = Mock(return_value={})
+        # and that there is no previously retrieved list of providers
+        PROVIDER_CACHE.clear()
         # in which case we should reject all POST requests
         self.assertFalse(test_cloud_view._signer_is_valid(allowed_dn))
@@ -1,16 +1,21 @@
 """This module tests POST requests to the Cloud Record endpoint."""
 
 import glob
+import json
 import logging
 import os
 import shutil
+import zlib
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
 
 from django.core.urlresolvers import reverse
 from django.test import Client, TestCase
-from mock import Mock
+from mock import Mock, patch
 
 from api.tests import MESSAGE, PROVIDERS
-from api.views.CloudRecordView import CloudRecordView
+from api.utils.StreamingQueue import StreamingQueue
+from api.views.CloudRecordView import CloudRecordView, PROVIDER_CACHE
 
 QPATH_TEST = '/tmp/django-test/'
 
@@ -19,7 +24,8 @@ class CloudRecordPostTest(TestCase):
     """Tests POST requests to the Cloud Record endpoint."""
 
     def setUp(self):
-        """Prevent logging from appearing in test output."""
+        """Empty the provider cache and prevent logging in test output."""
+        PROVIDER_CACHE.clear()
         logging.disable(logging.CRITICAL)
 
     def test_cloud_record_post_provider_banned(self):
@@ -90,6 +96,174 @@ class CloudRecordPostTest(TestCase):
         # Make (and check) the POST request
         self._check_record_post(MESSAGE, 202)
 
+    def test_cloud_record_post_form(self):
+        """Test a message POSTed with a form content type is saved."""
+        mock_providers = Mock(return_value=PROVIDERS)
+        CloudRecordView._get_provider_json_indigo_cmdb = mock_providers
+        dn = '/C=XX/O=XX/OU=XX/L=XX/CN=allowed_host.test'
+
+        # As curl -d sends a raw message, which has no _content field.
+        with self.settings(QPATH=QPATH_TEST):
+            response = Client().post(
+                reverse('CloudRecordView'),
+                MESSAGE,
+                content_type='application/x-www-form-urlencoded',
+                SSL_CLIENT_S_DN=dn)
+
+        self.assertEqual(response.status_code, 202)
+        [message_path] = self._saved_messages('%s*/*/*/body' % QPATH_TEST)
+        with file(message_path) as message_file:
+            self.assertEqual(message_file.read(), MESSAGE)
+
+    def test_cloud_record_post_form_content(self):
+        """Test a non-ASCII _content form field is saved as UTF-8."""
+        mock_providers = Mock(return_value=PROVIDERS)
+        CloudRecordView._get_provider_json_indigo_cmdb = mock_providers
+
+        with self.settings(QPATH=QPATH_TEST):
+            response = Client().post(
+                reverse('CloudRecordView'),
+                {'_content': u'VMUUID: caf\xe9'},
+                SSL_CLIENT_S_DN='/C=XX/O=XX/OU=XX/L=XX/CN=allowed_host.test')
+
+        self.assertEqual(response.status_code, 202)
+        [message_path] = self._saved_messages('%s*/*/*/body' % QPATH_TEST)
+        with file(message_path) as message_file:
+            self.assertEqual(message_file.read(), 'VMUUID: caf\xc3\xa9')
+
+    def test_cloud_record_post_batch(self):
+        """Test each message of a batch POST is saved separately."""
+        mock_providers = Mock(return_value=PROVIDERS)
+        CloudRecordView._get_provider_json_indigo_cmdb = mock_providers
+
+        batch = MIMEMultipart('mixed')
+        for index in range(3):
+            part = MIMEText(MESSAGE)
+            if index == 0:
+                part['Empa-Id'] = 'First Message'
+            batch.attach(part)
+
+        # Split the batch into its Content-Type header and body.
+        body = batch.as_string().split('\n\n', 1)[1]
+
+        with self.settings(QPATH=QPATH_TEST):
+            response = Client().post(
+                reverse('CloudRecordView'),
+                body,
+                content_type=batch['Content-Type'],
+                HTTP_EMPA_ID='Test Process',
+                SSL_CLIENT_S_DN='/C=XX/O=XX/OU=XX/L=XX/CN=allowed_host.test')
+
+        self.assertEqual(response.status_code, 202)
+        saved = json.loads(response.content)['messages']
+        self.assertEqual([message['empaid'] for message in saved],
+                         ['First Message', 'Test Process-1',
+                          'Test Process-2'])
+
+        messages = self._saved_messages('%s*/*/*/body' % QPATH_TEST)
+        self.assertEqual(len(messages), 3)
+        for message_path in messages:
+            with file(message_path) as message_file:
+                self.assertEqual(message_file.read(), MESSAGE)
+
+        # A batch of too many messages should be rejected outright.
+        with self.settings(QPATH=QPATH_TEST, MAX_BATCH_MESSAGES=2):
+            response = Client().post(
+                reverse('CloudRecordView'),
+                body,
+                content_type=batch['Content-Type'],
+                SSL_CLIENT_S_DN='/C=XX/O=XX/OU=XX/L=XX/CN=allowed_host.test')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            len(self._saved_messages('%s*/*/*/body' % QPATH_TEST)), 3)
+
+    def test_cloud_record_post_batch_500(self):
+        """Test no message of a batch is kept if one cannot be saved."""
+        mock_providers = Mock(return_value=PROVIDERS)
+        CloudRecordView._get_provider_json_indigo_cmdb = mock_providers
+
+        batch = MIMEMultipart('mixed')
+        for _ in range(3):
+            batch.attach(MIMEText(MESSAGE))
+        body = batch.as_string().split('\n\n', 1)[1]
+
+        add_stream = StreamingQueue.add_stream
+
+        def fail_second_part(queue, data, name, chunks):
+            """Save every part of the batch but the second."""
+            if data['empaid'] == 'Test Process-1':
+                raise IOError('No space left on device')
+            return add_stream(queue, data, name, chunks)
+
+        with patch.object(StreamingQueue, 'add_stream', autospec=True,
+                          side_effect=fail_second_part):
+            with self.settings(QPATH=QPATH_TEST):
+                response = Client().post(
+                    reverse('CloudRecordView'),
+                    body,
+                    content_type=batch['Content-Type'],
+                    HTTP_EMPA_ID='Test Process',
+                    SSL_CLIENT_S_DN=('/C=XX/O=XX/OU=XX/L=XX/'
+                                     'CN=allowed_host.test'))
+
+        self.assertEqual(response.status_code, 500)
+        # The first part, saved before the second failed, should have
+        # been removed, so retrying the batch won't duplicate it.
+        self.assertEqual(
+            self._saved_messages('%s*/*/*/body' % QPATH_TEST), [])
+        self.assertEqual(self._saved_messages('%s*/*/*' % QPATH_TEST), [])
+
+    def test_cloud_record_post_gzip(self):
+        """Test a gzip compressed POST is saved decompressed."""
+        mock_providers = Mock(return_value=PROVIDERS)
+        CloudRecordView._get_provider_json_indigo_cmdb = mock_providers
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(MESSAGE) + compressor.flush()
+        dn = '/C=XX/O=XX/OU=XX/L=XX/CN=allowed_host.test'
+
+        with self.settings(QPATH=QPATH_TEST):
+            # A body that decompresses to more than
+            # MAX_MESSAGE_SIZE should be rejected.
+            with self.settings(MAX_MESSAGE_SIZE=len(MESSAGE) - 1):
+                response = Client().post(reverse('CloudRecordView'),
+                                         body,
+                                         content_type='text/plain',
+                                         HTTP_CONTENT_ENCODING='gzip',
+                                         SSL_CLIENT_S_DN=dn)
+            self.assertEqual(response.status_code, 413)
+
+            # As should an unsupported Content-Encoding.
+            response = Client().post(reverse('CloudRecordView'),
+                                     body,
+                                     content_type='text/plain',
+                                     HTTP_CONTENT_ENCODING='br',
+                                     SSL_CLIENT_S_DN=dn)
+            self.assertEqual(response.status_code, 415)
+
+            response = Client().post(reverse('CloudRecordView'),
+                                     body,
+                                     content_type='text/plain',
+                                     HTTP_CONTENT_ENCODING='gzip',
+                                     SSL_CLIENT_S_DN=dn)
+            self.assertEqual(response.status_code, 202)
+
+        [message_path] = self._saved_messages('%s*/*/*/body' % QPATH_TEST)
+        with file(message_path) as message_file:
+            self.assertEqual(message_file.read(), MESSAGE)
+
+    def test_cloud_record_post_413(self):
+        """Test an oversized POST is rejected without being saved."""
+        mock_providers = Mock(return_value=PROVIDERS)
+        CloudRecordView._get_provider_json_indigo_cmdb = mock_providers
+
+        with self.settings(MAX_MESSAGE_SIZE=len(MESSAGE) - 1):
+            self._check_record_post(MESSAGE, 413)
+
+        self.assertEqual(self._saved_messages('%s*/*/*/body' % QPATH_TEST),
+                         [])
+
     def tearDown(self):
         """Delete any messages under QPATH and re-enable logging.INFO."""
         self._delete_messages(QPATH_TEST)
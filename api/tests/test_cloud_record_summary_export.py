@@ -0,0 +1,103 @@
+"""This module tests GET requests to the Cloud Summary export endpoint."""
+
+import logging
+
+from api.utils.TokenChecker import TokenChecker
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import Client, TestCase
+from mock import patch
+
+ROWS = [{'VOGroup': u'TestGroup', 'Day': 30},
+        {'VOGroup': u'TestGroup', 'Day': 31}]
+
+
+class CloudRecordSummaryExportTest(TestCase):
+    """Tests GET requests to the Cloud Summary export endpoint."""
+
+    def setUp(self):
+        """Prevent logging from appearing in test output."""
+        logging.disable(logging.CRITICAL)
+        # Don't let cached IDs leak between tests.
+        cache.clear()
+
+    def tearDown(self):
+        """Re-enable logging."""
+        logging.disable(logging.NOTSET)
+
+    @patch('api.views.CloudRecordSummaryExportView.get_pool')
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_export_200(self, mock_valid_token_to_id, mock_get_pool):
+        """Test every summary is streamed, as NDJSON and as CSV."""
+        mock_valid_token_to_id.return_value = 'TestService'
+        pool = mock_get_pool.return_value
+        cursor = pool.acquire.return_value.cursor.return_value
+        # The ID of TestGroup.
+        (pool.connection.return_value.__enter__.return_value.
+         cursor.return_value.fetchone.return_value) = (1,)
+
+        with self.settings(ALLOWED_FOR_GET='TestService',
+                           RETURN_HEADERS=['VOGroup', 'Day']):
+            cursor.fetchmany.side_effect = [ROWS, []]
+            response = self._get_export('?group=TestGroup&from=20000101')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            self.assertEqual(''.join(response.streaming_content),
+                             '{"VOGroup":"TestGroup","Day":30}\n'
+                             '{"VOGroup":"TestGroup","Day":31}\n')
+
+            cursor.fetchmany.side_effect = [ROWS, []]
+            response = self._get_export('?group=TestGroup&from=20000101'
+                                        '&output=csv')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(''.join(response.streaming_content),
+                             'VOGroup,Day\r\n'
+                             'TestGroup,30\r\n'
+                             'TestGroup,31\r\n')
+            response.close()
+
+        # Summaries should be filtered by the ID of TestGroup.
+        self.assertEqual(cursor.execute.call_args[0][1][0], 1)
+
+        # The connection should be returned to the pool, to be reused,
+        # once the response has been sent.
+        pool.release.assert_called_with(pool.acquire.return_value,
+                                         discard=False)
+
+    @patch('api.views.CloudRecordSummaryExportView.get_pool')
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_export_400(self, mock_valid_token_to_id, mock_get_pool):
+        """Test an export is rejected, without querying, if invalid."""
+        mock_valid_token_to_id.return_value = 'TestService'
+
+        with self.settings(ALLOWED_FOR_GET='TestService'):
+            # Without a from.
+            response = self._get_export('?group=TestGroup')
+            self.assertEqual(response.status_code, 400)
+
+            # With an unsupported output.
+            response = self._get_export('?group=TestGroup&from=20000101'
+                                        '&output=xml')
+            self.assertEqual(response.status_code, 400)
+
+            # With an unknown groupby.
+            response = self._get_export('?group=TestGroup&from=20000101'
+                                        '&groupby=day')
+            self.assertEqual(response.status_code, 400)
+
+        self.assertFalse(mock_get_pool.called)
+
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_export_403(self, mock_valid_token_to_id):
+        """Test an unauthorized service cannot export summaries."""
+        mock_valid_token_to_id.return_value = 'FakeService'
+
+        with self.settings(ALLOWED_FOR_GET='TestService'):
+            response = self._get_export('?group=TestGroup&from=20000101')
+            self.assertEqual(response.status_code, 403)
+
+    def _get_export(self, options):
+        """Helper method to make a GET request to the export endpoint."""
+        test_client = Client()
+        url = ''.join((reverse('CloudRecordSummaryExportView'), options))
+        return test_client.get(url, HTTP_AUTHORIZATION='Bearer TestToken')
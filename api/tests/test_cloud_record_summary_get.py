@@ -1,9 +1,12 @@
 """This module tests GET requests to the Cloud Sumamry Record endpoint."""
 
+import datetime
 import logging
 import MySQLdb
 
 from api.utils.TokenChecker import TokenChecker
+from api.views.CloudRecordSummaryView import LAST_UPDATED_CACHE_KEY
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import Client, TestCase
 from mock import patch
@@ -17,6 +20,8 @@ class CloudRecordSummaryGetTest(TestCase):
     def setUp(self):
         """Prevent logging from appearing in test output."""
         logging.disable(logging.CRITICAL)
+        # Don't let cached summaries leak between tests.
+        cache.clear()
 
     @patch.object(TokenChecker, 'valid_token_to_id')
     def test_cloud_record_summary_get_IAM_fail(self, mock_valid_token_to_id):
@@ -126,12 +131,188 @@ class CloudRecordSummaryGetTest(TestCase):
                 self._clear_database(database)
                 database.close()
 
+    @patch('api.views.CloudRecordSummaryView.get_pool')
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_cloud_record_summary_get_cached(self, mock_valid_token_to_id,
+                                             mock_get_pool):
+        """Test summaries are cached until LastUpdated changes."""
+        mock_valid_token_to_id.return_value = 'TestService'
+        cursor = (mock_get_pool.return_value.connection.return_value.
+                  __enter__.return_value.cursor.return_value)
+        # LastUpdated, the ID of TestGroup, then the count and page of
+        # summaries. The ID is cached, so only looked up the first time.
+        cursor.fetchone.side_effect = [(datetime.datetime(2016, 8, 1),),
+                                       (1,),
+                                       {'count(*)': 1},
+                                       (datetime.datetime(2016, 8, 2),),
+                                       {'count(*)': 1}]
+        cursor.fetchall.return_value = [{'WallDuration': 86399}]
+
+        expected_response = ('{'
+                             '"count":1,'
+                             '"next":null,'
+                             '"previous":null,'
+                             '"results":[{"WallDuration":86399}]}')
+
+        with self.settings(ALLOWED_FOR_GET='TestService',
+                           RETURN_HEADERS=['WallDuration'],
+                           SUMMARY_CACHE_CHECK_INTERVAL=60):
+            for _ in range(2):
+                self._check_summary_get(200,
+                                        expected_response=expected_response,
+                                        options=("?group=TestGroup"
+                                                 "&from=20000101"),
+                                        authZ_header_cont="Bearer TestToken")
+
+            # The second request should have been served from the cache.
+            self.assertEqual(cursor.execute.call_count, 4)
+
+            # Once LastUpdated is checked again and has changed,
+            # the summaries should be queried again.
+            cache.delete(LAST_UPDATED_CACHE_KEY)
+            self._check_summary_get(200,
+                                    expected_response=expected_response,
+                                    options=("?group=TestGroup"
+                                             "&from=20000101"),
+                                    authZ_header_cont="Bearer TestToken")
+            self.assertEqual(cursor.execute.call_count, 7)
+
+    @patch('api.views.CloudRecordSummaryView.get_pool')
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_cloud_record_summary_get_304(self, mock_valid_token_to_id,
+                                          mock_get_pool):
+        """Test unchanged summaries are not sent, or queried, again."""
+        mock_valid_token_to_id.return_value = 'TestService'
+        cursor = (mock_get_pool.return_value.connection.return_value.
+                  __enter__.return_value.cursor.return_value)
+        # LastUpdated, the ID of TestGroup, then the count and page.
+        cursor.fetchone.side_effect = [(datetime.datetime(2016, 8, 1),),
+                                       (1,),
+                                       {'count(*)': 1}]
+        cursor.fetchall.return_value = [{'WallDuration': 86399}]
+
+        options = "?group=TestGroup&from=20000101"
+
+        with self.settings(ALLOWED_FOR_GET='TestService',
+                           RETURN_HEADERS=['WallDuration']):
+            response = self._check_summary_get(
+                200, options=options, authZ_header_cont="Bearer TestToken")
+            self.assertEqual(response['Last-Modified'],
+                             'Mon, 01 Aug 2016 00:00:00 GMT')
+            etag = response['ETag']
+
+            # A matching ETag, or a date no older than Last-Modified,
+            # means the client's copy of the summaries is current.
+            for conditional_header in ({'HTTP_IF_NONE_MATCH': etag},
+                                       {'HTTP_IF_MODIFIED_SINCE':
+                                        'Mon, 01 Aug 2016 00:00:00 GMT'}):
+                response = self._check_summary_get(
+                    304, options=options,
+                    authZ_header_cont="Bearer TestToken",
+                    **conditional_header)
+                self.assertEqual(response['ETag'], etag)
+
+            # Only LastUpdated, and the first page, should have been read.
+            self.assertEqual(cursor.execute.call_count, 4)
+
+            # An out of date copy should be replaced.
+            self._check_summary_get(200, options=options,
+                                    authZ_header_cont="Bearer TestToken",
+                                    HTTP_IF_NONE_MATCH='"summary:old"')
+            self._check_summary_get(200, options=options,
+                                    authZ_header_cont="Bearer TestToken",
+                                    HTTP_IF_MODIFIED_SINCE=('Sun, 31 Jul '
+                                                            '2016 23:59:59 '
+                                                            'GMT'))
+
+    @patch('api.views.CloudRecordSummaryView.get_pool')
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_cloud_record_summary_get_unknown(self, mock_valid_token_to_id,
+                                              mock_get_pool):
+        """Test summaries are not queried for an unknown group."""
+        mock_valid_token_to_id.return_value = 'TestService'
+        cursor = (mock_get_pool.return_value.connection.return_value.
+                  __enter__.return_value.cursor.return_value)
+        # LastUpdated, then the ID of TestGroup, which is not found.
+        cursor.fetchone.side_effect = [(datetime.datetime(2016, 8, 1),),
+                                       None]
+
+        expected_response = ('{'
+                             '"count":0,'
+                             '"next":null,'
+                             '"previous":null,'
+                             '"results":[]}')
+
+        with self.settings(ALLOWED_FOR_GET='TestService'):
+            self._check_summary_get(200,
+                                    expected_response=expected_response,
+                                    options=("?group=TestGroup"
+                                             "&from=20000101"),
+                                    authZ_header_cont="Bearer TestToken")
+
+        self.assertEqual(cursor.execute.call_count, 2)
+        cursor.execute.assert_called_with(
+            'select id from VOGroups where name = %s', [u'TestGroup'])
+
+    @patch('api.views.CloudRecordSummaryView.get_pool')
+    @patch.object(TokenChecker, 'valid_token_to_id')
+    def test_cloud_record_summary_get_aggregated(self, mock_valid_token_to_id,
+                                                 mock_get_pool):
+        """Test summaries are aggregated by the database."""
+        mock_valid_token_to_id.return_value = 'TestService'
+        cursor = (mock_get_pool.return_value.connection.return_value.
+                  __enter__.return_value.cursor.return_value)
+        # LastUpdated, then no yearly summary split by the filters, so
+        # the count and page are aggregated from the yearly summaries.
+        cursor.fetchone.side_effect = [(datetime.datetime(2016, 8, 1),),
+                                       None,
+                                       {'count(*)': 1}]
+        cursor.fetchall.return_value = [{'SiteName': 'TestSite',
+                                         'WallDuration': 129599}]
+
+        expected_response = ('{'
+                             '"count":1,'
+                             '"next":null,'
+                             '"previous":null,'
+                             '"results":[{'
+                             '"SiteName":"TestSite",'
+                             '"WallDuration":129599}]}')
+
+        with self.settings(ALLOWED_FOR_GET='TestService',
+                           RETURN_HEADERS=['SiteName', 'WallDuration']):
+            self._check_summary_get(200,
+                                    expected_response=expected_response,
+                                    options=("?from=20000101&groupby=site"
+                                             "&agg=WallDuration"),
+                                    authZ_header_cont="Bearer TestToken")
+
+            # Unknown fields, fields that are not returned and cursor
+            # pagination should be rejected, without querying.
+            for options in ("&groupby=day",
+                            "&agg=CpuDuration",
+                            "&groupby=site&pagination=cursor"):
+                self._check_summary_get(400,
+                                        options="?from=20000101" + options,
+                                        authZ_header_cont="Bearer TestToken")
+
+        # The groups should have been counted, and then fetched.
+        self.assertEqual(cursor.execute.call_count, 4)
+        self.assertEqual(cursor.execute.call_args_list[2][0][0],
+                         'select count(*) from (select `SiteName`, '
+                         'cast(sum(`WallDuration`) as signed) '
+                         'as `WallDuration` '
+                         'from YearlyCloudSummaries '
+                         'where SummaryDate >= date(%s) '
+                         'and EarliestStartTime > %s '
+                         'group by `SiteName` '
+                         'order by `SiteName`) as aggregated')
+
     def tearDown(self):
         """Delete any messages under QPATH and re-enable logging.INFO."""
         logging.disable(logging.NOTSET)
 
     def _check_summary_get(self, expected_status, expected_response=None,
-                           options='', authZ_header_cont=None):
+                           options='', authZ_header_cont=None, **headers):
         """Helper method to make a GET request."""
         test_client = Client()
         # Form the URL to make the GET request to
@@ -140,11 +321,10 @@ class CloudRecordSummaryGetTest(TestCase):
         if authZ_header_cont is not None:
             # If content for a HTTP_AUTHORIZATION has been provided,
             # make the GET request with the appropriate header
-            response = test_client.get(url,
-                                       HTTP_AUTHORIZATION=authZ_header_cont)
-        else:
-            # Otherise, make a GET request without a HTTP_AUTHORIZATION header
-            response = test_client.get(url)
+            headers['HTTP_AUTHORIZATION'] = authZ_header_cont
+
+        # Make the GET request, with any other headers given
+        response = test_client.get(url, **headers)
 
         # Check the expected response code has been received.
         self.assertEqual(response.status_code, expected_status)
@@ -153,6 +333,8 @@ class CloudRecordSummaryGetTest(TestCase):
             # Check the response received is as expected.
             self.assertEqual(response.content, expected_response)
 
+        return response
+
     def _populate_database(self, database):
         """Populate the database with example summaries."""
         cursor = database.cursor()
@@ -182,7 +364,7 @@ class CloudRecordSummaryGetTest(TestCase):
                        '1);')
 
         # These INSERT statements are needed
-        # because we query VCloudSummaries
+        # because we query MaterialisedCloudSummaries
         cursor.execute('INSERT INTO Sites VALUES (1, "TestSite");')
         cursor.execute('INSERT INTO VOs VALUES (1, "TestVO");')
         cursor.execute('INSERT INTO VOGroups VALUES (1, "TestGroup");')
@@ -205,6 +387,12 @@ class CloudRecordSummaryGetTest(TestCase):
         cursor.execute('DELETE FROM CloudSummaries '
                        'WHERE CloudType="TEST";')
 
+        cursor.execute('DELETE FROM LastCloudRecordPerDay '
+                       'WHERE VMUUID="TEST-VM";')
+
+        cursor.execute('DELETE FROM MaterialisedCloudSummaries '
+                       'WHERE CloudType="TEST";')
+
         cursor.execute('DELETE FROM Sites '
                        'WHERE id=1;')
 
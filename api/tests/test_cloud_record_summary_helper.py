@@ -1,15 +1,29 @@
 """This module tests the helper methods of the CloudRecordView class."""
 
+import datetime
 import logging
 
-from api.views.CloudRecordSummaryView import CloudRecordSummaryView
+from api.views.CloudRecordSummaryView import (AGGREGATE_FIELDS,
+                                                CloudRecordSummaryView)
 from django.core.urlresolvers import reverse
+from django.http import QueryDict
 from django.test import TestCase
 from mock import Mock
 from rest_framework.test import APIRequestFactory
 
 QPATH_TEST = '/tmp/django-test/'
 
+ORDER_BY = ('Year, Month, Day, SiteName, GlobalUserName, '
+            'VO, VOGroup, VORole, Status, CloudType, ImageId')
+
+KEYSET_ORDER_BY = ('SummaryDate, SiteID, Day, Month, Year, '
+                   'GlobalUserNameID, VOID, VOGroupID, VORoleID, '
+                   'Status, CloudType, ImageId')
+
+# The position of a summary from 2016-07-30, in KEYSET_ORDER.
+KEYSET_AFTER = ['2016-07-30', 1, 30, 7, 2016, 1, 1, 1, 1,
+                'Running', 'TEST', '1']
+
 
 class CloudRecordSummaryHelperTest(TestCase):
     """
@@ -124,27 +138,347 @@ class CloudRecordSummaryHelperTest(TestCase):
                 test_cloud_view._is_client_authorized(
                     'IAmNotAllowed'))
 
-    def test_filter_cursor(self):
-        """Test the filtering of a query object based on settings."""
+    def test_build_summary_query(self):
+        """Test the summary query only selects settings.RETURN_HEADERS."""
         test_cloud_view = CloudRecordSummaryView()
 
-        # A list of test summaries.
-        test_data = [{'Day': 30,
-                      'Month': 7,
-                      'Year': 2016,
-                      'SiteName': 'TEST'}]
+        # Unknown (and repeated) fields should not be selected.
+        with self.settings(RETURN_HEADERS=['SiteName', 'Day',
+                                           'NotAField', 'Day']):
+            query, parameters = test_cloud_view._build_summary_query(
+                None, 1, '20000101', '20191231', None)
+
+        self.assertEqual(query,
+                         'select `SiteName`, `Day` '
+                         'from MaterialisedCloudSummaries '
+                         'where SiteID = %s '
+                         'and SummaryDate >= date(%s) '
+                         'and EarliestStartTime > %s '
+                         'and LatestStartTime < %s '
+                         'order by ' + ORDER_BY)
+
+        self.assertEqual(parameters,
+                         [1, '20000101', '20000101', '20191231'])
+
+        # Without a user, group or service, all summaries are selected.
+        with self.settings(RETURN_HEADERS=['WallDuration']):
+            query, parameters = test_cloud_view._build_summary_query(
+                None, None, '20000101', '20191231', None)
+
+        self.assertEqual(query,
+                         'select `WallDuration` '
+                         'from MaterialisedCloudSummaries '
+                         'where SummaryDate >= date(%s) '
+                         'and EarliestStartTime > %s '
+                         'order by ' + ORDER_BY)
+
+        self.assertEqual(parameters, ['20000101', '20000101'])
+
+    def test_parse_aggregation(self):
+        """Test groupby and agg are parsed into lists of fields."""
+        test_cloud_view = CloudRecordSummaryView()
+        factory = APIRequestFactory()
+        url = reverse('CloudRecordSummaryView')
+
+        with self.settings(RETURN_HEADERS=['SiteName', 'Year', 'Month',
+                                           'WallDuration',
+                                           'EarliestStartTime']):
+            # Without either, summaries are not aggregated.
+            request = factory.get(''.join((url, '?from=FromDate')))
+            self.assertEqual(test_cloud_view._parse_aggregation(request),
+                             None)
+
+            # Without agg, every returned field that can be is aggregated.
+            request = factory.get(''.join((url, '?from=FromDate'
+                                                '&groupby=year,site,month')))
+            self.assertEqual(test_cloud_view._parse_aggregation(request),
+                             (['Year', 'SiteName', 'Month'],
+                              ['WallDuration', 'EarliestStartTime']))
+
+            request = factory.get(''.join((url, '?from=FromDate'
+                                                '&agg=WallDuration')))
+            self.assertEqual(test_cloud_view._parse_aggregation(request),
+                             ([], ['WallDuration']))
+
+            # Unknown fields, and fields that are not returned,
+            # should be rejected.
+            for options in ('&groupby=day',
+                            '&groupby=site&agg=SiteName',
+                            '&groupby=vo',
+                            '&agg=CpuDuration'):
+                request = factory.get(''.join((url, '?from=FromDate',
+                                               options)))
+                self.assertRaises(ValueError,
+                                  test_cloud_view._parse_aggregation,
+                                  request)
+
+    def test_parse_aggregation_defaults(self):
+        """Test every groupby and agg field is returned by default."""
+        test_cloud_view = CloudRecordSummaryView()
+        factory = APIRequestFactory()
+        url = reverse('CloudRecordSummaryView')
+
+        # Neither groupby nor agg should be rejected by default.
+        options = ('?from=FromDate&groupby=site,group,user,vo,year,month'
+                   '&agg=%s' % ','.join(AGGREGATE_FIELDS))
+        request = factory.get(''.join((url, options)))
+        group_by, aggregates = test_cloud_view._parse_aggregation(request)
+        self.assertEqual(group_by, ['SiteName', 'VOGroup', 'GlobalUserName',
+                                    'VO', 'Year', 'Month'])
+        self.assertEqual(sorted(aggregates), sorted(AGGREGATE_FIELDS))
+
+        # Otherwise, the fields that are returned are listed.
+        with self.settings(RETURN_HEADERS=['SiteName', 'WallDuration']):
+            request = factory.get(''.join((url, '?from=FromDate'
+                                                '&groupby=vo')))
+            try:
+                test_cloud_view._parse_aggregation(request)
+            except ValueError as error:
+                self.assertEqual(str(error),
+                                 'VO is not returned by this service, '
+                                 'which returns: SiteName, WallDuration.')
+            else:
+                self.fail('groupby=vo should be rejected.')
+
+    def test_build_aggregate_query(self):
+        """Test the aggregate query groups and orders the summaries."""
+        test_cloud_view = CloudRecordSummaryView()
 
+        query, parameters = test_cloud_view._build_aggregate_query(
+            None, 1, '20000101', '20191231', None,
+            ['Year', 'Month'], ['WallDuration', 'LatestStartTime'])
+
+        self.assertEqual(query,
+                         'select `Year`, `Month`, '
+                         'cast(sum(`WallDuration`) as signed) '
+                         'as `WallDuration`, '
+                         'max(`LatestStartTime`) as `LatestStartTime` '
+                         'from MaterialisedCloudSummaries '
+                         'where SiteID = %s '
+                         'and SummaryDate >= date(%s) '
+                         'and EarliestStartTime > %s '
+                         'and LatestStartTime < %s '
+                         'group by `Year`, `Month` '
+                         'order by `Year`, `Month`')
+
+        self.assertEqual(parameters,
+                         [1, '20000101', '20000101', '20191231'])
+
+        # Without groupby, every summary is aggregated into one.
+        query, _ = test_cloud_view._build_aggregate_query(
+            None, None, '20000101', '20191231', None, [], ['WallDuration'])
+
+        self.assertEqual(query,
+                         'select cast(sum(`WallDuration`) as signed) '
+                         'as `WallDuration` '
+                         'from MaterialisedCloudSummaries '
+                         'where SummaryDate >= date(%s) '
+                         'and EarliestStartTime > %s')
+
+    def test_aggregate_table(self):
+        """Test summaries are aggregated from the smallest usable table."""
+        test_cloud_view = CloudRecordSummaryView()
         cursor = Mock()
-        # Get the mock cursor object return the test_data.
-        cursor.fetchall = Mock(return_value=test_data)
 
-        with self.settings(RETURN_HEADERS=['SiteName', 'Day']):
-            result = test_cloud_view._filter_cursor(cursor)
+        # Without a split yearly summary, the yearly summaries are used.
+        cursor.fetchone.return_value = None
+        self.assertEqual(test_cloud_view._aggregate_table(
+            cursor, None, 1, '20000101', '20191231', None, ['SiteName']),
+            'YearlyCloudSummaries')
+
+        # Months are only kept by the monthly summaries.
+        self.assertEqual(test_cloud_view._aggregate_table(
+            cursor, None, 1, '20000101', '20191231', None, ['Year', 'Month']),
+            'MonthlyCloudSummaries')
+
+        # If the filters split rolled up summaries, the (materialised)
+        # daily summaries are used, as are they to group by unkept fields.
+        cursor.fetchone.return_value = (1,)
+        self.assertEqual(test_cloud_view._aggregate_table(
+            cursor, None, 1, '20000101', '20191231', None, ['SiteName']),
+            'MaterialisedCloudSummaries')
+
+        cursor.fetchone.return_value = None
+        cursor.execute.reset_mock()
+        self.assertEqual(test_cloud_view._aggregate_table(
+            cursor, None, 1, '20000101', '20191231', None, ['Day']),
+            'MaterialisedCloudSummaries')
+        self.assertFalse(cursor.execute.called)
+
+    def test_build_rollup_check_query(self):
+        """Test the query finding rolled up summaries split by filters."""
+        test_cloud_view = CloudRecordSummaryView()
+
+        query, parameters = test_cloud_view._build_rollup_check_query(
+            'MonthlyCloudSummaries', 1, None, '20000101', '20191231', None)
+
+        self.assertEqual(query,
+                         'select 1 from MonthlyCloudSummaries '
+                         'where VOGroupID = %s '
+                         'and SummaryDate >= date(%s) '
+                         'and MaxEarliestStartTime > %s '
+                         'and MinLatestStartTime < %s '
+                         'and not (EarliestStartTime > %s '
+                         'and LatestStartTime < %s) '
+                         'limit 1')
+
+        self.assertEqual(parameters,
+                         [1, '20000101', '20000101', '20191231',
+                          '20000101', '20191231'])
+
+        # Without a user, group or service, there is no filter on
+        # LatestStartTime to split summaries.
+        query, parameters = test_cloud_view._build_rollup_check_query(
+            'YearlyCloudSummaries', None, None, '20000101', '20191231', None)
+
+        self.assertEqual(query,
+                         'select 1 from YearlyCloudSummaries '
+                         'where SummaryDate >= date(%s) '
+                         'and EarliestStartTime <= %s '
+                         'and MaxEarliestStartTime > %s '
+                         'limit 1')
+
+        self.assertEqual(parameters, ['20000101', '20000101', '20000101'])
+
+    def test_build_keyset_query(self):
+        """Test the keyset query starts after the given summary."""
+        test_cloud_view = CloudRecordSummaryView()
+
+        with self.settings(RETURN_HEADERS=['WallDuration', 'Day']):
+            query, parameters = test_cloud_view._build_keyset_query(
+                1, None, '20000101', '20191231', None, KEYSET_AFTER)
+
+        self.assertEqual(query,
+                         'select `WallDuration`, `Day`, `SummaryDate`, '
+                         '`SiteID`, `Month`, `Year`, `GlobalUserNameID`, '
+                         '`VOID`, `VOGroupID`, `VORoleID`, `Status`, '
+                         '`CloudType`, `ImageId` '
+                         'from MaterialisedCloudSummaries '
+                         'where VOGroupID = %s '
+                         'and SummaryDate >= date(%s) '
+                         'and EarliestStartTime > %s '
+                         'and LatestStartTime < %s '
+                         'and SummaryDate >= %s '
+                         'and ((SummaryDate > %s) '
+                         'or (SummaryDate = %s and SiteID > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID = %s and VOID > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID = %s and VOID = %s '
+                         'and VOGroupID > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID = %s and VOID = %s '
+                         'and VOGroupID = %s and VORoleID > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID = %s and VOID = %s '
+                         'and VOGroupID = %s and VORoleID = %s '
+                         'and Status > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID = %s and VOID = %s '
+                         'and VOGroupID = %s and VORoleID = %s '
+                         'and Status = %s and CloudType > %s) '
+                         'or (SummaryDate = %s and SiteID = %s '
+                         'and Day = %s and Month = %s and Year = %s '
+                         'and GlobalUserNameID = %s and VOID = %s '
+                         'and VOGroupID = %s and VORoleID = %s '
+                         'and Status = %s and CloudType = %s '
+                         'and ImageId > %s)) '
+                         'order by ' + KEYSET_ORDER_BY + ' limit %s')
+
+        # Each comparison is given the position up to the field it compares.
+        expected_parameters = [1, '20000101', '20000101', '20191231',
+                               '2016-07-30']
+        for index in range(len(KEYSET_AFTER)):
+            expected_parameters.extend(KEYSET_AFTER[:index + 1])
+
+        self.assertEqual(parameters, expected_parameters)
+
+    def test_keyset_paginate_result(self):
+        """Test a page of summaries links to the next page."""
+        test_cloud_view = CloudRecordSummaryView()
+        factory = APIRequestFactory()
+        url = ''.join((reverse('CloudRecordSummaryView'),
+                       '?from=FromDate&pagination=cursor'))
+        request = factory.get(url)
+
+        summaries = []
+        for day in (29, 30, 31):
+            summaries.append({'WallDuration': 86400,
+                              'SummaryDate': datetime.date(2016, 7, day),
+                              'SiteID': 1, 'Day': day, 'Month': 7,
+                              'Year': 2016, 'GlobalUserNameID': 1,
+                              'VOID': 1, 'VOGroupID': 1, 'VORoleID': 1,
+                              'Status': 'Running', 'CloudType': 'TEST',
+                              'ImageId': '1'})
 
-        expected_result = [{'SiteName': 'TEST',
-                            'Day': 30}]
+        cursor = Mock()
+        cursor.fetchall.return_value = summaries
+
+        with self.settings(RETURN_HEADERS=['WallDuration', 'Day'],
+                           RESULTS_PER_PAGE=2):
+            content = test_cloud_view._keyset_paginate_result(
+                request, cursor, None, None, 'FromDate', 'ToDate', None, None)
+
+        # Only RESULTS_PER_PAGE summaries, with only the
+        # RETURN_HEADERS fields, should be returned.
+        self.assertEqual(content['results'],
+                         [{'WallDuration': 86400, 'Day': 29},
+                          {'WallDuration': 86400, 'Day': 30}])
+
+        # The next page should start after the last summary returned.
+        cursor_token = QueryDict(
+            content['next'].split('?')[1]).get('cursor')
+        self.assertEqual(test_cloud_view._decode_cursor(cursor_token),
+                         KEYSET_AFTER)
+
+        # On the last page, there should be no next page.
+        cursor.fetchall.return_value = summaries[2:]
+        with self.settings(RESULTS_PER_PAGE=2):
+            content = test_cloud_view._keyset_paginate_result(
+                request, cursor, None, None, 'FromDate', 'ToDate', None,
+                KEYSET_AFTER)
+
+        self.assertEqual(content['next'], None)
+
+    def test_decode_cursor(self):
+        """Test malformed cursors are rejected."""
+        test_cloud_view = CloudRecordSummaryView()
 
-        self.assertEqual(result, expected_result)
+        # A cursor with each of its values replaced by one of the wrong type.
+        wrong_values = []
+        for index, value in enumerate([[2016, 7, 30], '2016-07', 'TestSite',
+                                       '30', 7.0, True, None, {'ID': 1},
+                                       [1], {}, ['Running'], 1]):
+            after = list(KEYSET_AFTER)
+            after[index] = value
+            wrong_values.append(after)
+
+        for cursor_token in (['not a cursor',
+                              test_cloud_view._encode_cursor({}),
+                              test_cloud_view._encode_cursor([2016, 7])] +
+                             [test_cloud_view._encode_cursor(after)
+                              for after in wrong_values]):
+            self.assertRaises(ValueError,
+                              test_cloud_view._decode_cursor,
+                              cursor_token)
+
+        # Whereas a cursor for a summary is decoded.
+        self.assertEqual(test_cloud_view._decode_cursor(
+            test_cloud_view._encode_cursor(KEYSET_AFTER)), KEYSET_AFTER)
 
     def tearDown(self):
         """Delete any messages under QPATH and re-enable logging.INFO."""
@@ -0,0 +1,90 @@
+"""This module tests the ContentDecoder class."""
+
+import unittest
+import zlib
+
+from api.utils import ContentDecoder as content_decoder_module
+from api.utils.ContentDecoder import (ContentDecoder, ContentDecoderError,
+                                      ContentTooLargeError,
+                                      UnsupportedEncodingError)
+
+BODY = 'APEL-cloud-message: v0.4\nVMUUID: TestVM\n%%\n' * 100
+
+
+def gzip_compress(data):
+    """Return data compressed with gzip."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ContentDecoderTest(unittest.TestCase):
+    """Tests the decoding of compressed request bodies."""
+
+    def test_decode_gzip(self):
+        """Test a gzip compressed body is decompressed."""
+        decoder = ContentDecoder(len(BODY))
+        self.assertEqual(decoder.decode('gzip', gzip_compress(BODY)), BODY)
+
+    def test_decode_stream(self):
+        """Test a body is decompressed a chunk at a time."""
+        data = gzip_compress(BODY * 100)
+        chunks = [data[start:start + 100]
+                  for start in range(0, len(data), 100)]
+
+        decoder = ContentDecoder(len(BODY) * 100)
+        decoder.CHUNK_SIZE = 1024
+        decoded = list(decoder.decode_stream('gzip', chunks))
+
+        self.assertEqual(''.join(decoded), BODY * 100)
+        self.assertTrue(max([len(chunk) for chunk in decoded]) <= 1024)
+
+    def test_decode_identity(self):
+        """Test an uncompressed body is returned as it is."""
+        decoder = ContentDecoder(len(BODY))
+        self.assertEqual(decoder.decode('identity', BODY), BODY)
+        self.assertEqual(decoder.decode(None, BODY), BODY)
+
+    def test_decode_zstd(self):
+        """Test a zstd compressed body is decompressed, if supported."""
+        zstandard = content_decoder_module.zstandard
+        if zstandard is None:
+            # zstd is optional, so only tested if zstandard is installed.
+            self.assertFalse('zstd' in ContentDecoder(len(BODY)).encodings())
+            return
+
+        data = zstandard.ZstdCompressor().compress(BODY)
+        self.assertEqual(ContentDecoder(len(BODY)).decode('zstd', data), BODY)
+
+    def test_decode_too_large(self):
+        """Test a body is not decompressed beyond the maximum size."""
+        decoder = ContentDecoder(len(BODY) - 1)
+        self.assertRaises(ContentTooLargeError,
+                          decoder.decode, 'gzip', gzip_compress(BODY))
+        self.assertRaises(ContentTooLargeError,
+                          decoder.decode, 'identity', BODY)
+
+    def test_decode_invalid(self):
+        """Test unsupported and corrupt bodies are rejected."""
+        decoder = ContentDecoder(len(BODY))
+        self.assertRaises(UnsupportedEncodingError,
+                          decoder.decode, 'br', BODY)
+        self.assertRaises(ContentDecoderError,
+                          decoder.decode, 'gzip', BODY)
+
+    def test_decode_gzip_truncated(self):
+        """Test a body that ends before its gzip stream is rejected."""
+        data = gzip_compress(BODY)
+        decoder = ContentDecoder(len(BODY))
+        for end in (len(data) // 2, len(data) - 1):
+            self.assertRaises(ContentDecoderError,
+                              decoder.decode, 'gzip', data[:end])
+
+    def test_decode_gzip_trailing_data(self):
+        """Test a body with data after its gzip stream is rejected."""
+        data = gzip_compress(BODY)
+        decoder = ContentDecoder(len(BODY))
+        self.assertRaises(ContentDecoderError,
+                          decoder.decode, 'gzip', data + 'trailing')
+        # Even if the data after the stream is in a chunk of its own.
+        self.assertRaises(ContentDecoderError, list,
+                          decoder.decode_stream('gzip', [data, 'trailing']))
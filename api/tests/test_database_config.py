@@ -0,0 +1,82 @@
+"""This module tests the DatabaseConfig class."""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from api.utils.DatabaseConfig import DatabaseConfig
+
+CONFIG_TEMPLATE = """[db]
+hostname = %s
+port = 3306
+name = apel_rest
+username = apel
+password = %s
+"""
+
+
+class DatabaseConfigTest(TestCase):
+    """Tests the caching and reloading of the database configuration."""
+
+    def setUp(self):
+        """Create a directory for test configuration files."""
+        logging.disable(logging.CRITICAL)
+        self._config_dir = tempfile.mkdtemp()
+        self._config_path = os.path.join(self._config_dir, 'clouddb.cfg')
+
+    def tearDown(self):
+        """Delete test configuration files and re-enable logging."""
+        shutil.rmtree(self._config_dir)
+        logging.disable(logging.NOTSET)
+
+    def test_get(self):
+        """Test the configuration file is parsed correctly."""
+        self._write_config('db.test', 'secret', mtime=1000)
+
+        with self.settings(CLOUD_DB_CONF=self._config_path):
+            self.assertEqual(DatabaseConfig().get(),
+                             {'host': 'db.test',
+                              'user': 'apel',
+                              'passwd': 'secret',
+                              'db': 'apel_rest'})
+
+    def test_get_cached(self):
+        """Test the file is only re-read when its mtime changes."""
+        database_config = DatabaseConfig()
+        self._write_config('db.test', 'secret', mtime=1000)
+
+        with self.settings(CLOUD_DB_CONF=self._config_path):
+            self.assertEqual(database_config.get()['passwd'], 'secret')
+
+            # Without a change of mtime, the cached configuration is used.
+            self._write_config('db.test', 'rotated', mtime=1000)
+            self.assertEqual(database_config.get()['passwd'], 'secret')
+
+            # Once the mtime changes, the file is read again.
+            self._write_config('db.test', 'rotated', mtime=2000)
+            self.assertEqual(database_config.get()['passwd'], 'rotated')
+
+    def test_get_missing_file(self):
+        """Test a missing file results in the default configuration."""
+        database_config = DatabaseConfig()
+
+        with self.settings(CLOUD_DB_CONF=self._config_path):
+            self.assertEqual(database_config.get(),
+                             {'host': 'localhost',
+                              'user': 'root',
+                              'passwd': '',
+                              'db': 'apel_rest'})
+
+            # The file is read once it has been created.
+            self._write_config('db.test', 'secret', mtime=1000)
+            self.assertEqual(database_config.get()['host'], 'db.test')
+
+    def _write_config(self, hostname, password, mtime):
+        """Write a configuration file, with the given modification time."""
+        with open(self._config_path, 'w') as config_file:
+            config_file.write(CONFIG_TEMPLATE % (hostname, password))
+
+        os.utime(self._config_path, (mtime, mtime))
@@ -0,0 +1,113 @@
+"""This module tests the DatabasePool class."""
+
+import logging
+import unittest
+
+import MySQLdb
+from mock import Mock, patch
+
+from api.utils.DatabasePool import DatabasePool, DatabasePoolError
+
+
+class DatabasePoolTest(unittest.TestCase):
+    """Tests the borrowing and returning of pooled database connections."""
+
+    def setUp(self):
+        """Prevent logging from appearing in test output."""
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        """Re-enable logging."""
+        logging.disable(logging.NOTSET)
+
+    @patch('MySQLdb.connect')
+    def test_connection_reused(self, mock_connect):
+        """Test a returned connection is handed out again."""
+        pool = self._create_pool()
+
+        with pool.connection() as first_connection:
+            pass
+        with pool.connection() as second_connection:
+            pass
+
+        self.assertEqual(mock_connect.call_count, 1)
+        self.assertTrue(first_connection is second_connection)
+        # The transaction should be ended each time it is returned.
+        self.assertEqual(first_connection.rollback.call_count, 2)
+
+    @patch('MySQLdb.connect')
+    def test_pool_bounded(self, mock_connect):
+        """Test no more than size connections are handed out at once."""
+        pool = self._create_pool(size=1, timeout=0.01)
+
+        connection = pool.acquire()
+        self.assertRaises(DatabasePoolError, pool.acquire)
+
+        # Once the connection is returned, it can be borrowed again.
+        pool.release(connection)
+        self.assertTrue(pool.acquire() is connection)
+
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+
+    @patch('MySQLdb.connect')
+    def test_unhealthy_connection_replaced(self, mock_connect):
+        """Test a connection that fails its ping is not reused."""
+        dead_connection = Mock()
+        dead_connection.ping.side_effect = MySQLdb.OperationalError
+        new_connection = Mock()
+        mock_connect.side_effect = [dead_connection, new_connection]
+
+        pool = self._create_pool(ping_interval=0)
+
+        pool.release(pool.acquire())
+        self.assertTrue(pool.acquire() is new_connection)
+        self.assertTrue(dead_connection.close.called)
+
+    @patch('MySQLdb.connect')
+    def test_idle_connection_evicted(self, mock_connect):
+        """Test connections idle for longer than max_idle are closed."""
+        old_connection = Mock()
+        new_connection = Mock()
+        mock_connect.side_effect = [old_connection, new_connection]
+
+        pool = self._create_pool(max_idle=-1)
+
+        pool.release(pool.acquire())
+        self.assertTrue(pool.acquire() is new_connection)
+        self.assertTrue(old_connection.close.called)
+        self.assertEqual(pool.stats()['evicted'], 1)
+
+    @patch('MySQLdb.connect')
+    def test_failed_connection_discarded(self, mock_connect):
+        """Test a connection is discarded if its with block fails."""
+        pool = self._create_pool()
+
+        try:
+            with pool.connection() as connection:
+                raise MySQLdb.OperationalError
+        except MySQLdb.OperationalError:
+            pass
+
+        self.assertTrue(connection.close.called)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    @patch('MySQLdb.connect')
+    def test_failed_connect_frees_slot(self, mock_connect):
+        """Test a failure to connect does not use up the pool."""
+        mock_connect.side_effect = MySQLdb.OperationalError
+        pool = self._create_pool(size=1)
+
+        self.assertRaises(MySQLdb.OperationalError, pool.acquire)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def _create_pool(self, size=2, timeout=1, max_idle=300, ping_interval=30):
+        """Return a new DatabasePool for a test database."""
+        return DatabasePool({'host': 'localhost',
+                             'user': 'root',
+                             'passwd': '',
+                             'db': 'apel_rest'},
+                            size, timeout, max_idle, ping_interval)
@@ -0,0 +1,54 @@
+"""This module tests the DimensionLookup class."""
+
+import logging
+
+from django.core.cache import cache
+from django.test import TestCase
+from mock import MagicMock
+
+from api.utils.DimensionLookup import DimensionLookup
+
+
+class DimensionLookupTest(TestCase):
+    """Tests the lookup, and caching, of the IDs of names."""
+
+    def setUp(self):
+        """Mock a pool of connections and disable logging."""
+        logging.disable(logging.CRITICAL)
+        cache.clear()
+        self._pool = MagicMock()
+        self._cursor = (self._pool.connection.return_value.
+                        __enter__.return_value.cursor.return_value)
+        self._lookup = DimensionLookup()
+
+    def tearDown(self):
+        """Re-enable logging."""
+        logging.disable(logging.NOTSET)
+
+    def test_get_id(self):
+        """Test IDs are read from the database once, then cached."""
+        self._cursor.fetchone.return_value = (7,)
+
+        for _ in range(2):
+            self.assertEqual(self._lookup.get_id(self._pool, 'Sites',
+                                                 u'TestSite'), 7)
+
+        self._cursor.execute.assert_called_once_with(
+            'select id from Sites where name = %s', [u'TestSite'])
+
+    def test_get_id_unknown(self):
+        """Test names that are not found are also cached."""
+        self._cursor.fetchone.return_value = None
+
+        with self.settings(SUMMARY_CACHE_CHECK_INTERVAL=60):
+            for _ in range(2):
+                self.assertEqual(self._lookup.get_id(self._pool, 'DNs',
+                                                     u'TestDN'), None)
+
+        self.assertEqual(self._cursor.execute.call_count, 1)
+
+    def test_get_id_unknown_table(self):
+        """Test only the dimension tables can be looked up."""
+        self.assertRaises(ValueError, self._lookup.get_id, self._pool,
+                          'CloudRecords', u'TestName')
+        self.assertFalse(self._pool.connection.called)
@@ -0,0 +1,135 @@
+"""This module tests the ProviderCache class."""
+
+import logging
+import time
+
+from django.core.cache import cache
+from django.test import TestCase
+from mock import Mock, patch
+
+from api.utils.ProviderCache import ProviderCache
+
+HOSTNAMES = ['allowed_host.test', 'allowed_host2.test']
+
+
+class ProviderCacheTest(TestCase):
+    """Tests the caching of the Resource Provider hostnames."""
+
+    def setUp(self):
+        """Create a new, empty, ProviderCache and disable logging."""
+        self._provider_cache = ProviderCache()
+        cache.clear()
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        """Re-enable logging."""
+        logging.disable(logging.NOTSET)
+
+    def test_get_cached(self):
+        """Test the hostnames are only fetched once while fresh."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=600):
+            for _ in range(3):
+                self.assertEqual(self._provider_cache.get(fetch),
+                                 set(HOSTNAMES))
+
+        self.assertEqual(fetch.call_count, 1)
+        stats = self._provider_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    @patch('threading.Thread')
+    def test_get_stale(self, mock_thread):
+        """Test stale hostnames are served while being refreshed."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=0,
+                           PROVIDERS_CACHE_MAX_STALE=600):
+            self._provider_cache.get(fetch)
+
+            # The stale hostnames are returned straight away...
+            fetch.return_value = ['new_host.test']
+            self.assertEqual(self._provider_cache.get(fetch),
+                             set(HOSTNAMES))
+            # ...and a refresh is started in the background.
+            self.assertTrue(mock_thread.return_value.start.called)
+
+            # Run the refresh, as the background thread would have.
+            self._provider_cache._refresh(fetch)
+            self.assertEqual(self._provider_cache._hostnames,
+                             set(['new_host.test']))
+
+        self.assertEqual(self._provider_cache.stats()['stale_hits'], 1)
+
+    @patch('threading.Thread')
+    def test_refresh_cache_error(self, mock_thread):
+        """Test a refresh is started again after the Django cache fails."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=0,
+                           PROVIDERS_CACHE_MAX_STALE=600):
+            self._provider_cache.get(fetch)
+            self._provider_cache.get(fetch)
+            self.assertEqual(mock_thread.return_value.start.call_count, 1)
+
+            # Run the refresh, as the background thread would have,
+            # while the Django cache is unavailable.
+            with patch('api.utils.ProviderCache.cache') as mock_cache:
+                mock_cache.get.side_effect = IOError('Cache unavailable')
+                self.assertRaises(IOError,
+                                  self._provider_cache._refresh, fetch)
+
+            # The next request should start another refresh.
+            self._provider_cache.get(fetch)
+            self.assertEqual(mock_thread.return_value.start.call_count, 2)
+
+    def test_refresh_failure(self):
+        """Test a failed refresh does not empty the cache."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=0,
+                           PROVIDERS_CACHE_MAX_STALE=600):
+            self._provider_cache.get(fetch)
+
+            # Simulate the CMDB failing to respond as expected.
+            fetch.return_value = []
+            self.assertEqual(self._provider_cache._refresh(fetch),
+                             set(HOSTNAMES))
+
+        self.assertEqual(self._provider_cache.stats()['refresh_failures'], 1)
+
+    def test_refresh_failure_too_stale(self):
+        """Test hostnames past PROVIDERS_CACHE_MAX_STALE are not served."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=0,
+                           PROVIDERS_CACHE_MAX_STALE=0):
+            self._provider_cache.get(fetch)
+            time.sleep(0.01)
+
+            # Simulate the CMDB failing to respond at all.
+            fetch.side_effect = IOError
+            self.assertEqual(self._provider_cache.get(fetch), set())
+
+    def test_get_shared(self):
+        """Test hostnames fetched by another process are reused."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=600):
+            ProviderCache().get(fetch)
+            self.assertEqual(self._provider_cache.get(fetch),
+                             set(HOSTNAMES))
+
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_clear(self):
+        """Test the hostnames are fetched again once cleared."""
+        fetch = Mock(return_value=HOSTNAMES)
+
+        with self.settings(PROVIDERS_CACHE_TTL=600):
+            self._provider_cache.get(fetch)
+            self._provider_cache.clear()
+            self._provider_cache.get(fetch)
+
+        self.assertEqual(fetch.call_count, 2)
@@ -0,0 +1,54 @@
+"""This module tests the QueryResults class."""
+
+import unittest
+
+from django.core.paginator import Paginator
+from mock import Mock
+
+from api.utils.QueryResults import QueryResults
+
+
+class QueryResultsTest(unittest.TestCase):
+    """Tests the fetching of query results on demand."""
+
+    def test_paginate(self):
+        """Test a Paginator only fetches the rows of the requested page."""
+        cursor = Mock()
+        cursor.fetchone.return_value = {'count(*)': 25}
+        cursor.fetchall.return_value = [{'Day': 21}, {'Day': 22}]
+
+        results = QueryResults(cursor,
+                               'select Day from CloudSummaries '
+                               'where Year = %s',
+                               'select count(*) from CloudSummaries '
+                               'where Year = %s',
+                               [2016])
+
+        page = Paginator(results, 10).page(3)
+
+        self.assertEqual(page.object_list, [{'Day': 21}, {'Day': 22}])
+        self.assertEqual(page.paginator.count, 25)
+
+        # The count should be run once, and the query
+        # run for the third page of 10 rows only.
+        cursor.execute.assert_any_call('select count(*) from CloudSummaries '
+                                       'where Year = %s',
+                                       [2016])
+        cursor.execute.assert_called_with('select Day from CloudSummaries '
+                                          'where Year = %s '
+                                          'limit %s offset %s',
+                                          [2016, 5, 20])
+        self.assertEqual(cursor.execute.call_count, 2)
+
+    def test_empty(self):
+        """Test nothing but the count is run when there are no rows."""
+        cursor = Mock()
+        cursor.fetchone.return_value = (0,)
+
+        results = QueryResults(cursor, 'select Day from CloudSummaries',
+                               'select count(*) from CloudSummaries', [])
+
+        self.assertEqual(len(results), 0)
+        self.assertEqual(results[0:10], [])
+        self.assertRaises(IndexError, results.__getitem__, 0)
+        self.assertEqual(cursor.execute.call_count, 1)
@@ -0,0 +1,260 @@
+"""This module tests the Sender class of scripts/sender.py."""
+
+import imp
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from django.conf import settings
+from mock import Mock, patch
+
+# scripts is not a package, as sender.py is run as a script.
+sender = imp.load_source('sender',
+                         os.path.join(settings.BASE_DIR, 'scripts',
+                                      'sender.py'))
+
+
+def mock_response(status, headers=None, will_close=False):
+    """Return a mock HTTPResponse with status and headers."""
+    response = Mock()
+    response.status = status
+    response.reason = 'Test Reason'
+    response.will_close = will_close
+    response.getheader.side_effect = (headers or {}).get
+    return response
+
+
+class SenderTest(unittest.TestCase):
+    """Tests the sending of messages over a kept alive connection."""
+
+    def setUp(self):
+        """Create a Sender for an empty queue, and disable logging."""
+        logging.disable(logging.CRITICAL)
+        self._queue_path = tempfile.mkdtemp()
+        self._sender = sender.Sender('TestHost', self._queue_path,
+                                     'TestCert', 'TestKey', 'v1')
+
+        # Connections are mocked, and nothing waits for real.
+        self._patchers = [patch.object(sender.httplib, 'HTTPSConnection'),
+                          patch.object(sender.time, 'sleep')]
+        self._mock_connection, self._mock_sleep = [
+            patcher.start() for patcher in self._patchers]
+
+    def tearDown(self):
+        """Delete the test queue and re-enable logging."""
+        for patcher in self._patchers:
+            patcher.stop()
+        shutil.rmtree(self._queue_path)
+        logging.disable(logging.NOTSET)
+
+    def test_rest_send_reuses_connection(self):
+        """Test one connection is used for every request."""
+        conn = self._mock_connection.return_value
+        conn.getresponse.return_value = mock_response(202)
+
+        for _ in range(3):
+            self._sender._rest_send('POST', '/', 'TestData', {}, 202)
+
+        self.assertEqual(self._mock_connection.call_count, 1)
+        self.assertEqual(conn.request.call_count, 3)
+        self.assertFalse(conn.close.called)
+        self.assertFalse(self._mock_sleep.called)
+
+    def test_rest_send_reconnects_after_close(self):
+        """Test a connection the endpoint closes is not reused."""
+        conn = self._mock_connection.return_value
+        conn.getresponse.side_effect = [mock_response(202, will_close=True),
+                                        mock_response(202)]
+
+        for _ in range(2):
+            self._sender._rest_send('POST', '/', 'TestData', {}, 202)
+
+        self.assertEqual(conn.close.call_count, 1)
+        self.assertEqual(self._mock_connection.call_count, 2)
+
+    def test_rest_send_reconnects_after_error(self):
+        """Test a request that fails is retried over a new connection."""
+        conn = self._mock_connection.return_value
+        conn.request.side_effect = [socket.error('Connection reset'), None]
+        conn.getresponse.return_value = mock_response(202)
+
+        response = self._sender._rest_send('POST', '/', 'TestData', {}, 202)
+
+        self.assertEqual(response.status, 202)
+        self.assertEqual(conn.close.call_count, 1)
+        self.assertEqual(self._mock_connection.call_count, 2)
+        # Having waited before retrying.
+        self._mock_sleep.assert_called_once_with(1)
+
+    def test_rest_send_unresolvable(self):
+        """Test an endpoint that cannot be resolved is not retried."""
+        conn = self._mock_connection.return_value
+        conn.request.side_effect = socket.gaierror(-2, 'Name not known')
+
+        self.assertRaises(sender.SenderError, self._sender._rest_send,
+                          'POST', '/', 'TestData', {}, 202)
+        self.assertEqual(conn.request.call_count, 1)
+
+    def test_rest_send_retry_after(self):
+        """Test a busy endpoint's Retry-After is waited, then recovered."""
+        conn = self._mock_connection.return_value
+        conn.getresponse.side_effect = [
+            mock_response(429, {'Retry-After': '8'}),
+            mock_response(202),
+            mock_response(202),
+        ]
+
+        self._sender._rest_send('POST', '/', 'TestData', {}, 202)
+
+        # The retry waits as long as the endpoint asked...
+        self._mock_sleep.assert_called_once_with(8.0)
+        # ...and once accepted, requests speed back up.
+        self.assertEqual(self._sender._state.delay, 4.0)
+
+        self._sender._rest_send('POST', '/', 'TestData', {}, 202)
+        self._mock_sleep.assert_called_with(4.0)
+        self.assertEqual(self._sender._state.delay, 2.0)
+
+        # Until they are no longer delayed at all.
+        conn.getresponse.side_effect = None
+        conn.getresponse.return_value = mock_response(202)
+        for _ in range(5):
+            self._sender._rest_send('POST', '/', 'TestData', {}, 202)
+        self.assertEqual(self._sender._state.delay, 0)
+
+    def test_rest_send_busy(self):
+        """Test a busy endpoint is backed off from, then given up on."""
+        conn = self._mock_connection.return_value
+        conn.getresponse.side_effect = [
+            # An HTTP date, rather than seconds, is not used.
+            mock_response(503, {'Retry-After':
+                                'Fri, 31 Dec 1999 23:59:59 GMT'}),
+            mock_response(503),
+            # The wait is capped, however long the endpoint asks for.
+            mock_response(503, {'Retry-After': '3600'}),
+        ]
+
+        self.assertRaises(sender.SenderError, self._sender._rest_send,
+                          'POST', '/', 'TestData', {}, 202)
+
+        # The connection is given up on too.
+        self.assertTrue(conn.close.called)
+        self.assertEqual([call[0][0] for call in
+                          self._mock_sleep.call_args_list], [1, 2])
+        self.assertEqual(self._sender._state.delay, sender.Sender.MAX_DELAY)
+
+
+class SendAllTest(unittest.TestCase):
+    """Tests the sending of a queue of messages by several workers."""
+
+    def setUp(self):
+        """Create a Sender for a queue of messages, and disable logging."""
+        logging.disable(logging.CRITICAL)
+        self._queue_path = tempfile.mkdtemp()
+        self._messages = ['Test Message %s' % index for index in range(20)]
+
+        queue = sender.QueueSimple(self._queue_path)
+        for message in self._messages:
+            queue.add(message)
+
+        self._sender = sender.Sender('TestHost', self._queue_path,
+                                     'TestCert', 'TestKey', 'v1')
+
+        # The messages the endpoint rejects, and those it accepted.
+        self._failing = set()
+        self._accepted = []
+
+        self._patchers = [patch.object(sender.httplib, 'HTTPSConnection',
+                                       side_effect=self._connect),
+                          patch.object(sender.time, 'sleep')]
+        for patcher in self._patchers:
+            patcher.start()
+
+    def tearDown(self):
+        """Delete the test queue and re-enable logging."""
+        for patcher in self._patchers:
+            patcher.stop()
+        shutil.rmtree(self._queue_path)
+        logging.disable(logging.NOTSET)
+
+    def test_send_all(self):
+        """Test every message is sent, and removed, by the workers."""
+        self._send_all(workers=4)
+
+        self.assertEqual(sorted(self._accepted), sorted(self._messages))
+        self.assertEqual(self._remaining(), [])
+
+    def test_send_all_failures(self):
+        """Test messages are removed or unlocked after mixed failures."""
+        self._failing.update(self._messages[5:20:5])
+
+        self.assertRaises(sender.SenderError, self._send_all, workers=3)
+
+        # Every message is either sent and removed, or left to be sent by
+        # a later run, unlocked, but never both.
+        remaining = self._remaining()
+        self.assertEqual(sorted(self._accepted + remaining),
+                         sorted(self._messages))
+        for message in self._failing:
+            self.assertTrue(message in remaining)
+
+    def test_send_all_worker_error(self):
+        """Test a worker that cannot tidy up does not stop the run."""
+        with patch.object(sender.QueueSimple, 'remove',
+                          side_effect=OSError('Permission denied')):
+            self.assertRaises(sender.SenderError, self._send_all, workers=1)
+
+        # No message could be removed, but each was unlocked or sent.
+        self.assertEqual(sorted(self._remaining()), sorted(self._messages))
+
+    def _send_all(self, workers):
+        """Call send_all, failing the test if it does not return."""
+        result = []
+
+        def send_all():
+            """Send the messages, keeping any exception raised."""
+            try:
+                self._sender.send_all(workers)
+            except Exception as error:
+                result.append(error)
+
+        thread = threading.Thread(target=send_all)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), 'send_all did not return.')
+
+        if result:
+            raise result[0]
+
+    def _connect(self, *args, **kwargs):
+        """Return a mock connection to an endpoint rejecting _failing."""
+        conn = Mock()
+
+        def getresponse():
+            """Return the response to the last message sent."""
+            message = conn.request.call_args[0][2]
+            if message in self._failing:
+                return mock_response(500)
+
+            self._accepted.append(message)
+            return mock_response(202)
+
+        conn.getresponse.side_effect = getresponse
+        return conn
+
+    def _remaining(self):
+        """Return the messages left in the queue, unlocking each of them."""
+        queue = sender.QueueSimple(self._queue_path)
+        remaining = []
+        for name in queue:
+            # A message left locked would not be sent by a later run.
+            self.assertTrue(queue.lock(name), '%s left locked.' % name)
+            remaining.append(queue.get(name))
+            queue.unlock(name)
+
+        return remaining
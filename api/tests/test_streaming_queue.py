@@ -0,0 +1,66 @@
+"""This module tests the StreamingQueue class."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dirq.queue import Queue
+
+from api.utils.StreamingQueue import StreamingQueue
+
+QSCHEMA = {'body': 'string',
+           'signer': 'string',
+           'empaid': 'string?'}
+
+
+class StreamingQueueTest(unittest.TestCase):
+    """Tests the streaming of elements into a dirq Queue."""
+
+    def setUp(self):
+        """Create a directory for the test queue."""
+        self._queue_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Delete the test queue."""
+        shutil.rmtree(self._queue_path)
+
+    def test_add_stream(self):
+        """Test a streamed element can be read as any other element."""
+        queue = StreamingQueue(self._queue_path, schema=QSCHEMA)
+        name = queue.add_stream({'signer': 'TestDN', 'empaid': 'TestID'},
+                                'body', iter(['APEL-cloud', '-message']))
+
+        # Read the element back with an ordinary Queue, as the loader would.
+        queue = Queue(self._queue_path, schema=QSCHEMA)
+        self.assertEqual(queue.count(), 1)
+        self.assertTrue(queue.lock(name))
+        self.assertEqual(queue.get(name),
+                         {'body': 'APEL-cloud-message',
+                          'signer': 'TestDN',
+                          'empaid': 'TestID'})
+
+    def test_add_stream_unicode(self):
+        """Test unicode chunks of a string field are saved as UTF-8."""
+        queue = StreamingQueue(self._queue_path, schema=QSCHEMA)
+        name = queue.add_stream({'signer': 'TestDN'},
+                                'body', [u'VMUUID: caf\xe9'])
+
+        queue = Queue(self._queue_path, schema=QSCHEMA)
+        self.assertTrue(queue.lock(name))
+        self.assertEqual(queue.get(name)['body'], u'VMUUID: caf\xe9')
+
+    def test_add_stream_failure(self):
+        """Test no element is left behind if the chunks cannot be read."""
+        def chunks():
+            """Yield a chunk, then fail as a too large body would."""
+            yield 'APEL-cloud'
+            raise ValueError('Body is too large.')
+
+        queue = StreamingQueue(self._queue_path, schema=QSCHEMA)
+        self.assertRaises(ValueError, queue.add_stream,
+                          {'signer': 'TestDN'}, 'body', chunks())
+
+        self.assertEqual(queue.count(), 0)
+        self.assertEqual(os.listdir(os.path.join(self._queue_path,
+                                                 'temporary')), [])
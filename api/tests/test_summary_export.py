@@ -0,0 +1,95 @@
+"""This module tests the SummaryExport class."""
+
+import logging
+import unittest
+
+import MySQLdb
+from mock import Mock
+
+from api.utils.SummaryExport import SummaryExport
+
+QUERY = 'select VOGroup, Day from VCloudSummaries where VOGroup = %s'
+
+ROWS = [{'VOGroup': u'/TEST1', 'Day': 26},
+        {'VOGroup': u'/TEST,2', 'Day': None},
+        {'VOGroup': u'/TEST3', 'Day': 28}]
+
+
+class SummaryExportTest(unittest.TestCase):
+    """Tests the streaming of query results as NDJSON or CSV."""
+
+    def setUp(self):
+        """Mock a pool of connections and disable logging."""
+        logging.disable(logging.CRITICAL)
+        self._cursor = Mock()
+        self._cursor.fetchmany.side_effect = [ROWS[:2], ROWS[2:], []]
+        self._pool = Mock()
+        self._pool.acquire.return_value.cursor.return_value = self._cursor
+
+    def tearDown(self):
+        """Re-enable logging."""
+        logging.disable(logging.NOTSET)
+
+    def test_ndjson(self):
+        """Test rows are streamed as one JSON object per line."""
+        export = self._export('ndjson')
+
+        self.assertEqual(list(export),
+                         ['{"VOGroup":"/TEST1","Day":26}\n'
+                          '{"VOGroup":"/TEST,2","Day":null}\n',
+                          '{"VOGroup":"/TEST3","Day":28}\n'])
+
+        # The query should be run once, with a server-side cursor.
+        self._pool.acquire.return_value.cursor.assert_called_once_with(
+            MySQLdb.cursors.SSDictCursor)
+        self._cursor.execute.assert_called_once_with(QUERY, ['/TEST1'])
+        self._cursor.fetchmany.assert_called_with(2)
+
+    def test_csv(self):
+        """Test rows are streamed as CSV, after a header row."""
+        export = self._export('csv')
+
+        self.assertEqual(''.join(export),
+                         'VOGroup,Day\r\n'
+                         '/TEST1,26\r\n'
+                         '"/TEST,2",\r\n'
+                         '/TEST3,28\r\n')
+
+    def test_close(self):
+        """Test the connection is only reused once every row is read."""
+        export = self._export('ndjson')
+        list(export)
+        export.close()
+        self._pool.release.assert_called_once_with(
+            self._pool.acquire.return_value, discard=False)
+
+        # An export abandoned part way through
+        # should have its connection closed.
+        self.setUp()
+        export = self._export('ndjson')
+        next(iter(export))
+        export.close()
+        self._pool.release.assert_called_once_with(
+            self._pool.acquire.return_value, discard=True)
+
+        # Closing an export more than once has no further effect.
+        export.close()
+        self.assertEqual(self._pool.release.call_count, 1)
+
+    def test_query_error(self):
+        """Test the connection is discarded if the query fails."""
+        self._cursor.execute.side_effect = MySQLdb.OperationalError
+
+        self.assertRaises(MySQLdb.OperationalError, self._export, 'ndjson')
+        self._pool.release.assert_called_once_with(
+            self._pool.acquire.return_value, discard=True)
+
+    def test_unsupported_output(self):
+        """Test an unsupported output is rejected before querying."""
+        self.assertRaises(ValueError, self._export, 'xml')
+        self.assertFalse(self._pool.acquire.called)
+
+    def _export(self, output):
+        """Return a SummaryExport of ROWS, two rows at a time."""
+        return SummaryExport(self._pool, QUERY, ['/TEST1'],
+                             ['VOGroup', 'Day'], output, 2)
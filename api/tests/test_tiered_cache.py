@@ -0,0 +1,75 @@
+"""This module tests the TieredCache class."""
+
+import logging
+import time
+import unittest
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from api.utils.TieredCache import TieredCache
+
+
+class TieredCacheTest(unittest.TestCase):
+    """Tests the local and shared tiers of a TieredCache."""
+
+    def setUp(self):
+        """Create two TieredCaches sharing a cache, and disable logging."""
+        logging.disable(logging.CRITICAL)
+        self._shared = LocMemCache('shared', {})
+        self._shared.clear()
+        self._cache = self._tiered_cache()
+        self._other_cache = self._tiered_cache()
+
+    def tearDown(self):
+        """Re-enable logging."""
+        logging.disable(logging.NOTSET)
+
+    def test_get_shared(self):
+        """Test an entry set by one process can be read by another."""
+        self._cache.set('key', 'value', 60)
+        self.assertEqual(self._other_cache.get('key'), 'value')
+
+        # Once read, the entry should be served from the local tier.
+        self._shared.clear()
+        self.assertEqual(self._other_cache.get('key'), 'value')
+        self.assertEqual(self._other_cache.get('missing', 'default'),
+                         'default')
+
+    def test_delete(self):
+        """Test a deleted entry is removed from both tiers."""
+        self._cache.set('key', 'value', 60)
+        self._cache.delete('key')
+
+        self.assertEqual(self._cache.get('key'), None)
+        self.assertEqual(self._other_cache.get('key'), None)
+
+    def test_add(self):
+        """Test only one process can add a given key."""
+        self.assertTrue(self._cache.add('key', 'value', 60))
+        self.assertFalse(self._other_cache.add('key', 'other', 60))
+        self.assertEqual(self._other_cache.get('key'), 'value')
+
+    def test_expiry(self):
+        """Test an entry is not served, by either tier, once expired."""
+        self._cache.set('key', 'value', 1)
+        self.assertEqual(self._cache.get('key'), 'value')
+        self.assertEqual(self._other_cache.get('key'), 'value')
+
+        time.sleep(1.1)
+        self.assertEqual(self._cache.get('key'), None)
+        self.assertEqual(self._other_cache.get('key'), None)
+
+    def test_local_timeout(self):
+        """Test a change by another process is seen after LOCAL_TIMEOUT."""
+        self._cache = self._tiered_cache(local_timeout=0)
+        self._cache.set('key', 'value', 60)
+        self._other_cache.set('key', 'other', 60)
+
+        self.assertEqual(self._cache.get('key'), 'other')
+
+    def _tiered_cache(self, local_timeout=30):
+        """Return a TieredCache, with its own local tier, over _shared."""
+        cache = TieredCache('', {'OPTIONS': {'LOCAL_TIMEOUT': local_timeout}})
+        cache._local_cache = LocMemCache('local-%s' % id(cache), {})
+        cache._shared_cache = self._shared
+        return cache
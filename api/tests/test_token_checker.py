@@ -1,25 +1,30 @@
 """This module tests the JSON Web Token validation."""
 
+import hashlib
+import json
 import logging
 import time
 
 from jose import jwt
+from django.core.cache import cache
 from django.test import TestCase
-from mock import patch
+from mock import Mock, patch
 
-from api.utils.TokenChecker import TokenChecker
+from api.utils.TokenChecker import IntrospectionError, TokenChecker
 
 
 class TokenCheckerTest(TestCase):
     """Tests the JSON Web Token validation."""
 
     def setUp(self):
-        """Create a new TokenChecker and disable logging."""
+        """Create a new TokenChecker, empty the cache and disable logging."""
         self._token_checker = TokenChecker()
+        cache.clear()
         logging.disable(logging.CRITICAL)
 
     def tearDown(self):
-        """Re-enable logging."""
+        """Forget the background introspection queue and enable logging."""
+        TokenChecker._introspection_queue = None
         logging.disable(logging.NOTSET)
 
     @patch.object(TokenChecker, '_get_issuer_public_key')
@@ -102,6 +107,192 @@ class TokenCheckerTest(TestCase):
                 "Token with payload %s should not be accepted!" % payload2
             )
 
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    @patch.object(TokenChecker, '_check_token_not_revoked')
+    def test_token_cache_per_token(self, mock_check_token_not_revoked,
+                                   mock_get_issuer_public_key):
+        """Check each of a subject's tokens is only introspected once."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        mock_check_token_not_revoked.return_value = CLIENT_ID
+
+        payload1 = self._standard_token()
+        payload2 = self._standard_token()
+        payload2['jti'] = 'a0f9e8a1-7a5e-4b43-9d4b-3a6b1b1c2d3e'
+
+        token1 = self._create_token(payload1, PRIVATE_KEY)
+        token2 = self._create_token(payload2, PRIVATE_KEY)
+
+        with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                           TOKEN_CACHE_TIMEOUT=300):
+            # Alternate between the subject's two tokens.
+            for token in (token1, token2, token1, token2):
+                self.assertEqual(
+                    self._token_checker.valid_token_to_id(token), CLIENT_ID)
+
+        self.assertEqual(mock_check_token_not_revoked.call_count, 2)
+
+        # The tokens themselves should not be kept in the cache.
+        cache_key = 'token:%s' % hashlib.sha256(token1).hexdigest()
+        self.assertEqual(cache.get(cache_key), CLIENT_ID)
+
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    @patch.object(TokenChecker, '_check_token_not_revoked')
+    def test_token_cache_rejected(self, mock_check_token_not_revoked,
+                                  mock_get_issuer_public_key):
+        """Check a rejected token is not introspected again straight away."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        # Simulate the IAM saying the token has been revoked.
+        mock_check_token_not_revoked.return_value = None
+
+        token = self._create_token(self._standard_token(), PRIVATE_KEY)
+
+        with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                           TOKEN_REJECTED_CACHE_TIMEOUT=30):
+            for _ in range(3):
+                self.assertEqual(
+                    self._token_checker.valid_token_to_id(token), None)
+
+        self.assertEqual(mock_check_token_not_revoked.call_count, 1)
+
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    @patch.object(TokenChecker, '_check_token_not_revoked')
+    def test_token_cache_expiry(self, mock_check_token_not_revoked,
+                                mock_get_issuer_public_key):
+        """Check a token is not cached beyond when it expires."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        mock_check_token_not_revoked.return_value = CLIENT_ID
+
+        payload = self._standard_token()
+        payload['exp'] = int(time.time()) + 60
+        token = self._create_token(payload, PRIVATE_KEY)
+
+        with patch('api.utils.TokenChecker.cache') as mock_cache:
+            mock_cache.get.return_value = None
+            with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                               TOKEN_CACHE_TIMEOUT=300):
+                self._token_checker.valid_token_to_id(token)
+
+        _, _, timeout = mock_cache.set.call_args[0]
+        self.assertTrue(0 < timeout <= 60)
+
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    @patch.object(TokenChecker, '_check_token_not_revoked')
+    def test_local_verification_policy(self, mock_check_token_not_revoked,
+                                       mock_get_issuer_public_key):
+        """Check only tokens older than the window are introspected."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        mock_check_token_not_revoked.return_value = CLIENT_ID
+
+        new_payload = self._standard_token()
+        new_payload['iat'] = int(time.time()) - 10
+        new_token = self._create_token(new_payload, PRIVATE_KEY)
+        old_token = self._create_token(self._standard_token(), PRIVATE_KEY)
+
+        skipped = TokenChecker.stats()['introspections_skipped']
+
+        with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                           TOKEN_VERIFICATION_POLICY='local',
+                           TOKEN_REVOCATION_WINDOW=300):
+            self.assertEqual(
+                self._token_checker.valid_token_to_id(new_token), CLIENT_ID)
+            self.assertFalse(mock_check_token_not_revoked.called)
+
+            self.assertEqual(
+                self._token_checker.valid_token_to_id(old_token), CLIENT_ID)
+            self.assertEqual(mock_check_token_not_revoked.call_count, 1)
+
+        self.assertEqual(TokenChecker.stats()['introspections_skipped'],
+                         skipped + 1)
+
+    @patch('threading.Thread')
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    @patch.object(TokenChecker, '_introspect_token')
+    def test_async_verification_policy(self, mock_introspect_token,
+                                       mock_get_issuer_public_key,
+                                       mock_thread):
+        """Check a token is accepted, then rejected once found revoked."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        # Simulate the IAM saying the token has been revoked.
+        mock_introspect_token.return_value = None
+
+        token = self._create_token(self._standard_token(), PRIVATE_KEY)
+
+        with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                           TOKEN_VERIFICATION_POLICY='async',
+                           TOKEN_INTROSPECTION_WORKERS=2,
+                           TOKEN_REJECTED_CACHE_TIMEOUT=30):
+            # The token is accepted without waiting for the IAM...
+            self.assertEqual(
+                self._token_checker.valid_token_to_id(token), CLIENT_ID)
+            self.assertFalse(mock_introspect_token.called)
+
+            # ...which is asked in the background, by a fixed pool.
+            self.assertEqual(mock_thread.call_count, 2)
+            self.assertEqual(mock_thread.return_value.start.call_count, 2)
+            args = TokenChecker._introspection_queue.get_nowait()
+            with patch('api.utils.TokenChecker.cache') as mock_cache:
+                self._token_checker._introspect_in_background(*args)
+
+            # The token is rejected for as long as any other rejection.
+            cache_key, value, timeout = mock_cache.set.call_args[0]
+            self.assertEqual((value, timeout), ('', 30))
+
+            # From then on, the token is rejected.
+            self._token_checker._introspect_in_background(*args)
+            self.assertEqual(
+                self._token_checker.valid_token_to_id(token), None)
+
+    @patch('threading.Thread')
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    @patch.object(TokenChecker, '_introspect_token')
+    def test_async_introspection_error(self, mock_introspect_token,
+                                       mock_get_issuer_public_key,
+                                       mock_thread):
+        """Check a token is not rejected if its IAM cannot be reached."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        mock_introspect_token.side_effect = IntrospectionError('Timed out')
+
+        token = self._create_token(self._standard_token(), PRIVATE_KEY)
+
+        with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                           TOKEN_VERIFICATION_POLICY='async'):
+            self.assertEqual(
+                self._token_checker.valid_token_to_id(token), CLIENT_ID)
+
+            args = TokenChecker._introspection_queue.get_nowait()
+            self._token_checker._introspect_in_background(*args)
+            self.assertTrue(mock_introspect_token.called)
+
+            # The token is still accepted.
+            self.assertEqual(
+                self._token_checker.valid_token_to_id(token), CLIENT_ID)
+
+    @patch('threading.Thread')
+    @patch.object(TokenChecker, '_get_issuer_public_key')
+    def test_async_introspection_queue_full(self, mock_get_issuer_public_key,
+                                            mock_thread):
+        """Check tokens are not queued for introspection without limit."""
+        mock_get_issuer_public_key.return_value = PUBLIC_KEY
+        dropped = TokenChecker.stats()['introspections_dropped']
+
+        with self.settings(IAM_HOSTNAME_LIST=['iam-test.idc.eu'],
+                           TOKEN_VERIFICATION_POLICY='async',
+                           TOKEN_INTROSPECTION_WORKERS=1,
+                           TOKEN_INTROSPECTION_QUEUE_SIZE=2):
+            for index in range(3):
+                payload = self._standard_token()
+                payload['jti'] = str(index)
+                token = self._create_token(payload, PRIVATE_KEY)
+                # Every token is accepted, introspected or not.
+                self.assertEqual(
+                    self._token_checker.valid_token_to_id(token), CLIENT_ID)
+
+        # Only one worker is started, however many tokens are queued.
+        self.assertEqual(mock_thread.call_count, 1)
+        self.assertEqual(TokenChecker._introspection_queue.qsize(), 2)
+        self.assertEqual(TokenChecker.stats()['introspections_dropped'],
+                         dropped + 1)
+
     @patch.object(TokenChecker, '_get_issuer_public_key')
     @patch.object(TokenChecker, '_check_token_not_revoked')
     def test_valid_token(self, mock_check_token_not_revoked,
@@ -303,6 +494,91 @@ class TokenCheckerTest(TestCase):
                                               'http://idc.org')
         )
 
+    @patch('urllib2.urlopen')
+    def test_get_issuer_public_key_cache(self, mock_urlopen):
+        """Check the IAM public key is only fetched once while cached."""
+        mock_urlopen.return_value = self._key_response(
+            PUBLIC_KEY, {'Cache-Control': 'max-age=600'})
+
+        for _ in range(2):
+            self.assertEqual(
+                self._token_checker._get_issuer_public_key(
+                    'https://iam-test.idc.eu/'),
+                PUBLIC_KEY
+            )
+
+        self.assertEqual(mock_urlopen.call_count, 1)
+
+        # A response that must not be stored is not cached.
+        cache.clear()
+        mock_urlopen.return_value = self._key_response(
+            PUBLIC_KEY, {'Cache-Control': 'no-store'})
+
+        for _ in range(2):
+            self._token_checker._get_issuer_public_key(
+                'https://iam-test.idc.eu/')
+
+        self.assertEqual(mock_urlopen.call_count, 3)
+
+    @patch('urllib2.urlopen')
+    def test_unknown_key_refresh(self, mock_urlopen):
+        """Check the cached IAM public key is refreshed for a new 'kid'."""
+        old_key = {'keys': [dict(PUBLIC_KEY['keys'][0], kid='old')]}
+        new_key = {'keys': [dict(PUBLIC_KEY['keys'][0], kid='new')]}
+        mock_urlopen.return_value = self._key_response(new_key, {})
+
+        cache.set('jwk:https://iam-test.idc.eu/', old_key, 600)
+
+        token = jwt.encode(self._standard_token(), PRIVATE_KEY,
+                           algorithm='RS256', headers={'kid': 'new'})
+
+        self.assertTrue(
+            self._token_checker._verify_token(token,
+                                              'https://iam-test.idc.eu/')
+        )
+        self.assertEqual(mock_urlopen.call_count, 1)
+
+        # A second refresh straight away is not allowed.
+        cache.set('jwk:https://iam-test.idc.eu/', old_key, 600)
+        self._token_checker._verify_token(token, 'https://iam-test.idc.eu/')
+        self.assertEqual(mock_urlopen.call_count, 1)
+
+    def test_key_cache_timeout(self):
+        """Check the IAM public key lifetime is read from its headers."""
+        header_list = [
+            # No caching headers, so use the default
+            ({}, 3600),
+            # max-age, less the time already spent in other caches
+            ({'Cache-Control': 'public, max-age=600', 'Age': '100'}, 500),
+            # s-maxage takes precedence over max-age
+            ({'Cache-Control': 'max-age=600, s-maxage=60'}, 60),
+            # The response should not be reused
+            ({'Cache-Control': 'no-cache'}, 0),
+            # Expires, relative to the response's Date
+            ({'Date': 'Sun, 06 Nov 1994 08:49:37 GMT',
+              'Expires': 'Sun, 06 Nov 1994 08:59:37 GMT'}, 600),
+            # Lifetimes are capped at JWK_CACHE_MAX_TIMEOUT
+            ({'Cache-Control': 'max-age=31536000'}, 86400),
+        ]
+
+        with self.settings(JWK_CACHE_TIMEOUT=3600,
+                           JWK_CACHE_MAX_TIMEOUT=86400):
+            for headers, expected_timeout in header_list:
+                self.assertEqual(
+                    self._token_checker._key_cache_timeout(
+                        self._key_response(PUBLIC_KEY, headers).info()),
+                    expected_timeout,
+                    "Headers %s should be cached for %s seconds!" %
+                    (headers, expected_timeout)
+                )
+
+    def _key_response(self, key_json, headers):
+        """Return a mock IAM response, for key_json, with headers."""
+        response = Mock()
+        response.read.return_value = json.dumps(key_json)
+        response.info.return_value.getheader.side_effect = headers.get
+        return response
+
     def _create_token(self, payload, key):
         """Return a token, signed by key, correspond to the payload."""
         return jwt.encode(payload, key, algorithm='RS256')
@@ -0,0 +1,143 @@
+"""This module contains the ContentDecoder class."""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is optional, and only supported if zstandard is installed.
+    zstandard = None
+
+
+class ContentDecoderError(Exception):
+    """Raised when a request body cannot be decoded."""
+
+
+class UnsupportedEncodingError(ContentDecoderError):
+    """Raised when a request body has an unsupported Content-Encoding."""
+
+
+class ContentTooLargeError(ContentDecoderError):
+    """Raised when a request body decodes to more than the maximum size."""
+
+
+class _ChunkReader(object):
+    """A file-like object that reads from an iterable of chunks."""
+
+    def __init__(self, chunks):
+        """Initialize a new _ChunkReader."""
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        """Return up to size bytes, or what is left if size is negative."""
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class ContentDecoder(object):
+    """
+    Decode request bodies compressed with a Content-Encoding.
+
+    Bodies are decoded a chunk, of at most CHUNK_SIZE bytes, at a time and
+    never beyond max_size bytes in total, so a small, highly compressed,
+    body cannot be used to exhaust memory.
+    """
+
+    # The most (in bytes) that is decoded at a time.
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, max_size):
+        """Initialize a new ContentDecoder."""
+        self._max_size = max_size
+
+    def encodings(self):
+        """Return the list of supported Content-Encodings."""
+        encodings = ['identity', 'gzip']
+        if zstandard is not None:
+            encodings.append('zstd')
+        return encodings
+
+    def decode(self, encoding, data):
+        """Return data, decoded from the given Content-Encoding."""
+        return ''.join(self.decode_stream(encoding, [data]))
+
+    def decode_stream(self, encoding, chunks):
+        """
+        Return an iterator over chunks, decoded from the given encoding.
+
+        An unsupported encoding is rejected straight away, whereas invalid
+        or oversized data is only found, and raised, during iteration.
+        """
+        encoding = (encoding or 'identity').strip().lower()
+        if encoding not in self.encodings():
+            raise UnsupportedEncodingError(
+                'Unsupported Content-Encoding: %s' % encoding)
+
+        if encoding == 'gzip':
+            decoded = self._decode_gzip(chunks)
+        elif encoding == 'zstd':
+            decoded = self._decode_zstd(chunks)
+        else:
+            decoded = chunks
+
+        return self._limit(decoded)
+
+    def _limit(self, chunks):
+        """Yield chunks, until they add up to more than max_size bytes."""
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if size > self._max_size:
+                raise ContentTooLargeError(
+                    'Body is larger than %s bytes.' % self._max_size)
+            yield chunk
+
+    def _decode_gzip(self, chunks):
+        """Yield gzip compressed chunks, decompressed."""
+        # Adding 16 to wbits expects a gzip, rather than zlib, header.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            for chunk in chunks:
+                while chunk:
+                    yield decompressor.decompress(chunk, self.CHUNK_SIZE)
+                    # Whatever could not be decompressed
+                    # within CHUNK_SIZE is fed in again.
+                    chunk = decompressor.unconsumed_tail
+
+                # Only data after the end of the stream is left unused.
+                if decompressor.unused_data:
+                    raise ContentDecoderError(
+                        'Body has data after the end of its gzip stream.')
+
+            # A byte fed in after a complete stream is left unused, so if
+            # it is not, the body ended before its gzip stream did.
+            data = decompressor.decompress('\0')
+            if not decompressor.unused_data:
+                raise ContentDecoderError(
+                    'Body ended before the end of its gzip stream.')
+            yield data
+        except zlib.error as error:
+            raise ContentDecoderError('Could not decompress body: %s' % error)
+
+    def _decode_zstd(self, chunks):
+        """Yield zstd compressed chunks, decompressed."""
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            _ChunkReader(chunks))
+        try:
+            while True:
+                chunk = reader.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        except zstandard.ZstdError as error:
+            raise ContentDecoderError('Could not decompress body: %s' % error)
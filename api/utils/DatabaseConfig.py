@@ -0,0 +1,78 @@
+"""This module contains the DatabaseConfig class."""
+
+import ConfigParser
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+
+class DatabaseConfig(object):
+    """
+    The database configuration held in settings.CLOUD_DB_CONF.
+
+    The file is parsed once and then only re-parsed when its modification
+    time changes, so credentials can be rotated without a restart while
+    requests avoid reading the file from disk.
+    """
+
+    def __init__(self):
+        """Initialize a new DatabaseConfig, that has yet to be read."""
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._path = None
+        self._mtime = None
+        self._config = None
+
+    def get(self):
+        """
+        Return the database configuration.
+
+        The configuration is returned as a dictionary of keyword arguments
+        for MySQLdb.connect.
+        """
+        path = settings.CLOUD_DB_CONF
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # A missing file is read as such, and re-read once it appears.
+            mtime = None
+
+        with self._lock:
+            if (self._config is None or
+                    path != self._path or
+                    mtime != self._mtime):
+                self._config = self._read(path)
+                self._path = path
+                self._mtime = mtime
+
+            return self._config
+
+    def _read(self, path):
+        """Parse the configuration file at path."""
+        self.logger.info('Reading database configuration from %s', path)
+        try:
+            dbcp = ConfigParser.ConfigParser()
+            dbcp.read(path)
+
+            db_hostname = dbcp.get('db', 'hostname')
+            # db_port = int(dbcp.get('db', 'port'))
+            db_name = dbcp.get('db', 'name')
+            db_username = dbcp.get('db', 'username')
+            db_password = dbcp.get('db', 'password')
+        except (ConfigParser.Error, ValueError, IOError) as err:
+            self.logger.warning('Error in configuration file %s: %s',
+                                path,
+                                err)
+            self.logger.warning('Using default configuration.')
+
+            db_hostname = 'localhost'
+            db_name = 'apel_rest'
+            db_username = 'root'
+            db_password = ''
+
+        return {'host': db_hostname,
+                'user': db_username,
+                'passwd': db_password,
+                'db': db_name}
@@ -0,0 +1,218 @@
+"""This module contains the DatabasePool class."""
+
+import contextlib
+import logging
+import threading
+import time
+
+import MySQLdb
+from django.conf import settings
+
+
+class DatabasePoolError(Exception):
+    """Raised when a connection cannot be borrowed from a DatabasePool."""
+
+
+class DatabasePool(object):
+    """
+    A bounded, thread safe pool of persistent MySQL connections.
+
+    Connections are created lazily, up to size, and handed back to the
+    pool once a request is done with them. Borrowed connections are
+    checked with a ping if they have been idle for longer than
+    ping_interval, and any that fail the check are replaced. Idle
+    connections older than max_idle are closed rather than reused.
+    """
+
+    def __init__(self, connect_kwargs, size, timeout, max_idle,
+                 ping_interval):
+        """Initialize a new, empty, DatabasePool."""
+        self.logger = logging.getLogger(__name__)
+        self._connect_kwargs = connect_kwargs
+        self._size = size
+        self._timeout = timeout
+        self._max_idle = max_idle
+        self._ping_interval = ping_interval
+
+        self._condition = threading.Condition()
+        # Idle connections, as (connection, time returned) pairs,
+        # with the most recently returned connection last.
+        self._idle = []
+        self._in_use = 0
+        self._closed = False
+
+        # Counters reported by stats()
+        self._created = 0
+        self._evicted = 0
+        self._borrowed = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def acquire(self):
+        """
+        Borrow a connection from the pool.
+
+        Blocks for up to the pool timeout if every connection is in use,
+        raising DatabasePoolError if none becomes free in that time.
+        """
+        start = time.time()
+        with self._condition:
+            self._evict_idle()
+            if not self._idle and self._in_use >= self._size:
+                self._waits += 1
+            while not self._idle and self._in_use >= self._size:
+                remaining = self._timeout - (time.time() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise DatabasePoolError('No database connection became '
+                                            'free within %s seconds.' %
+                                            self._timeout)
+                self._condition.wait(remaining)
+
+            wait_time = time.time() - start
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            self._borrowed += 1
+            self._in_use += 1
+
+            if self._idle:
+                connection, returned_at = self._idle.pop()
+            else:
+                connection, returned_at = None, None
+
+        try:
+            if (connection is not None and
+                    time.time() - returned_at >= self._ping_interval and
+                    not self._is_healthy(connection)):
+                self.logger.info('Replacing unhealthy database connection.')
+                self._close(connection)
+                connection = None
+
+            if connection is None:
+                connection = MySQLdb.connect(**self._connect_kwargs)
+                with self._condition:
+                    self._created += 1
+        except Exception:
+            # Give the slot back, as no connection has been handed out.
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return connection
+
+    def release(self, connection, discard=False):
+        """
+        Return a borrowed connection to the pool.
+
+        The connection is closed instead if discard is True, if the pool
+        has since been closed, or if its transaction cannot be ended.
+        """
+        if not discard:
+            try:
+                # End any open transaction so the next borrower does not
+                # read from a stale snapshot.
+                connection.rollback()
+            except MySQLdb.Error as error:
+                self.logger.warning('Discarding database connection: %s',
+                                    error)
+                discard = True
+
+        with self._condition:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._close(connection)
+            else:
+                self._idle.append((connection, time.time()))
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block.
+
+        The connection is discarded, rather than returned to the pool,
+        if the block raises an exception.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except Exception:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def close(self):
+        """Close idle connections, and any in use ones once released."""
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+    def stats(self):
+        """Return a dictionary of pool occupancy and wait time metrics."""
+        with self._condition:
+            return {'size': self._size,
+                    'in_use': self._in_use,
+                    'idle': len(self._idle),
+                    'created': self._created,
+                    'evicted': self._evicted,
+                    'borrowed': self._borrowed,
+                    'waits': self._waits,
+                    'timeouts': self._timeouts,
+                    'total_wait_time': self._wait_time,
+                    'max_wait_time': self._max_wait_time}
+
+    def _evict_idle(self):
+        """Close idle connections unused for longer than max_idle."""
+        now = time.time()
+        # self._idle is ordered by return time, so stale
+        # connections are always at the start of the list.
+        while self._idle and now - self._idle[0][1] > self._max_idle:
+            self._close(self._idle.pop(0)[0])
+            self._evicted += 1
+
+    def _is_healthy(self, connection):
+        """Return True if the server still answers on connection."""
+        try:
+            connection.ping()
+        except MySQLdb.Error:
+            return False
+        return True
+
+    def _close(self, connection):
+        """Close connection, ignoring errors from already dead ones."""
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+
+# The process wide pool, shared by every request handled by this process.
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool(**connect_kwargs):
+    """
+    Return the process wide DatabasePool for connect_kwargs.
+
+    A new pool replaces the current one if the connection arguments change,
+    for example after database credentials have been rotated.
+    """
+    global _POOL
+
+    with _POOL_LOCK:
+        if _POOL is None or _POOL._connect_kwargs != connect_kwargs:
+            if _POOL is not None:
+                _POOL.close()
+
+            _POOL = DatabasePool(connect_kwargs,
+                                 settings.DB_POOL_SIZE,
+                                 settings.DB_POOL_TIMEOUT,
+                                 settings.DB_POOL_MAX_IDLE,
+                                 settings.DB_POOL_PING_INTERVAL)
+
+        return _POOL
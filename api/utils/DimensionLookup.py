@@ -0,0 +1,50 @@
+"""This module contains the DimensionLookup class."""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class DimensionLookup(object):
+    """
+    Look up the IDs of names in the dimension tables, i.e. Sites.
+
+    IDs never change once assigned, so are cached for
+    settings.DIMENSION_CACHE_TIMEOUT seconds. Names that are not found are
+    cached for settings.SUMMARY_CACHE_CHECK_INTERVAL seconds, as new names
+    only matter once summaries using them have been added.
+    """
+
+    # The dimension tables names can be looked up in.
+    TABLES = ('DNs', 'Sites', 'VOGroups')
+
+    def get_id(self, pool, table, name):
+        """Return the ID of name in table, or None if it is not there."""
+        # Only known table names are used, as the table
+        # name cannot be passed to MySQL as a parameter.
+        if table not in self.TABLES:
+            raise ValueError('Unknown dimension table: %s' % table)
+
+        # Names are hashed, as they can be longer than a cache key can be.
+        cache_key = 'dimension:%s:%s' % (
+            table, hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+        # The ID is cached in a list, as a cached None means a miss.
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached[0]
+
+        with pool.connection() as database:
+            cursor = database.cursor()
+            cursor.execute('select id from %s where name = %%s' % table,
+                           [name])
+            row = cursor.fetchone()
+
+        if row is None:
+            cache.set(cache_key, [None],
+                      settings.SUMMARY_CACHE_CHECK_INTERVAL)
+            return None
+
+        cache.set(cache_key, [row[0]], settings.DIMENSION_CACHE_TIMEOUT)
+        return row[0]
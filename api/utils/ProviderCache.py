@@ -0,0 +1,155 @@
+"""This module contains the ProviderCache class."""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class ProviderCache(object):
+    """
+    A time limited cache of registered Resource Provider hostnames.
+
+    Hostnames are held as a set, for constant time lookups. Once the cached
+    set is older than settings.PROVIDERS_CACHE_TTL it is still served, for
+    up to settings.PROVIDERS_CACHE_MAX_STALE seconds more, while it is
+    refreshed in the background. If that refresh fails, the stale set
+    continues to be served, so a CMDB outage does not block submissions.
+
+    The hostnames are also stored in the Django cache, so that when that
+    cache is shared, they are only fetched once for every process using it.
+    """
+
+    # The Django cache key the hostnames are shared under.
+    CACHE_KEY = 'providers'
+
+    # How long (in seconds) to wait before retrying a failed refresh.
+    RETRY_INTERVAL = 60
+
+    def __init__(self):
+        """Initialize a new, empty, ProviderCache."""
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._hostnames = None
+        self._fetched_at = None
+        self._failed_at = None
+        self._refreshing = False
+
+        # Counters reported by stats()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._refresh_failures = 0
+
+    def get(self, fetch):
+        """
+        Return the set of Resource Provider hostnames.
+
+        fetch is called, with no arguments, to retrieve a list of hostnames
+        when the cache is empty or out of date.
+        """
+        now = time.time()
+        with self._lock:
+            if self._hostnames is not None:
+                age = now - self._fetched_at
+                if age < settings.PROVIDERS_CACHE_TTL:
+                    self._hits += 1
+                    return self._hostnames
+
+                if age < (settings.PROVIDERS_CACHE_TTL +
+                          settings.PROVIDERS_CACHE_MAX_STALE):
+                    self._stale_hits += 1
+                    if self._should_refresh(now):
+                        self._refreshing = True
+                        refresh_thread = threading.Thread(
+                            target=self._refresh, args=(fetch,))
+                        refresh_thread.daemon = True
+                        refresh_thread.start()
+                    return self._hostnames
+
+            self._misses += 1
+
+        # The cache is empty, or too old to be served, so the
+        # hostnames have to be fetched before we can return.
+        return self._refresh(fetch)
+
+    def clear(self):
+        """Empty the cache, including the copy in the Django cache."""
+        with self._lock:
+            self._hostnames = None
+            self._fetched_at = None
+            self._failed_at = None
+        cache.delete(self.CACHE_KEY)
+
+    def stats(self):
+        """Return a dictionary of cache hit and miss counters."""
+        with self._lock:
+            return {'hits': self._hits,
+                    'stale_hits': self._stale_hits,
+                    'misses': self._misses,
+                    'refresh_failures': self._refresh_failures}
+
+    def _should_refresh(self, now):
+        """Return True if a background refresh should be started."""
+        if self._refreshing:
+            return False
+
+        if (self._failed_at is not None and
+                now - self._failed_at < self.RETRY_INTERVAL):
+            return False
+
+        return True
+
+    def _refresh(self, fetch):
+        """Replace the cached hostnames with those returned by fetch()."""
+        try:
+            return self._refresh_hostnames(fetch)
+        finally:
+            # Even if the Django cache raised, so later refreshes can start.
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_hostnames(self, fetch):
+        """Do the work of _refresh, which resets self._refreshing."""
+        max_age = (settings.PROVIDERS_CACHE_TTL +
+                   settings.PROVIDERS_CACHE_MAX_STALE)
+
+        # Another process may have fetched the hostnames already.
+        fetched_at, hostnames = cache.get(self.CACHE_KEY, (0, ()))
+        if time.time() - fetched_at < settings.PROVIDERS_CACHE_TTL:
+            with self._lock:
+                self._hostnames = frozenset(hostnames)
+                self._fetched_at = fetched_at
+                self._failed_at = None
+                return self._hostnames
+
+        try:
+            hostnames = frozenset(fetch())
+        except Exception as error:
+            self.logger.error("Could not refresh provider list.")
+            self.logger.error("%s: %s", type(error), error)
+            hostnames = frozenset()
+
+        with self._lock:
+            if hostnames:
+                self._hostnames = hostnames
+                self._fetched_at = time.time()
+                self._failed_at = None
+                cache.set(self.CACHE_KEY,
+                          (self._fetched_at, list(hostnames)),
+                          max_age)
+                return hostnames
+
+            # An empty list is treated as a failure to
+            # retrieve providers, rather than cached.
+            self._refresh_failures += 1
+            self._failed_at = time.time()
+
+            if (self._hostnames is not None and
+                    self._failed_at - self._fetched_at < max_age):
+                self.logger.warning("Using stale provider list.")
+                return self._hostnames
+
+            return hostnames
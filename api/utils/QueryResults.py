@@ -0,0 +1,63 @@
+"""This module contains the QueryResults class."""
+
+
+class QueryResults(object):
+    """
+    The rows returned by a query, fetched from the database on demand.
+
+    Supports just enough of the sequence protocol for a Django Paginator:
+    count() runs the matching count query, and slicing runs the query
+    with a LIMIT and OFFSET, so only the requested rows are fetched.
+    """
+
+    def __init__(self, cursor, query, count_query, parameters):
+        """
+        Initialize a new QueryResults.
+
+        query and count_query must both take parameters, and count_query
+        must return a single row with a single column.
+        """
+        self._cursor = cursor
+        self._query = query
+        self._count_query = count_query
+        self._parameters = list(parameters)
+        self._count = None
+
+    def count(self):
+        """Return the number of rows the query matches."""
+        if self._count is None:
+            self._cursor.execute(self._count_query, self._parameters)
+            self._count = self._first_value(self._cursor.fetchone())
+
+        return self._count
+
+    def __len__(self):
+        """Return the number of rows the query matches."""
+        return self.count()
+
+    def __getitem__(self, index):
+        """Return the row, or list of rows, at index."""
+        if not isinstance(index, slice):
+            rows = self[index:index + 1]
+            if not rows:
+                raise IndexError('QueryResults index out of range')
+            return rows[0]
+
+        start, stop, step = index.indices(self.count())
+        if step != 1:
+            raise ValueError('QueryResults slices must have a step of 1')
+
+        if stop <= start:
+            return []
+
+        self._cursor.execute('%s limit %%s offset %%s' % self._query,
+                             self._parameters + [stop - start, start])
+
+        return list(self._cursor.fetchall())
+
+    def _first_value(self, row):
+        """Return the value of the single column in row."""
+        if isinstance(row, dict):
+            # Returned by a DictCursor.
+            return row.values()[0]
+        return row[0]
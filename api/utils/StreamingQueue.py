@@ -0,0 +1,82 @@
+"""This module contains the StreamingQueue class."""
+
+import errno
+import os
+import shutil
+
+from dirq.QueueBase import _file_create, _file_write, _name, _special_mkdir
+from dirq.queue import Queue, QueueError, TEMPORARY_DIRECTORY
+from dirq.utils import VALID_STR_TYPES
+
+
+class StreamingQueue(Queue):
+    """
+    A dirq Queue that elements can be streamed into.
+
+    Elements are built in a temporary directory and renamed into the queue
+    once complete, exactly as Queue.add does, so are never seen half
+    written. Unlike Queue.add, one field of the element can be written from
+    an iterable of chunks, so the whole of it is never held in memory.
+    """
+
+    def add_stream(self, data, name, chunks):
+        """
+        Add a new element to the queue and return its name.
+
+        data holds every field of the element except name, which is
+        written from chunks. If iterating over chunks raises an exception,
+        no element is added and the exception is raised.
+        """
+        if not self.type:
+            raise QueueError("unknown schema")
+
+        for key in list(data.keys()) + [name]:
+            if self.type.get(key) not in ('binary', 'string'):
+                raise QueueError("unexpected data: %s" % key)
+
+        for key in self.mandatory.keys():
+            if key not in data and key != name:
+                raise QueueError("missing mandatory data: %s" % key)
+
+        while True:
+            temp = '%s/%s/%s' % (self.path, TEMPORARY_DIRECTORY,
+                                 _name(self.rndhex))
+            if _special_mkdir(temp, self.umask):
+                break
+
+        try:
+            for key, value in data.items():
+                if type(value) not in VALID_STR_TYPES:
+                    raise QueueError("unexpected data in %s: %r" %
+                                     (key, value))
+                _file_write('%s/%s' % (temp, key),
+                            self.type[key] == 'string', self.umask, value)
+
+            # Byte chunks are written as they are, so should already be
+            # encoded if the field is a string. Unicode chunks of a string
+            # field are encoded as UTF-8, as _file_write would.
+            utf8 = self.type[name] == 'string'
+            element_file = _file_create('%s/%s' % (temp, name), self.umask)
+            try:
+                for chunk in chunks:
+                    if utf8 and isinstance(chunk, unicode):
+                        chunk = chunk.encode('utf-8')
+                    element_file.write(chunk)
+            finally:
+                element_file.close()
+        except Exception:
+            shutil.rmtree(temp, ignore_errors=True)
+            raise
+
+        while True:
+            element = '%s/%s' % (self._insertion_directory(),
+                                 _name(self.rndhex))
+            path = '%s/%s' % (self.path, element)
+            try:
+                os.rename(temp, path)
+                return element
+            except OSError as error:
+                # RACE: the target directory was already present...
+                if error.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    raise OSError("cannot rename(%s, %s): %s" %
+                                  (temp, path, error))
@@ -0,0 +1,122 @@
+"""This module contains the SummaryExport class."""
+
+import csv
+import json
+import logging
+
+import MySQLdb
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class _Echo(object):
+    """A file-like object that returns, rather than stores, what is written."""
+
+    def write(self, value):
+        """Return value, so csv.writer.writerow returns the formatted row."""
+        return value
+
+
+class SummaryExport(object):
+    """
+    The rows returned by a query, streamed as NDJSON or CSV.
+
+    The query is run with a server-side cursor on a connection borrowed from
+    a DatabasePool, and rows are fetched fetch_size at a time as the export
+    is iterated over, so memory use does not grow with the number of rows.
+    The connection is returned to the pool by close(), which Django calls
+    once the response has been sent, or abandoned.
+    """
+
+    # The supported outputs, and the content type of each.
+    CONTENT_TYPES = {'ndjson': 'application/x-ndjson',
+                     'csv': 'text/csv; charset=utf-8'}
+
+    def __init__(self, pool, query, parameters, headers, output, fetch_size):
+        """
+        Initialize a new SummaryExport and run its query.
+
+        The query is run straight away, so that database errors are raised
+        here, before a response has been started, rather than mid-stream.
+        """
+        if output not in self.CONTENT_TYPES:
+            raise ValueError('Unsupported export output: %s' % output)
+
+        self.logger = logging.getLogger(__name__)
+        self._pool = pool
+        self._headers = list(headers)
+        self._output = output
+        self._fetch_size = fetch_size
+        self._finished = False
+
+        self._connection = pool.acquire()
+        try:
+            self._cursor = self._connection.cursor(
+                MySQLdb.cursors.SSDictCursor)
+            self._cursor.execute(query, parameters)
+        except Exception:
+            pool.release(self._connection, discard=True)
+            self._connection = None
+            raise
+
+    @property
+    def content_type(self):
+        """Return the content type of the export."""
+        return self.CONTENT_TYPES[self._output]
+
+    def __iter__(self):
+        """Yield the export a chunk of rows at a time."""
+        if self._output == 'csv':
+            writer = csv.writer(_Echo())
+            yield writer.writerow(self._headers)
+            format_row = lambda row: writer.writerow(
+                [self._csv_value(row.get(header))
+                 for header in self._headers])
+        else:
+            # Encode rows as compactly as the JSON API responses are.
+            encoder = JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+            format_row = lambda row: ('%s\n' % encoder.encode(
+                dict([(header, row.get(header))
+                      for header in self._headers]))).encode('utf-8')
+
+        while True:
+            rows = self._cursor.fetchmany(self._fetch_size)
+            if not rows:
+                break
+
+            yield ''.join([format_row(row) for row in rows])
+
+        self._finished = True
+
+    def close(self):
+        """
+        Return the connection to the pool.
+
+        A server-side cursor must be read to the end before its connection
+        can be reused, so the connection of an unfinished export is closed
+        rather than returned.
+        """
+        if self._connection is None:
+            return
+
+        if self._finished:
+            try:
+                self._cursor.close()
+            except MySQLdb.Error as error:
+                self.logger.warning('Could not close export cursor: %s',
+                                    error)
+                self._finished = False
+        else:
+            # Closing the cursor would read, and throw away, every
+            # remaining row, so just close the connection instead.
+            self.logger.warning('Export ended before all rows were sent.')
+
+        self._pool.release(self._connection, discard=not self._finished)
+        self._connection = None
+
+    def _csv_value(self, value):
+        """Return value in a form the csv module can write."""
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
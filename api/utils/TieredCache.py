@@ -0,0 +1,132 @@
+"""This module contains the TieredCache class."""
+
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class TieredCache(BaseCache):
+    """
+    A Django cache backend with a local tier in front of a shared tier.
+
+    Every entry is written to both tiers. Reads are served from the local
+    (in-process) cache where possible, and otherwise from the shared cache
+    (e.g. memcached), which is then copied into the local cache. This way,
+    an entry is only computed once for all the processes, and replicas,
+    sharing the shared cache, but most reads don't leave the process.
+
+    Entries are kept in the local cache for at most LOCAL_TIMEOUT seconds,
+    which bounds how long a process can miss a change made by another, and
+    never beyond when they expire from the shared cache.
+
+    Configured with the aliases of the two tiers, e.g.
+
+        'default': {
+            'BACKEND': 'api.utils.TieredCache.TieredCache',
+            'OPTIONS': {'LOCAL_CACHE': 'local',
+                        'SHARED_CACHE': 'shared',
+                        'LOCAL_TIMEOUT': 30},
+        },
+    """
+
+    def __init__(self, location, params):
+        """Initialize a new TieredCache."""
+        super(TieredCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self._local_alias = options.get('LOCAL_CACHE', 'local')
+        self._shared_alias = options.get('SHARED_CACHE', 'shared')
+        self._local_timeout = int(options.get('LOCAL_TIMEOUT', 30))
+        self._local_cache = None
+        self._shared_cache = None
+
+    @property
+    def local(self):
+        """Return the local tier, creating it on first use."""
+        if self._local_cache is None:
+            self._local_cache = self._get_cache(self._local_alias)
+        return self._local_cache
+
+    @property
+    def shared(self):
+        """Return the shared tier, creating it on first use."""
+        if self._shared_cache is None:
+            self._shared_cache = self._get_cache(self._shared_alias)
+        return self._shared_cache
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Set a value in the cache if the key does not already exist.
+
+        Whether the key exists is decided by the shared tier alone. So only
+        one process can add a given key if the shared tier's add is atomic,
+        as memcached's is. A LocMemCache is not shared, so processes adding
+        the same key can each succeed.
+        """
+        expiry = self._expiry(timeout)
+        if not self.shared.add(key, (expiry, value), timeout, version):
+            return False
+
+        self._set_local(key, expiry, value, version)
+        return True
+
+    def get(self, key, default=None, version=None):
+        """Fetch a given key from the cache, or default if not found."""
+        entry = self.local.get(key, version=version)
+        if entry is None:
+            entry = self.shared.get(key, version=version)
+            if entry is None:
+                return default
+            self._set_local(key, entry[0], entry[1], version)
+
+        expiry, value = entry
+        if expiry is not None and expiry <= time.time():
+            return default
+
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Set a value in both tiers of the cache."""
+        expiry = self._expiry(timeout)
+        self.shared.set(key, (expiry, value), timeout, version)
+        self._set_local(key, expiry, value, version)
+
+    def delete(self, key, version=None):
+        """Delete a key from both tiers of the cache."""
+        self.shared.delete(key, version)
+        self.local.delete(key, version)
+
+    def clear(self):
+        """Remove all values from both tiers of the cache."""
+        self.shared.clear()
+        self.local.clear()
+
+    def close(self, **kwargs):
+        """Close both tiers of the cache."""
+        if self._shared_cache is not None:
+            self._shared_cache.close(**kwargs)
+        if self._local_cache is not None:
+            self._local_cache.close(**kwargs)
+
+    def _expiry(self, timeout):
+        """Return when an entry set with timeout expires, or None if never."""
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    def _set_local(self, key, expiry, value, version):
+        """Copy an entry, which expires at expiry, into the local tier."""
+        timeout = self._local_timeout
+        if expiry is not None:
+            timeout = min(timeout, expiry - time.time())
+
+        if timeout > 0:
+            self.local.set(key, (expiry, value), timeout, version)
+
+    def _get_cache(self, alias):
+        """Return the cache configured in settings.CACHES as alias."""
+        # Imported here, as this module is itself imported
+        # while django.core.cache creates the default cache.
+        from django.core.cache import get_cache
+        return get_cache(alias)
@@ -1,24 +1,65 @@
 """This module contains the TokenChecker class."""
 import base64
 import datetime
+import hashlib
 import httplib
 import json
 import logging
+import Queue
+import threading
 import urllib2
 
 from django.conf import settings
 from django.core.cache import cache
+from django.utils.http import parse_http_date_safe
 from jose import jwt
 from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
 
 
+class IntrospectionError(Exception):
+    """Raised when a token cannot be introspected by its IAM."""
+
+
 class TokenChecker(object):
-    """This class contains methods to check a JWT token for validity."""
+    """
+    This class contains methods to check a JWT token for validity.
+
+    How much a token is checked with its IAM, once its signature has been
+    verified locally, depends on settings.TOKEN_VERIFICATION_POLICY:
+     - 'introspect': every token is introspected before it is accepted.
+     - 'local': tokens issued within settings.TOKEN_REVOCATION_WINDOW
+       seconds are accepted on their signature alone, older tokens are
+       introspected.
+     - 'async': tokens are accepted on their signature, and introspected
+       in the background, so a revoked token is rejected from then on.
+       Background introspections are made by a fixed number of workers,
+       and are skipped if too many are already waiting for them.
+    """
+
+    # Counters reported by stats(), shared by every TokenChecker.
+    _stats = {'cache_hits': 0,
+              'introspections': 0,
+              'introspections_skipped': 0,
+              'introspections_deferred': 0,
+              'introspections_dropped': 0,
+              'deferred_rejections': 0}
+    _stats_lock = threading.Lock()
+
+    # The tokens waiting to be introspected in the background, shared by
+    # every TokenChecker, and created, with its workers, on first use.
+    _introspection_queue = None
+    _introspection_lock = threading.Lock()
 
     def __init__(self):
         """Initialize a new TokenChecker."""
         self.logger = logging.getLogger(__name__)
 
+    @classmethod
+    def stats(cls):
+        """Return a dictionary of token cache and introspection counters."""
+        with cls._stats_lock:
+            return dict(cls._stats)
+
     def valid_token_to_id(self, token):
         """Introspect a token to determine its origin."""
         try:
@@ -28,50 +69,180 @@ class TokenChecker(object):
             self.logger.debug('Full token: %s', token)
             return None
 
-        unverified_token_id = jwt_unverified_json['sub']
+        unverified_token_id = jwt_unverified_json.get('sub')
         self.logger.info('Token claims to be from %s', unverified_token_id)
 
-        # if token is in the cache, we say it is valid
-        if cache.get(unverified_token_id) == token:
-            self.logger.info("Token is in cache.")
+        # Tokens are cached by their digest, rather than their subject,
+        # so each token is only validated once, however many tokens the
+        # subject has, and the tokens themselves are not kept in the cache.
+        cache_key = 'token:%s' % hashlib.sha256(token).hexdigest()
+
+        cached_id = cache.get(cache_key)
+        if cached_id == '':
+            self.logger.info("Token was rejected recently.")
+            return None
 
-            return jwt_unverified_json['sub']
+        if cached_id is not None:
+            self.logger.info("Token is in cache.")
+            self._count('cache_hits')
+            return cached_id
 
         # otherwise, we need to validate the token
-        if not self._is_token_json_temporally_valid(jwt_unverified_json):
+        token_id = self._validate_token(token, jwt_unverified_json)
+
+        if token_id is None:
+            # Remember the rejection for a short while, so a client
+            # retrying a bad token does not reach the IAM every time.
+            cache.set(cache_key, '', settings.TOKEN_REJECTED_CACHE_TIMEOUT)
+            return None
+
+        self.logger.info('Token validated')
+        # Cache the token for settings.TOKEN_CACHE_TIMEOUT, to enable quick
+        # revocation but also limit the number of requests to the IAM
+        # instance, and never beyond when the token expires.
+        now = int(datetime.datetime.now().strftime('%s'))
+        timeout = min(settings.TOKEN_CACHE_TIMEOUT,
+                      jwt_unverified_json['exp'] - now)
+        if timeout > 0:
+            cache.set(cache_key, token_id, timeout)
+
+        if settings.TOKEN_VERIFICATION_POLICY == 'async':
+            # Queued once the token is cached, so that
+            # a rejection cannot be overwritten by it.
+            self._defer_introspection(token, jwt_unverified_json, cache_key)
+
+        self.logger.debug("Token checker: %s", self.stats())
+
+        return token_id
+
+    def _validate_token(self, token, token_json):
+        """
+        Return the subject of token, if the token is valid, otherwise None.
+
+        token_json is the unverified claims of the token.
+        """
+        if not self._is_token_json_temporally_valid(token_json):
             return None
 
-        if not self._is_token_issuer_trusted(jwt_unverified_json):
+        if not self._is_token_issuer_trusted(token_json):
             return None
 
-        issuer = jwt_unverified_json['iss']
         # we can pass issuer because the previous 'if' statement
-        # returns if jwt_unverified_json['iss'] is missing.
-        issuer = jwt_unverified_json['iss']
+        # returns if token_json['iss'] is missing.
+        issuer = token_json['iss']
         if not self._verify_token(token, issuer):
             return None
 
+        if not self._should_introspect(token_json):
+            return token_json.get('sub')
+
         # check the token has not been revoked
+        self._count('introspections')
         verifed_token_id = self._check_token_not_revoked(token, issuer)
-        # if the IAM disagrees with the token sub, reject ir
-        if verifed_token_id != jwt_unverified_json['sub']:
+        # if the IAM disagrees with the token sub, reject it
+        if (verifed_token_id is None or
+                verifed_token_id != token_json.get('sub')):
             return None
 
-        self.logger.info('Token validated')
-        # If the execution gets here, we can cache the token.
-        # The cache variable is a key: value like structure
-        # with an optional timeout, we use the token subject
-        # as the key and the token as the value.
-        # Cache timeout set to 300 seconds to enable quick revocation
-        # but also limit the number of requests to the IAM instance
-        # Caching is also done after token validation to ensure
-        # only valids tokens are cached
-        cache.set(jwt_unverified_json['sub'], token, 300)
-
-        return jwt_unverified_json['sub']
+        return verifed_token_id
+
+    def _should_introspect(self, token_json):
+        """
+        Return True if the token must be introspected before it is accepted.
+
+        token_json must already have been checked to be temporally valid.
+        """
+        policy = settings.TOKEN_VERIFICATION_POLICY
+
+        if policy == 'async':
+            self._count('introspections_deferred')
+            return False
+
+        if policy == 'local':
+            now = int(datetime.datetime.now().strftime('%s'))
+            if now - token_json['iat'] < settings.TOKEN_REVOCATION_WINDOW:
+                self._count('introspections_skipped')
+                return False
+
+        return True
+
+    def _defer_introspection(self, token, token_json, cache_key):
+        """
+        Queue an accepted token to be introspected in the background.
+
+        The token is not introspected at all if there are already
+        settings.TOKEN_INTROSPECTION_QUEUE_SIZE tokens waiting.
+        """
+        with self._introspection_lock:
+            if TokenChecker._introspection_queue is None:
+                TokenChecker._introspection_queue = Queue.Queue(
+                    settings.TOKEN_INTROSPECTION_QUEUE_SIZE)
+                for _ in range(settings.TOKEN_INTROSPECTION_WORKERS):
+                    worker = threading.Thread(
+                        target=self._introspection_worker,
+                        args=(TokenChecker._introspection_queue,))
+                    worker.daemon = True
+                    worker.start()
+
+        try:
+            self._introspection_queue.put_nowait((token, token_json,
+                                                  cache_key))
+        except Queue.Full:
+            self.logger.warning('Too many tokens waiting to be introspected, '
+                                'token will not be introspected.')
+            self._count('introspections_dropped')
+
+    def _introspection_worker(self, introspection_queue):
+        """Introspect the tokens in introspection_queue, forever."""
+        while True:
+            args = introspection_queue.get()
+            try:
+                self._introspect_in_background(*args)
+            except Exception as error:
+                # Carry on, or no more tokens would be introspected.
+                self.logger.error('Could not introspect token: %s: %s',
+                                  type(error), error)
+
+    def _introspect_in_background(self, token, token_json, cache_key):
+        """Introspect an accepted token, and reject it if it is revoked."""
+        try:
+            verifed_token_id = self._introspect_token(token,
+                                                      token_json['iss'])
+        except IntrospectionError as error:
+            # The token is not rejected just because its IAM could not be
+            # reached, so it is accepted until it leaves the cache.
+            self.logger.error('Could not introspect token: %s', error)
+            return
+
+        if verifed_token_id == token_json.get('sub'):
+            return
+
+        self.logger.info('Token rejected after introspection.')
+        self._count('deferred_rejections')
+
+        # Reject the token from now on, as a token rejected by
+        # _validate_token would be.
+        cache.set(cache_key, '', settings.TOKEN_REJECTED_CACHE_TIMEOUT)
+
+    def _count(self, name):
+        """Increment the counter name, as reported by stats()."""
+        with self._stats_lock:
+            self._stats[name] += 1
 
     def _check_token_not_revoked(self, token, issuer):
         """Contact issuer to check if the token has been revoked or not."""
+        try:
+            return self._introspect_token(token, issuer)
+        except IntrospectionError as error:
+            self.logger.error(error)
+            return None
+
+    def _introspect_token(self, token, issuer):
+        """
+        Return the ID issuer gives for token, or None if it is not active.
+
+        Raises IntrospectionError if issuer could not be asked.
+        """
         if "https://" not in issuer:
             self.logger.info('Issuer not https! Ending revokation check!')
             return None
@@ -91,16 +262,15 @@ class TokenChecker(object):
             auth_result = urllib2.urlopen(auth_request)
 
             auth_json = json.loads(auth_result.read())
-            client_id = auth_json['client_id']
 
         except (urllib2.HTTPError,
                 urllib2.URLError,
                 httplib.HTTPException,
-                KeyError) as error:
-            self.logger.error("%s: %s", type(error), str(error))
-            return None
+                ValueError) as error:
+            raise IntrospectionError("%s: %s" % (type(error), str(error)))
 
-        return client_id
+        # Revoked, or otherwise inactive, tokens are not given an ID.
+        return auth_json.get('client_id')
 
     def _verify_token(self, token, issuer):
         """Fetch IAM public key and veifry token against it."""
@@ -111,6 +281,13 @@ class TokenChecker(object):
         # get the IAM's public key
         key_json = self._get_issuer_public_key(issuer)
 
+        # if the token was signed with a key we have not seen before,
+        # the IAM may have rotated its keys since we cached them.
+        if key_json is not None and not self._has_signing_key(token,
+                                                              key_json):
+            self.logger.info('Token signed with an unknown key.')
+            key_json = self._get_issuer_public_key(issuer, refresh=True)
+
         # if we couldn't get the IAM public key, we cannot verify the token.
         if key_json is None:
             self.logger.info('No IAM Key found. Cannot verfiy token.')
@@ -125,14 +302,57 @@ class TokenChecker(object):
 
         return True
 
-    def _get_issuer_public_key(self, issuer):
-        """Return the public key of an IAM Hostname."""
+    def _has_signing_key(self, token, key_json):
+        """
+        Return False if token names a signing key missing from key_json.
+
+        Tokens without a key ID ('kid') header, and key sets without key IDs,
+        can only be checked by attempting to verify the token.
+        """
+        try:
+            key_id = jwt.get_unverified_header(token).get('kid')
+        except JWTError:
+            return True
+
+        if key_id is None:
+            return True
+
+        key_ids = [key.get('kid') for key in key_json.get('keys', [])]
+        if not any(key_ids):
+            return True
+
+        return key_id in key_ids
+
+    def _get_issuer_public_key(self, issuer, refresh=False):
+        """
+        Return the public key of an IAM Hostname.
+
+        The key is cached, in the Django cache, for as long as the IAM's
+        response allows. If refresh is True, the cached key is fetched
+        again, at most once every settings.JWK_REFRESH_INTERVAL seconds.
+        """
+        cache_key = 'jwk:%s' % issuer
+
+        if refresh:
+            # cache.add only succeeds if the key is not already set,
+            # so this limits how often a refresh can be forced. Unless
+            # the shared cache's add is atomic (e.g. memcached), processes
+            # refreshing at the same time can each fetch the key.
+            if not cache.add('jwk-refresh:%s' % issuer, True,
+                             settings.JWK_REFRESH_INTERVAL):
+                self.logger.info('IAM Key refreshed recently.')
+                return cache.get(cache_key)
+        else:
+            key_json = cache.get(cache_key)
+            if key_json is not None:
+                self.logger.info('IAM Key is in cache.')
+                return key_json
+
         try:
             key_request = urllib2.Request('%s/jwk' % issuer)
             key_result = urllib2.urlopen(key_request)
 
             key_json = json.loads(key_result.read())
-            return key_json
 
         except (urllib2.HTTPError,
                 urllib2.URLError,
@@ -141,6 +361,53 @@ class TokenChecker(object):
             self.logger.error("%s: %s", type(error), str(error))
             return None
 
+        timeout = self._key_cache_timeout(key_result.info())
+        if timeout > 0:
+            cache.set(cache_key, key_json, timeout)
+
+        return key_json
+
+    def _key_cache_timeout(self, headers):
+        """
+        Return how long (in seconds) a key can be cached for.
+
+        The lifetime is taken from the Cache-Control or Expires headers of
+        the IAM response, defaulting to settings.JWK_CACHE_TIMEOUT, and is
+        never more than settings.JWK_CACHE_MAX_TIMEOUT.
+        """
+        timeout = settings.JWK_CACHE_TIMEOUT
+
+        cache_control = headers.getheader('Cache-Control')
+        expires = parse_http_date_safe(headers.getheader('Expires'))
+
+        if cache_control is not None:
+            directives = {}
+            for directive in cache_control.split(','):
+                name, _, value = directive.strip().partition('=')
+                directives[name.lower()] = value.strip('"')
+
+            if 'no-store' in directives or 'no-cache' in directives:
+                return 0
+
+            if 'max-age' in directives or 's-maxage' in directives:
+                try:
+                    timeout = int(directives.get('s-maxage',
+                                                 directives.get('max-age')))
+                    # Age is how long the response has already been cached.
+                    timeout -= int(headers.getheader('Age') or 0)
+                except ValueError:
+                    pass
+                else:
+                    expires = None
+
+        if expires is not None:
+            date = parse_http_date_safe(headers.getheader('Date'))
+            if date is None:
+                date = int(datetime.datetime.now().strftime('%s'))
+            timeout = expires - date
+
+        return max(min(timeout, settings.JWK_CACHE_MAX_TIMEOUT), 0)
+
     def _is_token_issuer_trusted(self, token_json):
         """
         Return True if the 'issuer' hostname is in settings.IAM_HOSTNAME_LIST.
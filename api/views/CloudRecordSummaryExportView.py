@@ -0,0 +1,87 @@
+"""This file contains the CloudRecordSummaryExportView class."""
+
+import MySQLdb
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.response import Response
+
+from api.utils.DatabasePool import DatabasePoolError, get_pool
+from api.utils.SummaryExport import SummaryExport
+from api.views.CloudRecordSummaryView import (CloudRecordSummaryView,
+                                              DATABASE_CONFIG)
+
+
+class CloudRecordSummaryExportView(CloudRecordSummaryView):
+    """
+    Export all Cloud Accounting Summaries matching a query.
+
+    Accepts the same query parameters, and enforces the same authorization,
+    as CloudRecordSummaryView, but instead of a page of results, streams
+    every matching summary, read from the database with a server-side
+    cursor, as newline delimited JSON (the default) or CSV. Aggregated
+    summaries, see CloudRecordSummaryView, can be exported in the same way.
+    """
+
+    def get(self, request, format=None):
+        """
+        Export Cloud Accounting Summaries.
+
+        .../api/v1/cloud/record/summary/export?group=<group_name>&from=<date_from>&output=<ndjson|csv>
+
+        Will stream every summary for group_name, from date_from to now,
+        as NDJSON or CSV
+        """
+        error_response, query_parameters = self._check_request(request)
+        if error_response is not None:
+            return error_response
+
+        output = request.GET.get('output', 'ndjson')
+        if output not in SummaryExport.CONTENT_TYPES:
+            return Response("'output' must be one of: %s." %
+                            ', '.join(sorted(SummaryExport.CONTENT_TYPES)),
+                            status=400)
+
+        try:
+            aggregation = self._parse_aggregation(request)
+        except ValueError as error:
+            return Response(str(error), status=400)
+
+        db_config = DATABASE_CONFIG.get()
+        pool = get_pool(**db_config)
+        try:
+            # An unknown name is not treated specially, as the query then
+            # finds nothing straight away, and a CSV export still gets its
+            # header row.
+            ids = self._resolve_ids(pool, query_parameters)
+            if aggregation is None:
+                query, parameters = self._build_summary_query(*ids)
+                headers = settings.RETURN_HEADERS
+            else:
+                with pool.connection() as database:
+                    table = self._aggregate_table(database.cursor(),
+                                                  *(ids + aggregation[:1]))
+
+                query, parameters = self._build_aggregate_query(
+                    *(ids + aggregation), table=table)
+                headers = aggregation[0] + aggregation[1]
+
+            export = SummaryExport(pool, query, parameters, headers, output,
+                                   settings.EXPORT_FETCH_SIZE)
+        except MySQLdb.OperationalError as error:
+            self.logger.error("Could not query %s at %s using %s: %s",
+                              db_config['db'], db_config['host'],
+                              db_config['user'], error)
+            return Response(status=500)
+        except DatabasePoolError as error:
+            self.logger.error(error)
+            return Response(status=500)
+
+        # The export, and so the database connection, is closed by Django
+        # once the response has been streamed to the client.
+        response = StreamingHttpResponse(export,
+                                         content_type=export.content_type)
+        response['Content-Disposition'] = (
+            'attachment; filename="summaries.%s"' % output)
+
+        return response
@@ -1,18 +1,96 @@
 """This file contains the CloudRecordSummaryView class."""
 
-import ConfigParser
+import base64
+import calendar
 import datetime
+import hashlib
+import json
 import logging
 import MySQLdb
 
+from rest_framework.compat import OrderedDict
 from rest_framework.pagination import PaginationSerializer
+from rest_framework.templatetags.rest_framework import replace_query_param
 from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.utils.DatabaseConfig import DatabaseConfig
+from api.utils.DatabasePool import DatabasePoolError, get_pool
+from api.utils.DimensionLookup import DimensionLookup
+from api.utils.QueryResults import QueryResults
 from api.utils.TokenChecker import TokenChecker
 
+# The database configuration, shared by every request handled by this process.
+DATABASE_CONFIG = DatabaseConfig()
+
+# The fields of a summary that can be listed in settings.RETURN_HEADERS.
+SUMMARY_FIELDS = ('UpdateTime', 'SiteName', 'CloudComputeService',
+                  'Day', 'Month', 'Year', 'GlobalUserName', 'VO',
+                  'VOGroup', 'VORole', 'Status', 'CloudType', 'ImageId',
+                  'EarliestStartTime', 'LatestStartTime', 'WallDuration',
+                  'CpuDuration', 'CpuCount', 'NetworkInbound',
+                  'NetworkOutbound', 'PublicIPCount', 'Memory', 'Disk',
+                  'BenchmarkType', 'Benchmark', 'NumberOfVMs')
+
+# The order summaries are returned in when paginated by page number.
+SUMMARY_ORDER = ('Year', 'Month', 'Day', 'SiteName', 'GlobalUserName',
+                 'VO', 'VOGroup', 'VORole', 'Status', 'CloudType', 'ImageId')
+
+# The order summaries are returned in when paginated by cursor. These are
+# SummaryDate and the primary key of SUMMARY_TABLE, so identify a summary and
+# give its position for keyset pagination. InnoDB appends the primary key to
+# every index, so each of the indexes the filters use is already in this order.
+KEYSET_ORDER = ('SummaryDate', 'SiteID', 'Day', 'Month', 'Year',
+                'GlobalUserNameID', 'VOID', 'VOGroupID', 'VORoleID',
+                'Status', 'CloudType', 'ImageId')
+
+# The table summaries are read from, which holds the same summaries as the
+# VCloudSummaries view, without having to join CloudSummaries to the names.
+SUMMARY_TABLE = 'MaterialisedCloudSummaries'
+
+# The values of groupby, and the summary fields each one groups summaries by.
+GROUP_BY_FIELDS = {'site': ('SiteName',),
+                   'group': ('VOGroup',),
+                   'user': ('GlobalUserName',),
+                   'vo': ('VO',),
+                   'year': ('Year',),
+                   'month': ('Year', 'Month')}
+
+# The summary fields that can be aggregated, and the SQL aggregating each.
+# Sums are cast back to integers, as MySQL returns them as decimals.
+AGGREGATE_FIELDS = {'WallDuration': 'cast(sum(`%s`) as signed)',
+                    'CpuDuration': 'cast(sum(`%s`) as signed)',
+                    'NetworkInbound': 'cast(sum(`%s`) as signed)',
+                    'NetworkOutbound': 'cast(sum(`%s`) as signed)',
+                    'PublicIPCount': 'cast(sum(`%s`) as signed)',
+                    'Memory': 'cast(sum(`%s`) as signed)',
+                    'Disk': 'cast(sum(`%s`) as signed)',
+                    'NumberOfVMs': 'cast(sum(`%s`) as signed)',
+                    'EarliestStartTime': 'min(`%s`)',
+                    'LatestStartTime': 'max(`%s`)'}
+
+# The tables summaries are rolled up into, from the smallest, and the fields
+# of the summaries each one keeps, as well as AGGREGATE_FIELDS. Aggregates
+# are read from the first of these that gives the same results as
+# SUMMARY_TABLE, see _aggregate_table.
+ROLLUP_TABLES = (('YearlyCloudSummaries',
+                  ('Year', 'SiteName', 'GlobalUserName', 'VO', 'VOGroup')),
+                 ('MonthlyCloudSummaries',
+                  ('Year', 'Month', 'SiteName', 'GlobalUserName',
+                   'VO', 'VOGroup')))
+
+# The ID given to names that are not in the database. IDs start from 1, so
+# no summary has this ID, and a filter on it matches no summaries.
+UNKNOWN_ID = 0
+
+# The cache key of the time the summaries were last changed.
+LAST_UPDATED_CACHE_KEY = 'summary-last-updated'
+
 
 class CloudRecordSummaryView(APIView):
     """
@@ -39,12 +117,18 @@ class CloudRecordSummaryView(APIView):
 
     Will give summary for whole infrastructure from date_from
     (exclusive) to now
+
+    .../api/v1/cloud/record/summary?from=<date_from>&groupby=site,month&agg=WallDuration
+
+    Will give the total WallDuration of each service in each month,
+    from date_from (exclusive) to now
     """
 
     def __init__(self):
         """Set up class level logging."""
         self.logger = logging.getLogger(__name__)
         self._token_checker = TokenChecker()
+        self._dimension_lookup = DimensionLookup()
         super(CloudRecordSummaryView, self).__init__()
 
     def get(self, request, format=None):
@@ -70,27 +154,120 @@ class CloudRecordSummaryView(APIView):
 
         Will give summary for whole infrastructure from
         date_from (exclusive) to now
+
+        .../api/v1/cloud/record/summary?from=<date_from>&groupby=site,month&agg=WallDuration
+
+        Will give the total WallDuration of each service in each month,
+        from date_from (exclusive) to now
+        """
+        error_response, query_parameters = self._check_request(request)
+        if error_response is not None:
+            return error_response
+
+        try:
+            aggregation = self._parse_aggregation(request)
+        except ValueError as error:
+            return Response(str(error), status=400)
+
+        # A cursor, or asking for cursor pagination, selects keyset
+        # pagination, otherwise results are paginated by page number.
+        cursor_token = request.GET.get('cursor', '')
+        use_keyset = (cursor_token != '' or
+                      request.GET.get('pagination') == 'cursor')
+
+        if use_keyset and aggregation is not None:
+            # Aggregated summaries are not ordered by KEYSET_ORDER,
+            # so have no position to continue from.
+            return Response("'cursor' pagination cannot be combined with "
+                            "'groupby' or 'agg'.", status=400)
+
+        after = None
+        if cursor_token != '':
+            try:
+                after = self._decode_cursor(cursor_token)
+            except ValueError as error:
+                self.logger.error(error)
+                return Response("Malformed 'cursor'.", status=400)
+
+        # get the data requested
+        db_config = DATABASE_CONFIG.get()
+        pool = get_pool(**db_config)
+        try:
+            # Summaries only change when LastUpdated does, so a cached
+            # page is served until then, or until it times out.
+            last_updated = self._last_updated(pool)
+            cache_key = self._cache_key(request, query_parameters,
+                                        last_updated)
+
+            # The cache key changes whenever the results could, so it
+            # also serves as an ETag for them.
+            headers = {'ETag': quote_etag(cache_key)}
+            last_modified = None
+            if last_updated is not None:
+                last_modified = calendar.timegm(last_updated.utctimetuple())
+                headers['Last-Modified'] = http_date(last_modified)
+
+            if self._is_not_modified(request, cache_key, last_modified):
+                return Response(status=304, headers=headers)
+
+            results = cache.get(cache_key)
+
+            if results is None:
+                # Cache a plain copy of the (ordered) results, as
+                # serializer data does not keep its order when pickled.
+                results = OrderedDict(self._query_result(request, pool,
+                                                         use_keyset,
+                                                         query_parameters,
+                                                         after,
+                                                         aggregation))
+                cache.set(cache_key, results, settings.SUMMARY_CACHE_TIMEOUT)
+        except MySQLdb.OperationalError as error:
+            self.logger.error("Could not query %s at %s using %s: %s",
+                              db_config['db'], db_config['host'],
+                              db_config['user'], error)
+            return Response(status=500)
+        except DatabasePoolError as error:
+            self.logger.error(error)
+            return Response(status=500)
+        finally:
+            self.logger.debug("Database pool: %s", pool.stats())
+
+        return Response(results, status=200, headers=headers)
+
+###############################################################################
+#                                                                             #
+# Helper methods                                                              #
+#                                                                             #
+###############################################################################
+
+    def _check_request(self, request):
+        """
+        Authenticate, authorize and parse a summary request.
+
+        Return a tuple of the Response to reject the request with, or None
+        if the request is allowed, and the parsed query parameters.
         """
         client_token = self._request_to_token(request)
         if client_token is None:
-            return Response(status=401)
+            return Response(status=401), None
 
         # The token checker will introspect the token,
         # i.e. check it's in-date, correctly signed etc
         # and return the client_id of the token
         client_id = self._token_checker.valid_token_to_id(client_token)
         if client_id is None:
-            return Response(status=401)
+            return Response(status=401), None
 
         if not self._is_client_authorized(client_id):
-            return Response(status=403)
+            return Response(status=403), None
 
         # parse query parameters
+        query_parameters = self._parse_query_parameters(request)
         (group_name,
          service_name,
          start_date,
          end_date,
-         global_user_name) = self._parse_query_parameters(request)
+         global_user_name) = query_parameters
 
         # Check that at most one of group_name, service_name
         # and global_user_name is set as having more than
@@ -102,82 +279,259 @@ class CloudRecordSummaryView(APIView):
             self.logger.error("User, Group and/or Service combined.")
             self.logger.error("Rejecting request.")
             return Response("Only one of User, Group and Service can be set.",
-                            status=400)
+                            status=400), None
 
         if start_date is None:
             # querying without a from is not supported
             return Response("'from' must be set in GET requests.",
-                            status=400)
+                            status=400), None
 
-        # Read configuration from file
-        try:
-            dbcp = ConfigParser.ConfigParser()
-            dbcp.read(settings.CLOUD_DB_CONF)
-
-            db_hostname = dbcp.get('db', 'hostname')
-            # db_port = int(dbcp.get('db', 'port'))
-            db_name = dbcp.get('db', 'name')
-            db_username = dbcp.get('db', 'username')
-            db_password = dbcp.get('db', 'password')
-        except (ConfigParser.Error, ValueError, IOError) as err:
-            self.logger.warning('Error in configuration file %s: %s',
-                                settings.CLOUD_DB_CONF,
-                                err)
-            self.logger.warning('Using default configuration.')
-
-            db_hostname = 'localhost'
-            db_name = 'apel_rest'
-            db_username = 'root'
-            db_password = ''
+        return None, query_parameters
 
-        # get the data requested
-        try:
-            database = MySQLdb.connect(db_hostname,
-                                       db_username,
-                                       db_password,
-                                       db_name)
-        except MySQLdb.OperationalError:
-            self.logger.error("Could not connect to %s at %s using %s, %s",
-                              db_name, db_hostname, db_username, db_password)
-            return Response(status=500)
+    def _parse_aggregation(self, request):
+        """
+        Parse the groupby and agg query parameters of request.
 
-        cursor = database.cursor(MySQLdb.cursors.DictCursor)
-
-        if global_user_name is not None:
-            cursor.execute('select * from VCloudSummaries '
-                           'where GlobalUserName = %s '
-                           'and EarliestStartTime > %s '
-                           'and LatestStartTime < %s',
-                           [global_user_name, start_date, end_date])
-
-        elif group_name is not None:
-            cursor.execute('select * from VCloudSummaries '
-                           'where VOGroup = %s '
-                           'and EarliestStartTime > %s '
-                           'and LatestStartTime < %s',
-                           [group_name, start_date, end_date])
-
-        elif service_name is not None:
-            cursor.execute('select * from VCloudSummaries '
-                           'where SiteName = %s and '
-                           'EarliestStartTime > %s and '
-                           'LatestStartTime < %s',
-                           [service_name, start_date, end_date])
+        Return a tuple of the list of fields to group summaries by and the
+        list of fields to aggregate, or None if neither parameter is set.
+        Without agg, every aggregatable field in settings.RETURN_HEADERS is
+        aggregated. Raises ValueError if either parameter names a field
+        that is unknown, or not in settings.RETURN_HEADERS.
+        """
+        group_by_param = request.GET.get('groupby', '')
+        agg_param = request.GET.get('agg', '')
+        if group_by_param == '' and agg_param == '':
+            return None
 
+        group_by = []
+        for name in group_by_param.split(','):
+            if name == '':
+                continue
+            if name not in GROUP_BY_FIELDS:
+                raise ValueError("'groupby' must be a comma separated list "
+                                 "of: %s." %
+                                 ', '.join(sorted(GROUP_BY_FIELDS)))
+            for field in GROUP_BY_FIELDS[name]:
+                if field not in group_by:
+                    group_by.append(field)
+
+        if agg_param == '':
+            fields = settings.RETURN_HEADERS
         else:
-            cursor.execute('select * from VCloudSummaries '
-                           'where EarliestStartTime > %s',
-                           [start_date])
+            fields = agg_param.split(',')
+            for field in fields:
+                if field not in AGGREGATE_FIELDS:
+                    raise ValueError("'agg' must be a comma separated list "
+                                     "of: %s." %
+                                     ', '.join(sorted(AGGREGATE_FIELDS)))
+
+        aggregates = []
+        for field in fields:
+            if field in AGGREGATE_FIELDS and field not in aggregates:
+                aggregates.append(field)
+
+        for field in group_by + aggregates:
+            if field not in settings.RETURN_HEADERS:
+                raise ValueError("%s is not returned by this service, "
+                                 "which returns: %s." %
+                                 (field, ', '.join(settings.RETURN_HEADERS)))
+
+        self.logger.debug("Group by = %s", group_by)
+        self.logger.debug("Aggregates = %s", aggregates)
+
+        return group_by, aggregates
+
+    def _query_result(self, request, pool, use_keyset,
+                      query_parameters, after, aggregation=None):
+        """
+        Return the page of summaries requested, read from the database.
 
-        results = self._filter_cursor(cursor)
-        results = self._paginate_result(request, results)
-        return Response(results, status=200)
+        aggregation is as returned by _parse_aggregation. If it is not
+        None, the page is of aggregated summaries.
+        """
+        (group_id,
+         service_id,
+         start_date,
+         end_date,
+         global_user_id) = self._resolve_ids(pool, query_parameters)
+
+        if UNKNOWN_ID in (group_id, service_id, global_user_id):
+            # No summaries can match, so don't look for any.
+            return OrderedDict([('count', None if use_keyset else 0),
+                                ('next', None),
+                                ('previous', None),
+                                ('results', [])])
+
+        with pool.connection() as database:
+            cursor = database.cursor(MySQLdb.cursors.DictCursor)
+
+            if use_keyset:
+                return self._keyset_paginate_result(request,
+                                                    cursor,
+                                                    group_id,
+                                                    service_id,
+                                                    start_date,
+                                                    end_date,
+                                                    global_user_id,
+                                                    after)
+
+            if aggregation is not None:
+                table = self._aggregate_table(cursor, group_id, service_id,
+                                              start_date, end_date,
+                                              global_user_id, aggregation[0])
+
+                query, parameters = self._build_aggregate_query(
+                    group_id, service_id, start_date,
+                    end_date, global_user_id, *aggregation, table=table)
+
+                # Count the groups, rather than the summaries in them.
+                count_query = ('select count(*) from (%s) as aggregated' %
+                               query)
+
+                return self._paginate_result(
+                    request,
+                    QueryResults(cursor, query, count_query, parameters))
+
+            query, parameters = self._build_summary_query(
+                group_id, service_id, start_date,
+                end_date, global_user_id)
+
+            count_query, _ = self._build_count_query(
+                group_id, service_id, start_date,
+                end_date, global_user_id)
+
+            return self._paginate_result(
+                request,
+                QueryResults(cursor, query, count_query, parameters))
+
+    def _resolve_ids(self, pool, query_parameters):
+        """
+        Return query_parameters, with names replaced by their IDs.
 
-###############################################################################
-#                                                                             #
-# Helper methods                                                              #
-#                                                                             #
-###############################################################################
+        Summaries are filtered on the (indexed) ID columns rather than on
+        names. Names that are not in the database are given UNKNOWN_ID.
+        """
+        (group_name,
+         service_name,
+         start_date,
+         end_date,
+         global_user_name) = query_parameters
+
+        ids = []
+        for table, name in (('VOGroups', group_name),
+                            ('Sites', service_name),
+                            ('DNs', global_user_name)):
+            if name is None:
+                ids.append(None)
+                continue
+
+            dimension_id = self._dimension_lookup.get_id(pool, table, name)
+            if dimension_id is None:
+                self.logger.debug("Unknown name %s in %s", name, table)
+                dimension_id = UNKNOWN_ID
+            ids.append(dimension_id)
+
+        return ids[0], ids[1], start_date, end_date, ids[2]
+
+    def _aggregate_table(self, cursor, group_id, service_id, start_date,
+                         end_date, global_user_id, group_by):
+        """
+        Return the smallest table the summaries can be aggregated from.
+
+        A table in ROLLUP_TABLES can only be used if it keeps every group_by
+        field, and if the filters match either all, or none, of the
+        summaries rolled up into each of its rows, as a row cannot be split.
+        Otherwise, SUMMARY_TABLE is used.
+        """
+        for table, fields in ROLLUP_TABLES:
+            if [field for field in group_by if field not in fields]:
+                continue
+
+            query, parameters = self._build_rollup_check_query(
+                table, group_id, service_id, start_date,
+                end_date, global_user_id)
+            cursor.execute(query, parameters)
+            if cursor.fetchone() is None:
+                self.logger.debug("Aggregating summaries from %s", table)
+                return table
+
+        return SUMMARY_TABLE
+
+    def _last_updated(self, pool):
+        """
+        Return when the summaries were last changed.
+
+        This is the latest time in the LastUpdated table, which is only
+        read from the database every settings.SUMMARY_CACHE_CHECK_INTERVAL
+        seconds. None is returned if the table is empty.
+        """
+        # The time is cached in a list, as a cached None means a miss.
+        cached = cache.get(LAST_UPDATED_CACHE_KEY)
+        if cached is not None:
+            return cached[0]
+
+        with pool.connection() as database:
+            cursor = database.cursor()
+            cursor.execute('select max(UpdateTime) from LastUpdated')
+            last_updated = cursor.fetchone()[0]
+
+        cache.set(LAST_UPDATED_CACHE_KEY, [last_updated],
+                  settings.SUMMARY_CACHE_CHECK_INTERVAL)
+
+        return last_updated
+
+    def _cache_key(self, request, query_parameters, last_updated):
+        """
+        Return the key the results of request are cached under.
+
+        The key covers everything the results depend on, normalised so
+        that equivalent requests share cached results.
+        """
+        (group_name,
+         service_name,
+         start_date,
+         _,
+         global_user_name) = query_parameters
+
+        key = (group_name,
+               service_name,
+               start_date,
+               # Without a 'to', summaries up to now are returned, which
+               # can only change when LastUpdated does.
+               request.GET.get('to', ''),
+               global_user_name,
+               request.GET.get('page', ''),
+               request.GET.get('pagination', ''),
+               request.GET.get('cursor', ''),
+               request.GET.get('groupby', ''),
+               request.GET.get('agg', ''),
+               # Pages link to the next and previous pages, so depend on
+               # where, and how, the endpoint was reached.
+               request.build_absolute_uri(request.path),
+               tuple(settings.RETURN_HEADERS),
+               settings.RESULTS_PER_PAGE,
+               last_updated)
+
+        return 'summary:%s' % hashlib.sha1(repr(key)).hexdigest()
+
+    def _is_not_modified(self, request, etag, last_modified):
+        """
+        Return True if the client already has the requested results.
+
+        As in RFC 7232, If-Modified-Since is ignored if If-None-Match is
+        given. last_modified is a timestamp, or None if it is not known.
+        """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE'))
+        if if_modified_since is None or last_modified is None:
+            return False
+
+        return last_modified <= if_modified_since
 
     def _parse_query_parameters(self, request):
         """Parse expected query parameters from the given HTTP request."""
@@ -212,6 +566,205 @@ class CloudRecordSummaryView(APIView):
         return (group_name, service_name, start_date,
                 end_date, global_user_name)
 
+    def _build_summary_query(self, group_id, service_id,
+                             start_date, end_date, global_user_id):
+        """
+        Return the summary query matching the given filters.
+
+        The query, and the list of parameters to execute it with, only
+        select the columns listed in settings.RETURN_HEADERS.
+        """
+        where_clause, parameters = self._build_summary_filter(
+            group_id, service_id, start_date, end_date, global_user_id)
+
+        query = ('select %s from %s where %s order by %s' %
+                 (self._summary_columns(settings.RETURN_HEADERS),
+                  SUMMARY_TABLE,
+                  where_clause,
+                  ', '.join(SUMMARY_ORDER)))
+
+        return query, parameters
+
+    def _build_count_query(self, group_id, service_id,
+                           start_date, end_date, global_user_id):
+        """Return the query counting the summaries matching the filters."""
+        where_clause, parameters = self._build_summary_filter(
+            group_id, service_id, start_date, end_date, global_user_id)
+
+        query = 'select count(*) from %s where %s' % (SUMMARY_TABLE,
+                                                      where_clause)
+
+        return query, parameters
+
+    def _build_aggregate_query(self, group_id, service_id, start_date,
+                               end_date, global_user_id, group_by,
+                               aggregates, table=SUMMARY_TABLE):
+        """
+        Return the query aggregating the summaries matching the filters.
+
+        The summaries are grouped, and ordered, by the group_by fields, and
+        each group's aggregates are calculated by MySQL, see
+        AGGREGATE_FIELDS. Without group_by, every summary matching the
+        filters is aggregated into one. The summaries are read from table,
+        which is either SUMMARY_TABLE or one of ROLLUP_TABLES.
+        """
+        where_clause, parameters = self._build_summary_filter(
+            group_id, service_id, start_date, end_date, global_user_id)
+
+        group_columns = ', '.join(['`%s`' % field for field in group_by])
+
+        columns = ['`%s`' % field for field in group_by]
+        for field in aggregates:
+            columns.append('%s as `%s`' % (AGGREGATE_FIELDS[field] % field,
+                                           field))
+
+        query = 'select %s from %s where %s' % (', '.join(columns),
+                                                table,
+                                                where_clause)
+        if group_by:
+            query = '%s group by %s order by %s' % (query, group_columns,
+                                                    group_columns)
+
+        return query, parameters
+
+    def _build_rollup_check_query(self, table, group_id, service_id,
+                                  start_date, end_date, global_user_id):
+        """
+        Return the query finding a row of table the filters split.
+
+        That is, a row rolled up from some summaries that the filters of
+        _build_summary_filter match, and some that they don't. The least
+        and greatest start times of a row's summaries tell whether the
+        filters on EarliestStartTime and LatestStartTime match all, none or
+        only some of them.
+        """
+        for column, dimension_id in (('GlobalUserNameID', global_user_id),
+                                     ('VOGroupID', group_id),
+                                     ('SiteID', service_id)):
+            if dimension_id is not None:
+                return ('select 1 from %s '
+                        'where %s = %%s '
+                        'and SummaryDate >= date(%%s) '
+                        'and MaxEarliestStartTime > %%s '
+                        'and MinLatestStartTime < %%s '
+                        'and not (EarliestStartTime > %%s '
+                        'and LatestStartTime < %%s) '
+                        'limit 1' % (table, column),
+                        [dimension_id, start_date, start_date, end_date,
+                         start_date, end_date])
+
+        return ('select 1 from %s '
+                'where SummaryDate >= date(%%s) '
+                'and EarliestStartTime <= %%s '
+                'and MaxEarliestStartTime > %%s '
+                'limit 1' % table,
+                [start_date, start_date, start_date])
+
+    def _build_keyset_query(self, group_id, service_id,
+                            start_date, end_date, global_user_id, after):
+        """
+        Return the query for a page of summaries following after.
+
+        after is a list of KEYSET_ORDER values, or None for the first page.
+        As well as settings.RETURN_HEADERS, the KEYSET_ORDER columns are
+        selected so the position of the page's last summary can be given
+        as the next page's after. The page size is the last parameter.
+
+        Summaries after the position are found with the expanded form of
+        the row comparison (KEYSET_ORDER) > (after), as MySQL can only
+        range scan an index for that form.
+        """
+        where_clause, parameters = self._build_summary_filter(
+            group_id, service_id, start_date, end_date, global_user_id)
+
+        if after is not None:
+            # The first field is compared on its own as well, so an index
+            # range scan can start from the position.
+            comparisons = []
+            parameters = parameters + [after[0]]
+            for index, field in enumerate(KEYSET_ORDER):
+                equals = ['%s = %%s' % previous
+                          for previous in KEYSET_ORDER[:index]]
+                comparisons.append('(%s)' % ' and '.join(
+                    equals + ['%s > %%s' % field]))
+                parameters = parameters + list(after[:index + 1])
+
+            where_clause = '%s and %s >= %%s and (%s)' % (
+                where_clause, KEYSET_ORDER[0], ' or '.join(comparisons))
+
+        # Not all of the KEYSET_ORDER fields are summary fields, so they
+        # are added after _summary_columns has checked the headers.
+        columns = [self._summary_columns(settings.RETURN_HEADERS)]
+        columns.extend(['`%s`' % field for field in KEYSET_ORDER
+                        if field not in settings.RETURN_HEADERS])
+
+        query = ('select %s from %s where %s order by %s limit %%s' %
+                 (', '.join([column for column in columns if column]),
+                  SUMMARY_TABLE,
+                  where_clause,
+                  ', '.join(KEYSET_ORDER)))
+
+        return query, parameters
+
+    def _build_summary_filter(self, group_id, service_id,
+                              start_date, end_date, global_user_id):
+        """
+        Return the where clause, and its parameters, for the filters.
+
+        The user, group and service are given by ID, see _resolve_ids.
+
+        Every VM in a summary started before the end of the summary's day,
+        so a summary can only start after start_date if its SummaryDate is
+        no earlier than start_date. Filtering on that as well changes no
+        results, but lets the summaries be found with an index range scan.
+        """
+        if global_user_id is not None:
+            return ('GlobalUserNameID = %s '
+                    'and SummaryDate >= date(%s) '
+                    'and EarliestStartTime > %s '
+                    'and LatestStartTime < %s',
+                    [global_user_id, start_date, start_date, end_date])
+
+        elif group_id is not None:
+            return ('VOGroupID = %s '
+                    'and SummaryDate >= date(%s) '
+                    'and EarliestStartTime > %s '
+                    'and LatestStartTime < %s',
+                    [group_id, start_date, start_date, end_date])
+
+        elif service_id is not None:
+            return ('SiteID = %s '
+                    'and SummaryDate >= date(%s) '
+                    'and EarliestStartTime > %s '
+                    'and LatestStartTime < %s',
+                    [service_id, start_date, start_date, end_date])
+
+        else:
+            return ('SummaryDate >= date(%s) '
+                    'and EarliestStartTime > %s',
+                    [start_date, start_date])
+
+    def _summary_columns(self, headers):
+        """
+        Return the SQL column list for the given headers.
+
+        Allows for configuration of what summary fields the REST
+        interface returns on GET requests. Headers that are not
+        summary fields are ignored.
+        """
+        columns = []
+        for header in headers:
+            # Only known column names are used, as the column
+            # list cannot be passed to MySQL as a parameter.
+            if header in SUMMARY_FIELDS:
+                if header not in columns:
+                    columns.append(header)
+            else:
+                self.logger.warning("Ignoring unknown summary field %s",
+                                    header)
+
+        return ', '.join(['`%s`' % column for column in columns])
+
     def _paginate_result(self, request, result):
         """Paginate result based on the request and apel_rest settings."""
         paginator = Paginator(result, settings.RESULTS_PER_PAGE)
@@ -235,31 +788,90 @@ class CloudRecordSummaryView(APIView):
                                           context={'request': request})
         return serializer.data
 
-    def _filter_cursor(self, cursor):
+    def _keyset_paginate_result(self, request, cursor, group_id,
+                                service_id, start_date, end_date,
+                                global_user_id, after):
         """
-        Filter database results based on settings.RETURN_HEADERS.
+        Return the page of summaries following after.
 
-        Allows for configuration of what summary fields
-        the REST interface returns on GET requests.
+        Unlike _paginate_result, the cost of fetching a page does not grow
+        with how far through the summaries it is, as the page starts from
+        the position given by after rather than skipping preceding rows.
         """
-        results_list = []
-        # Use results_list to store individual summaries to before returning.
-        for record in cursor.fetchall():
-            # record refers to one day's summary
-            result = {}
-            # result is used to construct a new, filtered, summary with
-            # only the values listed in settings.RETURN_HEADERS.
-            for key, value in record.iteritems():
-                if key in settings.RETURN_HEADERS:
-                    # keys listed in settings.RETURN_HEADERS represent
-                    # summary fields the REST interface has been configured
-                    # to return. As such we need to add that field to the
-                    # new summary we are constructing
-                    result.update({key: value})
-
-            results_list.append(result)
+        query, parameters = self._build_keyset_query(
+            group_id, service_id, start_date, end_date,
+            global_user_id, after)
+
+        # Fetch one extra summary to find out if there is a next page.
+        cursor.execute(query, parameters + [settings.RESULTS_PER_PAGE + 1])
+        rows = list(cursor.fetchall())
+
+        next_url = None
+        if len(rows) > settings.RESULTS_PER_PAGE:
+            rows = rows[:settings.RESULTS_PER_PAGE]
+            next_after = [rows[-1][field] for field in KEYSET_ORDER]
+            next_url = replace_query_param(request.build_absolute_uri(),
+                                           'cursor',
+                                           self._encode_cursor(next_after))
+
+        results = []
+        for row in rows:
+            # Drop the KEYSET_ORDER fields not in settings.RETURN_HEADERS.
+            results.append(dict((key, value)
+                                for key, value in row.iteritems()
+                                if key in settings.RETURN_HEADERS))
+
+        return {'count': None,
+                'next': next_url,
+                'previous': None,
+                'results': results}
+
+    def _encode_cursor(self, after):
+        """Return an opaque cursor token for a list of KEYSET_ORDER values."""
+        # SummaryDate is a date, which is given in ISO format, as MySQL
+        # compares it with a DATE column in the same way.
+        return base64.urlsafe_b64encode(
+            json.dumps(after, default=lambda value: value.isoformat()))
+
+    def _decode_cursor(self, cursor_token):
+        """
+        Return the list of KEYSET_ORDER values in a cursor token.
 
-        return results_list
+        Raises ValueError if cursor_token was not made by _encode_cursor.
+        """
+        try:
+            after = json.loads(base64.urlsafe_b64decode(str(cursor_token)))
+        except (TypeError, UnicodeError):
+            raise ValueError('Malformed cursor %s' % cursor_token)
+
+        if not isinstance(after, list) or len(after) != len(KEYSET_ORDER):
+            raise ValueError('Malformed cursor %s' % cursor_token)
+
+        # The values are passed to MySQL as they are, so must each be
+        # of the type _encode_cursor gives for its field.
+        for field, value in zip(KEYSET_ORDER, after):
+            if not self._is_keyset_value(field, value):
+                raise ValueError('Malformed cursor %s' % cursor_token)
+
+        return after
+
+    def _is_keyset_value(self, field, value):
+        """Return True if value can be the KEYSET_ORDER field of a summary."""
+        if field == 'SummaryDate':
+            if not isinstance(value, basestring):
+                return False
+            try:
+                datetime.datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return False
+            return True
+
+        if field in ('Status', 'CloudType', 'ImageId'):
+            return isinstance(value, basestring)
+
+        # Otherwise an ID, or part of the date, which are integers.
+        return (isinstance(value, (int, long)) and
+                not isinstance(value, bool))
 
     def _request_to_token(self, request):
         """Get the token from the request."""
@@ -1,15 +1,26 @@
 """This file contains the CloudRecordView class."""
 
+import email
 import json
 import logging
 import os
 import urllib2
 
-from dirq.queue import Queue, QueueError
+from dirq.queue import QueueError
 from django.conf import settings
+from rest_framework.request import is_form_media_type
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.utils.ContentDecoder import (ContentDecoder, ContentDecoderError,
+                                      ContentTooLargeError,
+                                      UnsupportedEncodingError)
+from api.utils.ProviderCache import ProviderCache
+from api.utils.StreamingQueue import StreamingQueue
+
+# The provider list, shared by every request handled by this process.
+PROVIDER_CACHE = ProviderCache()
+
 
 class CloudRecordView(APIView):
     """
@@ -18,6 +29,11 @@ class CloudRecordView(APIView):
     .../api/v1/cloud/record
 
     Will save Cloud Accounting Records for later loading.
+
+    A multipart/mixed POST is a batch, with each part saved as a separate
+    message. The IDs the messages were saved under are returned.
+
+    The body can be compressed, as given by its Content-Encoding.
     """
 
     def __init__(self):
@@ -51,40 +67,100 @@ class CloudRecordView(APIView):
             self.logger.error("%s not a valid provider", signer)
             return Response(status=403)
 
-        if "_content" in request.POST.dict():
-            # then POST likely to come via the rest api framework
-            # hence use the content of request.POST as message
-            body = request.POST.get('_content')
-
-        else:
-            # POST likely to comes through a browser client or curl
-            # hence use request.body as message
-            body = request.body
-
-        self.logger.debug("Message body received: %s", body)
-
-        for header in request.META:
-            self.logger.debug("%s: %s", header, request.META[header])
-
-        # taken from ssm2
-        QSCHEMA = {'body': 'string',
-                   'signer': 'string',
-                   'empaid': 'string?'}
-
-        inqpath = os.path.join(settings.QPATH, 'incoming')
-        inq = Queue(inqpath, schema=QSCHEMA)
+        content_type = request.META.get('CONTENT_TYPE', '')
+        encoding = request.META.get('HTTP_CONTENT_ENCODING')
 
         try:
-            name = inq.add({'body': body,
-                            'signer': signer,
-                            'empaid': empaid})
-        except QueueError as err:
-            self.logger.error("Could not save %s/%s: %s", inqpath, name, err)
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
 
-            response = "Data could not be saved to disk, please try again."
-            return Response(response, status=500)
+        # Reject an oversized body before reading any of it.
+        if content_length > settings.MAX_MESSAGE_SIZE:
+            self.logger.error("Body of %s bytes is too large.", content_length)
+            return Response("Body is larger than %s bytes." %
+                            settings.MAX_MESSAGE_SIZE, status=413)
 
-        self.logger.info("Message saved to in queue as %s/%s", inqpath, name)
+        decoder = ContentDecoder(settings.MAX_MESSAGE_SIZE)
+        try:
+            if (is_form_media_type(content_type) and
+                    '_content' in request.POST):
+                # then POST likely to come via the rest api framework
+                # hence use the content of request.POST as message
+                chunks = [request.POST.get('_content')]
+            else:
+                # POST likely to comes through a client, such as the
+                # sender or curl (which sends a raw body as form data
+                # by default), hence read the body as it arrives
+                chunks = self._read_chunks(request.stream,
+                                           decoder.CHUNK_SIZE)
+
+            chunks = decoder.decode_stream(encoding, chunks)
+
+            if content_type.startswith('multipart/mixed'):
+                # A batch of messages, one per part of the body,
+                # which has to be read in full to be split.
+                try:
+                    messages = self._split_batch(content_type,
+                                                 ''.join(chunks), empaid)
+                except ValueError as error:
+                    self.logger.error("Rejecting batch: %s", error)
+                    return Response(str(error), status=400)
+
+                self.logger.info("Message %s is a batch of %s messages.",
+                                 empaid, len(messages))
+
+            else:
+                messages = [(empaid, chunks)]
+
+            for header in request.META:
+                self.logger.debug("%s: %s", header, request.META[header])
+
+            # taken from ssm2
+            QSCHEMA = {'body': 'string',
+                       'signer': 'string',
+                       'empaid': 'string?'}
+
+            inqpath = os.path.join(settings.QPATH, 'incoming')
+            inq = StreamingQueue(inqpath, schema=QSCHEMA)
+
+            saved = []
+            for message_empaid, message_chunks in messages:
+                try:
+                    name = inq.add_stream({'signer': signer,
+                                           'empaid': message_empaid},
+                                          'body', message_chunks)
+                except (QueueError, OSError, IOError) as err:
+                    self.logger.error("Could not save %s to %s: %s",
+                                      message_empaid, inqpath, err)
+
+                    # The whole batch is sent again on retry, so the
+                    # messages of it already saved must not be kept.
+                    self._remove_messages(inq, saved)
+
+                    response = ("Data could not be saved to disk, "
+                                "please try again.")
+                    return Response(response, status=500)
+
+                self.logger.info("Message %s saved to in queue as %s/%s",
+                                 message_empaid, inqpath, name)
+                saved.append({'empaid': message_empaid, 'id': name})
+
+        except UnsupportedEncodingError as error:
+            self.logger.error(error)
+            return Response("Content-Encoding must be one of: %s." %
+                            ', '.join(decoder.encodings()),
+                            status=415)
+        except ContentTooLargeError as error:
+            self.logger.error(error)
+            return Response(str(error), status=413)
+        except ContentDecoderError as error:
+            self.logger.error(error)
+            return Response(str(error), status=400)
+
+        if content_type.startswith('multipart/mixed'):
+            # Let the sender know which of its messages were saved where.
+            return Response({'messages': saved}, status=202)
 
         response = "Data successfully saved for future loading."
         return Response(response, status=202)
@@ -95,6 +171,67 @@ class CloudRecordView(APIView):
 #                                                                             #
 ###############################################################################
 
+    def _split_batch(self, content_type, body, empaid):
+        """
+        Split a multipart/mixed batch into a list of (empaid, chunks) tuples.
+
+        Each part of the batch is one message. A part can be given its own
+        Empa-Id header, otherwise it is identified by empaid and its index.
+        """
+        batch = email.message_from_string('Content-Type: %s\r\n\r\n%s' %
+                                          (content_type, body))
+        if not batch.is_multipart():
+            raise ValueError('Batch is not a valid multipart message.')
+
+        parts = batch.get_payload()
+        if not parts:
+            raise ValueError('Batch contains no messages.')
+
+        if len(parts) > settings.MAX_BATCH_MESSAGES:
+            raise ValueError('Batch contains more than %s messages.' %
+                             settings.MAX_BATCH_MESSAGES)
+
+        messages = []
+        for index, part in enumerate(parts):
+            part_body = part.get_payload(decode=True)
+            if part_body is None:
+                # get_payload returns None for nested multipart parts.
+                raise ValueError('Batch part %s is not a message.' % index)
+
+            part_empaid = part.get('Empa-Id', '%s-%s' % (empaid, index))
+            messages.append((part_empaid, [part_body]))
+
+        return messages
+
+    def _remove_messages(self, inq, saved):
+        """Remove the saved messages, as listed by post, from inq."""
+        for message in saved:
+            try:
+                # dirq only removes locked elements.
+                if inq.lock(message['id']):
+                    inq.remove(message['id'])
+                    self.logger.info("Message %s removed from in queue.",
+                                     message['empaid'])
+                else:
+                    # Already locked, so being loaded.
+                    self.logger.error("Could not remove message %s.",
+                                      message['empaid'])
+            except (QueueError, OSError, IOError) as err:
+                self.logger.error("Could not remove message %s: %s",
+                                  message['empaid'], err)
+
+    def _read_chunks(self, stream, chunk_size):
+        """Yield the contents of stream, chunk_size bytes at a time."""
+        if stream is None:
+            # The request has no body.
+            return
+
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
     def _get_provider_json_indigo_cmdb(self):
         """Fetch the INDIGO CMDB Resource Provider JSON."""
         try:
@@ -156,7 +293,10 @@ class CloudRecordView(APIView):
             self.logger.info("Host %s has special access.", signer)
             return True
 
-        if signer in self._get_indigo_providers():
+        providers = PROVIDER_CACHE.get(self._get_indigo_providers)
+        self.logger.debug("Provider cache: %s", PROVIDER_CACHE.stats())
+
+        if signer in providers:
             self.logger.info("Host %s is listed as an INDIGO provider.",
                              signer)
             return True
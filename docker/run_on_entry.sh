@@ -26,6 +26,15 @@ sed -i "s|\['banned_from_post'\]|$BANNED_FROM_POST|g" /home/apel_rest_interface/
 sed -i "s|\['allowed_for_get'\]|$ALLOWED_FOR_GET|g" /home/apel_rest_interface/apel_rest/settings.py
 
 
+# SHARED_CACHE_BACKEND and SHARED_CACHE_LOCATION, if set
+# (only in the 'shared' cache, as the 'local' cache has the same backend)
+if [ -n "$SHARED_CACHE_BACKEND" ]; then
+    sed -i "/'shared': {/,/}/ s|django.core.cache.backends.locmem.LocMemCache|$SHARED_CACHE_BACKEND|" /home/apel_rest_interface/apel_rest/settings.py
+fi
+if [ -n "$SHARED_CACHE_LOCATION" ]; then
+    sed -i "/'shared': {/,/}/ s|'LOCATION': 'shared'|'LOCATION': '$SHARED_CACHE_LOCATION'|" /home/apel_rest_interface/apel_rest/settings.py
+fi
+
 # fetch the crl first
 fetch-crl
 
@@ -45,12 +45,17 @@ CREATE TABLE CloudRecords (
 
   PublisherDNID INT NOT NULL,	    -- Foreign key
 
+  -- StartTime + SuspendDuration + WallDuration, set by ReplaceCloudRecord
+  MeasurementTime DATETIME,
+  MeasurementDate DATE,
+
   PRIMARY KEY (VMUUID, StartTime, SuspendDuration, WallDuration),
 
   INDEX (UpdateTime),
   INDEX (GlobalUserNameID),
   INDEX (SiteID),
-  INDEX (ImageID)
+  INDEX (ImageID),
+  INDEX (VMUUID, MeasurementDate, MeasurementTime)
 
 );
 
@@ -73,16 +78,23 @@ CREATE PROCEDURE ReplaceCloudRecord(
   imageId VARCHAR(255), cloudType VARCHAR(255),
   publisherDN VARCHAR(255))
 BEGIN
+    DECLARE measurementTime DATETIME;
+
+    SET suspendDuration = IFNULL(suspendDuration, 0);
+    SET wallDuration = IF((wallDuration IS NULL) AND (status = "completed"), endTime - startTime, wallDuration);
+    SET measurementTime = TIMESTAMPADD(SECOND, (suspendDuration + wallDuration), startTime);
+
     REPLACE INTO CloudRecords(VMUUID, SiteID, CloudComputeServiceID, MachineName, LocalUserId, LocalGroupId,
         GlobalUserNameID, FQAN, VOID, VOGroupID, VORoleID, Status, StartTime, EndTime, SuspendDuration,
         WallDuration, CpuDuration, CpuCount, NetworkType, NetworkInbound, NetworkOutbound, PublicIPCount, Memory, Disk, BenchmarkType, Benchmark, 
-        StorageRecordId, ImageId, CloudType, PublisherDNID)
+        StorageRecordId, ImageId, CloudType, PublisherDNID, MeasurementTime, MeasurementDate)
       VALUES (
         VMUUID, SiteLookup(site), CloudComputeServiceLookup(cloudComputeService), machineName, localUserId, localGroupId, DNLookup(globalUserName), 
         fqan, VOLookup(vo),
-        VOGroupLookup(voGroup), VORoleLookup(voRole), status, startTime, endTime, IFNULL(suspendDuration, 0), 
-	IF((wallDuration IS NULL) AND (status = "completed"), endTime - startTime, wallDuration), cpuDuration, cpuCount, networkType, networkInbound, networkOutbound, publicIPCount, memory,
-        disk, benchmarkType, benchmark, storageRecordId, imageId, cloudType, DNLookup(publisherDN)
+        VOGroupLookup(voGroup), VORoleLookup(voRole), status, startTime, endTime, suspendDuration, 
+	wallDuration, cpuDuration, cpuCount, networkType, networkInbound, networkOutbound, publicIPCount, memory,
+        disk, benchmarkType, benchmark, storageRecordId, imageId, cloudType, DNLookup(publisherDN),
+        measurementTime, DATE(measurementTime)
         );
 END //
 DELIMITER ;
@@ -130,7 +142,9 @@ CREATE TABLE CloudSummaries (
   
   PublisherDNID VARCHAR(255),
 
-  PRIMARY KEY (SiteID, Day, Month, Year, GlobalUserNameID, VOID, VOGroupID, VORoleID, Status, CloudType, ImageId)
+  PRIMARY KEY (SiteID, Day, Month, Year, GlobalUserNameID, VOID, VOGroupID, VORoleID, Status, CloudType, ImageId),
+
+  INDEX (UpdateTime)
 
 );
 
@@ -158,51 +172,381 @@ END //
 DELIMITER ;
 
 
+-- ------------------------------------------------------------------------------
+-- MaterialisedCloudSummaries
+
+-- CloudSummaries with the names of their sites, users, VOs etc., so the summaries
+-- the REST API reads come from a single table, kept up to date by SummariseVMs
+DROP TABLE IF EXISTS MaterialisedCloudSummaries;
+CREATE TABLE MaterialisedCloudSummaries (
+  UpdateTime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  SiteID INT NOT NULL,
+  SiteName VARCHAR(255) NOT NULL,
+  CloudComputeServiceID INT NOT NULL,
+  CloudComputeService VARCHAR(255) NOT NULL,
+
+  Day INT NOT NULL,
+  Month INT NOT NULL,
+  Year INT NOT NULL,
+  -- The same day as a DATE, which can be range scanned
+  SummaryDate DATE NOT NULL,
+
+  GlobalUserNameID INT NOT NULL,
+  GlobalUserName VARCHAR(255) NOT NULL,
+  VOID INT NOT NULL,
+  VO VARCHAR(255) NOT NULL,
+  VOGroupID INT NOT NULL,
+  VOGroup VARCHAR(255) NOT NULL,
+  VORoleID INT NOT NULL,
+  VORole VARCHAR(255) NOT NULL,
+
+  Status VARCHAR(255),
+  CloudType VARCHAR(255),
+  ImageId VARCHAR(255),
+
+  EarliestStartTime DATETIME,
+  LatestStartTime DATETIME,
+  WallDuration BIGINT,
+  CpuDuration BIGINT,
+  CpuCount INT,
+
+  NetworkInbound BIGINT,
+  NetworkOutbound BIGINT,
+  PublicIPCount BIGINT,
+  Memory BIGINT,
+  Disk BIGINT,
+
+  BenchmarkType VARCHAR(50) NOT NULL,
+  Benchmark DECIMAL(10,3) NOT NULL,
+
+  NumberOfVMs INT,
+
+  PRIMARY KEY (SiteID, Day, Month, Year, GlobalUserNameID, VOID, VOGroupID, VORoleID, Status, CloudType, ImageId),
+
+  -- The REST API filters summaries by the ID, rather than the name, of a
+  -- site, group or user, as IDs are far smaller to index and compare, and
+  -- from a SummaryDate. Every VM in a summary started before the end of its
+  -- day, so summaries starting after a date are from no earlier than it.
+  -- InnoDB appends the primary key to each of these indexes, so they also
+  -- give the order, SummaryDate then the primary key, that the REST API
+  -- pages through summaries in with a cursor.
+  INDEX (SiteID, SummaryDate),
+  INDEX (VOGroupID, SummaryDate),
+  INDEX (GlobalUserNameID, SummaryDate),
+  INDEX (SummaryDate)
+);
+
+-- MaterialisedCloudSummaries rolled up into months, and years, for each site,
+-- user, VO and group, kept up to date by MaterialiseCloudSummaries. The REST
+-- API aggregates summaries from the smallest of these tables that gives the
+-- same results as MaterialisedCloudSummaries
+DROP TABLE IF EXISTS MonthlyCloudSummaries;
+CREATE TABLE MonthlyCloudSummaries (
+  SiteID INT NOT NULL,
+  SiteName VARCHAR(255) NOT NULL,
+
+  Month INT NOT NULL,
+  Year INT NOT NULL,
+  -- The last day of the month, so, as in MaterialisedCloudSummaries,
+  -- summaries starting after a date are from no earlier than it
+  SummaryDate DATE NOT NULL,
+
+  GlobalUserNameID INT NOT NULL,
+  GlobalUserName VARCHAR(255) NOT NULL,
+  VOID INT NOT NULL,
+  VO VARCHAR(255) NOT NULL,
+  VOGroupID INT NOT NULL,
+  VOGroup VARCHAR(255) NOT NULL,
+
+  -- The least and greatest EarliestStartTime and LatestStartTime of the
+  -- summaries rolled up, which tell whether a filter on them matches all,
+  -- none or only some of those summaries
+  EarliestStartTime DATETIME,
+  MaxEarliestStartTime DATETIME,
+  MinLatestStartTime DATETIME,
+  LatestStartTime DATETIME,
+  WallDuration BIGINT,
+  CpuDuration BIGINT,
+
+  NetworkInbound BIGINT,
+  NetworkOutbound BIGINT,
+  PublicIPCount BIGINT,
+  Memory BIGINT,
+  Disk BIGINT,
+
+  NumberOfVMs BIGINT,
+
+  PRIMARY KEY (Year, Month, SiteID, GlobalUserNameID, VOID, VOGroupID),
+
+  INDEX (SiteID, SummaryDate),
+  INDEX (VOGroupID, SummaryDate),
+  INDEX (GlobalUserNameID, SummaryDate),
+  INDEX (SummaryDate)
+);
+
+DROP TABLE IF EXISTS YearlyCloudSummaries;
+CREATE TABLE YearlyCloudSummaries (
+  SiteID INT NOT NULL,
+  SiteName VARCHAR(255) NOT NULL,
+
+  Year INT NOT NULL,
+  -- The last day of the year
+  SummaryDate DATE NOT NULL,
+
+  GlobalUserNameID INT NOT NULL,
+  GlobalUserName VARCHAR(255) NOT NULL,
+  VOID INT NOT NULL,
+  VO VARCHAR(255) NOT NULL,
+  VOGroupID INT NOT NULL,
+  VOGroup VARCHAR(255) NOT NULL,
+
+  EarliestStartTime DATETIME,
+  MaxEarliestStartTime DATETIME,
+  MinLatestStartTime DATETIME,
+  LatestStartTime DATETIME,
+  WallDuration BIGINT,
+  CpuDuration BIGINT,
+
+  NetworkInbound BIGINT,
+  NetworkOutbound BIGINT,
+  PublicIPCount BIGINT,
+  Memory BIGINT,
+  Disk BIGINT,
+
+  NumberOfVMs BIGINT,
+
+  PRIMARY KEY (Year, SiteID, GlobalUserNameID, VOID, VOGroupID),
+
+  INDEX (SiteID, SummaryDate),
+  INDEX (VOGroupID, SummaryDate),
+  INDEX (GlobalUserNameID, SummaryDate),
+  INDEX (SummaryDate)
+);
+
+DROP PROCEDURE IF EXISTS MaterialiseCloudSummaries;
+DELIMITER //
+CREATE PROCEDURE MaterialiseCloudSummaries()
+BEGIN
+-- Only the summaries replaced since the last run, whether by SummariseVMs
+-- or ReplaceCloudSummaryRecord, are copied again.
+DECLARE lastRun DATETIME;
+DECLARE latestUpdate DATETIME;
+
+SELECT IFNULL(TIMESTAMPADD(MINUTE, -10, MAX(UpdateTime)), '1970-01-01')
+FROM LastUpdated WHERE Type = 'MaterialiseCloudSummaries' INTO lastRun;
+SELECT MAX(UpdateTime) FROM CloudSummaries INTO latestUpdate;
+
+REPLACE INTO MaterialisedCloudSummaries(UpdateTime, SiteID, SiteName,
+    CloudComputeServiceID, CloudComputeService, Day, Month, Year, SummaryDate,
+    GlobalUserNameID, GlobalUserName, VOID, VO, VOGroupID, VOGroup,
+    VORoleID, VORole, Status, CloudType, ImageId, EarliestStartTime,
+    LatestStartTime, WallDuration, CpuDuration, CpuCount, NetworkInbound,
+    NetworkOutbound, PublicIPCount, Memory, Disk, BenchmarkType, Benchmark,
+    NumberOfVMs)
+SELECT summary.UpdateTime, SiteID, site.name,
+    CloudComputeServiceID, cloudComputeService.name, Day, Month, Year,
+    MAKEDATE(Year, 1) + INTERVAL (Month - 1) MONTH + INTERVAL (Day - 1) DAY,
+    GlobalUserNameID, userdn.name, VOID, vo.name, VOGroupID, vogroup.name,
+    VORoleID, vorole.name, Status, CloudType, ImageId, EarliestStartTime,
+    LatestStartTime, WallDuration, CpuDuration, CpuCount, NetworkInbound,
+    NetworkOutbound, PublicIPCount, Memory, Disk, BenchmarkType, Benchmark,
+    NumberOfVMs
+FROM CloudSummaries AS summary
+JOIN Sites AS site ON SiteID = site.id
+JOIN CloudComputeServices AS cloudComputeService ON CloudComputeServiceID = cloudComputeService.id
+JOIN DNs AS userdn ON GlobalUserNameID = userdn.id
+JOIN VOs AS vo ON VOID = vo.id
+JOIN VOGroups AS vogroup ON VOGroupID = vogroup.id
+JOIN VORoles AS vorole ON VORoleID = vorole.id
+WHERE summary.UpdateTime >= lastRun;
+
+-- The months, and years, of the copied summaries are rolled up again. Each
+-- month is found by its range of SummaryDates, which is indexed.
+DROP TEMPORARY TABLE IF EXISTS TChangedMonths, TChangedYears;
+
+CREATE TEMPORARY TABLE TChangedMonths
+(PRIMARY KEY (MonthStart))
+SELECT DISTINCT MAKEDATE(Year, 1) + INTERVAL (Month - 1) MONTH AS MonthStart
+FROM CloudSummaries
+WHERE UpdateTime >= lastRun;
+
+REPLACE INTO MonthlyCloudSummaries(SiteID, SiteName, Month, Year,
+    SummaryDate, GlobalUserNameID, GlobalUserName, VOID, VO, VOGroupID,
+    VOGroup, EarliestStartTime, MaxEarliestStartTime, MinLatestStartTime,
+    LatestStartTime, WallDuration, CpuDuration, NetworkInbound,
+    NetworkOutbound, PublicIPCount, Memory, Disk, NumberOfVMs)
+SELECT SiteID, MAX(SiteName), Month, Year, LAST_DAY(MonthStart),
+    GlobalUserNameID, MAX(GlobalUserName), VOID, MAX(VO), VOGroupID,
+    MAX(VOGroup), MIN(EarliestStartTime), MAX(EarliestStartTime),
+    MIN(LatestStartTime), MAX(LatestStartTime), SUM(WallDuration),
+    SUM(CpuDuration), SUM(NetworkInbound), SUM(NetworkOutbound),
+    SUM(PublicIPCount), SUM(Memory), SUM(Disk), SUM(NumberOfVMs)
+FROM TChangedMonths
+JOIN MaterialisedCloudSummaries
+ON (SummaryDate BETWEEN MonthStart AND LAST_DAY(MonthStart))
+GROUP BY Year, Month, SiteID, GlobalUserNameID, VOID, VOGroupID
+ORDER BY NULL;
+
+CREATE TEMPORARY TABLE TChangedYears
+(PRIMARY KEY (Year))
+SELECT DISTINCT YEAR(MonthStart) AS Year FROM TChangedMonths;
+
+-- Years are rolled up from the (far fewer) monthly summaries.
+REPLACE INTO YearlyCloudSummaries(SiteID, SiteName, Year, SummaryDate,
+    GlobalUserNameID, GlobalUserName, VOID, VO, VOGroupID, VOGroup,
+    EarliestStartTime, MaxEarliestStartTime, MinLatestStartTime,
+    LatestStartTime, WallDuration, CpuDuration, NetworkInbound,
+    NetworkOutbound, PublicIPCount, Memory, Disk, NumberOfVMs)
+SELECT SiteID, MAX(SiteName), monthly.Year,
+    MAKEDATE(monthly.Year, 1) + INTERVAL 1 YEAR - INTERVAL 1 DAY,
+    GlobalUserNameID, MAX(GlobalUserName), VOID, MAX(VO), VOGroupID,
+    MAX(VOGroup), MIN(EarliestStartTime), MAX(MaxEarliestStartTime),
+    MIN(MinLatestStartTime), MAX(LatestStartTime), SUM(WallDuration),
+    SUM(CpuDuration), SUM(NetworkInbound), SUM(NetworkOutbound),
+    SUM(PublicIPCount), SUM(Memory), SUM(Disk), SUM(NumberOfVMs)
+FROM TChangedYears
+JOIN MonthlyCloudSummaries AS monthly
+ON (monthly.Year = TChangedYears.Year)
+GROUP BY monthly.Year, SiteID, GlobalUserNameID, VOID, VOGroupID
+ORDER BY NULL;
+
+IF latestUpdate IS NOT NULL THEN
+    REPLACE INTO LastUpdated (Type, UpdateTime) VALUES ('MaterialiseCloudSummaries', latestUpdate);
+END IF;
+END //
+DELIMITER ;
+
+
+-- ------------------------------------------------------------------------------
+-- LastCloudRecordPerDay
+
+-- The last record of each VM on each day, kept up to date by SummariseVMs
+DROP TABLE IF EXISTS LastCloudRecordPerDay;
+CREATE TABLE LastCloudRecordPerDay (
+  VMUUID VARCHAR(255) NOT NULL,
+  SiteID INT NOT NULL,                -- Foreign key
+  CloudComputeServiceID INT NOT NULL, -- Foreign key
+
+  GlobalUserNameID INT NOT NULL,      -- Foreign key
+  VOID INT NOT NULL,                  -- Foreign key
+  VOGroupID INT NOT NULL,             -- Foreign key
+  VORoleID INT NOT NULL,              -- Foreign key
+
+  Status VARCHAR(255),
+  CloudType VARCHAR(255),
+  ImageId VARCHAR(255),
+
+  StartTime DATETIME NOT NULL,
+  WallDuration INT NOT NULL,
+  CpuDuration INT,
+  CpuCount INT,
+
+  NetworkInbound INT,
+  NetworkOutbound INT,
+  PublicIPCount INT,
+  Memory INT,
+  Disk INT,
+
+  BenchmarkType VARCHAR(50) NOT NULL,
+  Benchmark DECIMAL(10,3) NOT NULL,
+
+  MeasurementTime DATETIME NOT NULL,
+  MeasurementDate DATE NOT NULL,
+  Day INT NOT NULL,
+  Month INT NOT NULL,
+  Year INT NOT NULL,
+
+  PRIMARY KEY (VMUUID, MeasurementDate),
+
+  INDEX (MeasurementDate)
+);
+
+
 DROP PROCEDURE IF EXISTS SummariseVMs;
 DELIMITER //
 CREATE PROCEDURE SummariseVMs()
 BEGIN
-CREATE TEMPORARY TABLE TCloudRecordsWithMeasurementTime
-(INDEX index_measurementtime USING BTREE (MeasurementTime))
-SELECT *, TIMESTAMPADD(SECOND, (IFNULL(SuspendDuration, 0) + WallDuration), StartTime) as MeasurementTime FROM CloudRecords;
+-- Only records loaded since the last run are summarised, along with what
+-- they change: the usage of their VM from the day of the earliest of them
+-- onwards, and so the summaries of every VM on those days.
+DECLARE lastRun DATETIME;
+DECLARE latestUpdate DATETIME;
+
+-- Records still being loaded during the last run could have been missed,
+-- so records loaded shortly before it are summarised again.
+SELECT IFNULL(TIMESTAMPADD(MINUTE, -10, MAX(UpdateTime)), '1970-01-01')
+FROM LastUpdated WHERE Type = 'SummariseVMs' INTO lastRun;
+SELECT MAX(UpdateTime) FROM CloudRecords INTO latestUpdate;
+
+-- Records not loaded by ReplaceCloudRecord have no MeasurementTime yet.
+UPDATE CloudRecords SET
+	MeasurementTime = TIMESTAMPADD(SECOND, (IFNULL(SuspendDuration, 0) + WallDuration), StartTime),
+	MeasurementDate = DATE(TIMESTAMPADD(SECOND, (IFNULL(SuspendDuration, 0) + WallDuration), StartTime)),
+	UpdateTime = UpdateTime
+	WHERE UpdateTime >= lastRun AND MeasurementTime IS NULL
+;
+
+DROP TEMPORARY TABLE IF EXISTS TChangedVMs, TGreatestMeasurementTimePerDay,
+    TChangedDays, TVMUsagePerDay;
+
+CREATE TEMPORARY TABLE TChangedVMs
+(PRIMARY KEY (VMUUID))
+SELECT
+	VMUUID,
+	MIN(MeasurementDate) as FirstDate
+	FROM CloudRecords
+	WHERE UpdateTime >= lastRun
+	GROUP BY VMUUID
+;
 
+-- Both this and the join below are driven by the
+-- (VMUUID, MeasurementDate, MeasurementTime) index.
 CREATE TEMPORARY TABLE TGreatestMeasurementTimePerDay
-(INDEX index_greatestmeasurementtime USING BTREE (MaxMT))
-select 
-	Year(MeasurementTime) as Year, 
-	Month(MeasurementTime) as Month, 
-        Day(MeasurementTime) as Day,
-	VMUUID, 
-	max(MeasurementTime) as MaxMT 
-	from TCloudRecordsWithMeasurementTime 
-	group by 
-		Year(MeasurementTime), 
-		Month(MeasurementTime), 
-                Day(MeasurementTime),
-		VMUUID
+(INDEX index_greatestmeasurementtime USING BTREE (VMUUID, MeasurementDate))
+select
+	a.VMUUID,
+	a.MeasurementDate,
+	max(a.MeasurementTime) as MaxMT
+	from TChangedVMs as b
+	join CloudRecords as a
+	on (
+		a.VMUUID = b.VMUUID and
+		a.MeasurementDate >= b.FirstDate
+	)
+	group by
+		a.VMUUID,
+		a.MeasurementDate
 ;
-DROP TABLE IF EXISTS LastCloudRecordPerDay;
-CREATE TABLE LastCloudRecordPerDay
-(INDEX index_vmuuidyearmonthday USING BTREE (VMUUID, Year, Month, Day))
-SELECT 
-	a.*, 
-	Year(a.MeasurementTime) as Year, 
-	Month(a.MeasurementTime) as Month, 
-        Day(a.MeasurementTime) as Day
-	from TCloudRecordsWithMeasurementTime as a 
-	left join 
-	TGreatestMeasurementTimePerDay as b 
+
+REPLACE INTO LastCloudRecordPerDay(VMUUID, SiteID, CloudComputeServiceID,
+    GlobalUserNameID, VOID, VOGroupID, VORoleID, Status, CloudType, ImageId,
+    StartTime, WallDuration, CpuDuration, CpuCount, NetworkInbound,
+    NetworkOutbound, PublicIPCount, Memory, Disk, BenchmarkType, Benchmark,
+    MeasurementTime, MeasurementDate, Day, Month, Year)
+SELECT
+	a.VMUUID, a.SiteID, a.CloudComputeServiceID,
+	a.GlobalUserNameID, a.VOID, a.VOGroupID, a.VORoleID, a.Status, a.CloudType, a.ImageId,
+	a.StartTime, a.WallDuration, a.CpuDuration, a.CpuCount, a.NetworkInbound,
+	a.NetworkOutbound, a.PublicIPCount, a.Memory, a.Disk, a.BenchmarkType, a.Benchmark,
+	a.MeasurementTime,
+	a.MeasurementDate,
+	Day(a.MeasurementDate),
+	Month(a.MeasurementDate),
+	Year(a.MeasurementDate)
+	from TGreatestMeasurementTimePerDay as b
+	join CloudRecords as a
 	on (
-		Year(a.MeasurementTime) = b.Year and 
-		Month(a.MeasurementTime) = b.Month and
-                Day(a.MeasurementTime) = b.Day and                                  
-	        a.VMUUID = b.VMUUID
-	)       
-	where a.MeasurementTime = b.MaxMT
-	
-	ORDER BY a.VMUUID, Year(a.MeasurementTime), Month(a.MeasurementTime), Day(a.MeasurementTime)
+		a.VMUUID = b.VMUUID and
+		a.MeasurementDate = b.MeasurementDate and
+		a.MeasurementTime = b.MaxMT
+	)
 ;
 
+CREATE TEMPORARY TABLE TChangedDays
+(PRIMARY KEY (MeasurementDate))
+SELECT DISTINCT MeasurementDate FROM TGreatestMeasurementTimePerDay;
+
 -- Based on discussion here: http://stackoverflow.com/questions/13196190/mysql-subtracting-value-from-previous-row-group-by
 
 CREATE TEMPORARY TABLE TVMUsagePerDay
@@ -235,13 +579,15 @@ SELECT
 	ThisRecord.Disk, -- As above: constant or changing?
 	ThisRecord.BenchmarkType as BenchmarkType,
 	ThisRecord.Benchmark as Benchmark
-FROM	LastCloudRecordPerDay as ThisRecord
+FROM	TChangedDays
+JOIN LastCloudRecordPerDay as ThisRecord
+ON	(ThisRecord.MeasurementDate = TChangedDays.MeasurementDate)
 LEFT JOIN LastCloudRecordPerDay as PrevRecord
 ON 	(ThisRecord.VMUUID = PrevRecord.VMUUID and
-	PrevRecord.MeasurementTime = (SELECT max(MeasurementTime)
+	PrevRecord.MeasurementDate = (SELECT max(MeasurementDate)
 					FROM LastCloudRecordPerDay
 					WHERE VMUUID = ThisRecord.VMUUID
-					AND MeasurementTime < ThisRecord.MeasurementTime)
+					AND MeasurementDate < ThisRecord.MeasurementDate)
 	);
 
     REPLACE INTO CloudSummaries(SiteID, CloudComputeServiceID, Day, Month, Year,
@@ -272,6 +618,25 @@ ON 	(ThisRecord.VMUUID = PrevRecord.VMUUID and
         VOGroupID, VORoleID, Status, CloudType, ImageId, CpuCount,
         BenchmarkType, Benchmark
     ORDER BY NULL;
+
+    -- The high-water mark the next run summarises records from.
+    IF latestUpdate IS NOT NULL THEN
+        REPLACE INTO LastUpdated (Type, UpdateTime) VALUES ('SummariseVMs', latestUpdate);
+    END IF;
+
+    CALL MaterialiseCloudSummaries();
+END //
+DELIMITER ;
+
+
+DROP PROCEDURE IF EXISTS ResummariseVMs;
+DELIMITER //
+CREATE PROCEDURE ResummariseVMs()
+BEGIN
+    -- Summarise every record again, as if SummariseVMs had never been run.
+    TRUNCATE TABLE LastCloudRecordPerDay;
+    DELETE FROM LastUpdated WHERE Type = 'SummariseVMs';
+    CALL SummariseVMs();
 END //
 DELIMITER ;
 
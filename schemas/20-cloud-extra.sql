@@ -3,7 +3,8 @@
 
 -- Partitioning for CloudRecords to aid query performance and monthly deletions
 
--- More partitions can be added by "reorganizing" the pDefault parition. E.g.:
+-- More partitions are added by MaintainCloudRecordPartitions, in 30-cloud-partitions.sql,
+-- which "reorganizes" the pDefault parition. E.g.:
 /*
 ALTER TABLE CloudRecords REORGANIZE PARTITION pDefault INTO (
     PARTITION p2017_12 VALUES LESS THAN (TO_DAYS('2018-01-01')),
@@ -0,0 +1,91 @@
+-- Partition maintenance for the CloudRecords partitioning in 20-cloud-extra.sql
+-- -----------------------------------------------------------------------------
+
+DROP PROCEDURE IF EXISTS ExecuteStatement;
+DELIMITER //
+CREATE PROCEDURE ExecuteStatement(statement TEXT)
+BEGIN
+    -- Only user variables can be prepared as statements.
+    SET @statement = statement;
+    PREPARE preparedStatement FROM @statement;
+    EXECUTE preparedStatement;
+    DEALLOCATE PREPARE preparedStatement;
+END //
+DELIMITER ;
+
+
+-- Reorganizes pDefault into monthly partitions, named pYYYY_MM as in
+-- 20-cloud-extra.sql, up to monthsAhead months from now.
+-- If retentionMonths is more than 0, partitions that end more than
+-- retentionMonths months before the start of this month are removed.
+-- If archive is TRUE, the records in a removed partition are first moved
+-- into a table of their own, i.e. CloudRecords_p2016_03, rather than deleted.
+DROP PROCEDURE IF EXISTS MaintainCloudRecordPartitions;
+DELIMITER //
+CREATE PROCEDURE MaintainCloudRecordPartitions(monthsAhead INT, retentionMonths INT, archive BOOLEAN)
+BEGIN
+    DECLARE thisMonth DATE DEFAULT DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY);
+    DECLARE nextMonth DATE;
+    DECLARE newPartitions TEXT DEFAULT '';
+    DECLARE expiredPartition VARCHAR(64);
+
+    -- The end of the last monthly partition is the start of the next one.
+    SELECT FROM_DAYS(MAX(CAST(PARTITION_DESCRIPTION AS UNSIGNED)))
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'CloudRecords'
+    AND PARTITION_NAME NOT IN ('pNull', 'pDefault')
+    INTO nextMonth;
+
+    IF nextMonth IS NULL THEN
+        SET nextMonth = thisMonth;
+    END IF;
+
+    WHILE nextMonth <= DATE_ADD(thisMonth, INTERVAL monthsAhead MONTH) DO
+        SET newPartitions = CONCAT(newPartitions,
+            'PARTITION p', DATE_FORMAT(nextMonth, '%Y_%m'),
+            ' VALUES LESS THAN (TO_DAYS(''', DATE_ADD(nextMonth, INTERVAL 1 MONTH), ''')), ');
+        SET nextMonth = DATE_ADD(nextMonth, INTERVAL 1 MONTH);
+    END WHILE;
+
+    IF newPartitions != '' THEN
+        CALL ExecuteStatement(CONCAT(
+            'ALTER TABLE CloudRecords REORGANIZE PARTITION pDefault INTO (',
+            newPartitions, 'PARTITION pDefault VALUES LESS THAN MAXVALUE)'));
+    END IF;
+
+    removeExpired: WHILE retentionMonths > 0 DO
+        SET expiredPartition = (
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'CloudRecords'
+            AND PARTITION_NAME NOT IN ('pNull', 'pDefault')
+            AND CAST(PARTITION_DESCRIPTION AS UNSIGNED) <= TO_DAYS(DATE_SUB(thisMonth, INTERVAL retentionMonths MONTH))
+            ORDER BY PARTITION_ORDINAL_POSITION
+            LIMIT 1);
+
+        IF expiredPartition IS NULL THEN
+            LEAVE removeExpired;
+        END IF;
+
+        IF archive THEN
+            CALL ExecuteStatement(CONCAT('CREATE TABLE CloudRecords_', expiredPartition, ' LIKE CloudRecords'));
+            CALL ExecuteStatement(CONCAT('ALTER TABLE CloudRecords_', expiredPartition, ' REMOVE PARTITIONING'));
+            CALL ExecuteStatement(CONCAT('ALTER TABLE CloudRecords EXCHANGE PARTITION ', expiredPartition,
+                ' WITH TABLE CloudRecords_', expiredPartition));
+        END IF;
+
+        CALL ExecuteStatement(CONCAT('ALTER TABLE CloudRecords DROP PARTITION ', expiredPartition));
+    END WHILE;
+END //
+DELIMITER ;
+
+
+-- Keeps three months of partitions ahead, and every record, by default.
+-- Events only run if the event scheduler is on, i.e. with event_scheduler = ON
+-- in the MySQL configuration, as in docker/etc/mysql/conf.d/52_events.cnf.
+DROP EVENT IF EXISTS CloudRecordPartitionMaintenance;
+CREATE EVENT CloudRecordPartitionMaintenance
+ON SCHEDULE EVERY 1 DAY
+DO CALL MaintainCloudRecordPartitions(3, 0, TRUE);
+
+-- Create the partitions up to now, as the event may not run straight away.
+CALL MaintainCloudRecordPartitions(3, 0, TRUE);
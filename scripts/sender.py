@@ -9,48 +9,110 @@ send messages to the REST endpoint defined in main().
 
 import argparse
 import httplib
+import Queue
 import json
 import logging
 import ssl
 import socket
 import sys
+import threading
 import time
+import zlib
 
 from dirq.QueueSimple import QueueSimple
 
+try:
+    import zstandard
+except ImportError:
+    # zstd compression is optional, and only
+    # supported if zstandard is installed.
+    zstandard = None
+
 log = logging.getLogger(__name__)
 
 
+class SenderError(Exception):
+    """Raised when messages could not be sent."""
+
+
+class _SenderState(threading.local):
+    """The connection and pacing of one sending thread."""
+
+    # The connection to the endpoint, kept open between messages.
+    conn = None
+    # How long (in seconds) to wait before the next request.
+    delay = 0
+
+
 class Sender(object):
     """A simple class for sending Accounting Records to a REST endpoint."""
 
-    def __init__(self, dest, qpath, cert, key, api_version):
-        """Initialize a Sender."""
+    # The longest (in seconds) to wait between requests
+    # when the endpoint has asked us to slow down.
+    MAX_DELAY = 60
+
+    # Response codes that mean the endpoint is busy, rather than that
+    # the request was wrong, so are retried after waiting a while.
+    BUSY_RESPONSE_CODES = (429, 502, 503, 504)
+
+    def __init__(self, dest, qpath, cert, key, api_version,
+                 compression='none'):
+        """
+        Initialize a Sender.
+
+        compression is the Content-Encoding to compress messages with,
+        one of 'none', 'gzip' or, if zstandard is installed, 'zstd'.
+        """
+        if compression == 'zstd' and zstandard is None:
+            raise SenderError('zstd compression requires zstandard.')
+
+        self._compression = compression
         self._cert = cert
         self._key = key
         self._outq = QueueSimple(qpath)
         self._dest = dest
         self._api_version = api_version
 
-    def send_all(self):
-        """Send all the messages in the outgoing queue via REST."""
+        # The connection and pacing of each sending thread.
+        self._state = _SenderState()
+
+    def send_all(self, workers=1):
+        """
+        Send all the messages in the outgoing queue via REST.
+
+        Messages are sent by workers threads, each with its own connection.
+        At most two messages per worker are locked, waiting to be sent, at
+        any one time. Raises SenderError if any message could not be sent.
+        """
         log.info('Found %s messages.', self._outq.count())
-        for msgid in self._outq:
-            if not self._outq.lock(msgid):
-                log.warn('Message was locked. %s will not be sent.', msgid)
-                continue
 
-            text = self._outq.get(msgid)
+        window = Queue.Queue(maxsize=workers * 2)
+        failed = threading.Event()
 
-            path = '/api/%s/cloud/record' % self._api_version
-            data = text
+        threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._send_worker,
+                                      args=(window, failed))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
 
-            self._rest_send('POST', path, data, {}, 202)
-            log.info("Sent %s", msgid)
+        try:
+            for msgid in self._outq:
+                if failed.is_set():
+                    break
 
-            time.sleep(0.1)
+                if not self._outq.lock(msgid):
+                    log.warn('Message was locked. %s will not be sent.', msgid)
+                    continue
 
-            self._outq.remove(msgid)
+                window.put(msgid)
+        finally:
+            # Tell each worker there are no more messages to send.
+            for _ in threads:
+                window.put(None)
+            for thread in threads:
+                thread.join()
 
         log.info('Tidying message directory.')
         try:
@@ -59,43 +121,171 @@ class Sender(object):
         except OSError, e:
             log.warn('OSError raised while purging message queue: %s', e)
 
+        if failed.is_set():
+            raise SenderError('Not all messages could be sent.')
+
+    def _send_worker(self, window, failed):
+        """
+        Send the locked messages put in window, until None is put in it.
+
+        Once any message fails to send, failed is set and the remaining
+        messages are unlocked, rather than sent, for a later run to send.
+        Errors never stop the worker taking messages from window, so
+        send_all cannot block putting messages in it.
+        """
+        path = '/api/%s/cloud/record' % self._api_version
+        try:
+            while True:
+                msgid = window.get()
+                if msgid is None:
+                    break
+
+                try:
+                    self._send_message(path, msgid, failed)
+                except Exception as e:
+                    # i.e. the message could not be unlocked or removed.
+                    log.error('Could not tidy up %s: %s', msgid, e)
+                    failed.set()
+        finally:
+            self._close()
+
+    def _send_message(self, path, msgid, failed):
+        """Send, and then remove, the locked message msgid."""
+        if failed.is_set():
+            self._outq.unlock(msgid)
+            return
+
+        try:
+            text = self._outq.get(msgid)
+            data, headers = self._compress(text)
+
+            self._rest_send('POST', path, data, headers, 202)
+        except Exception as e:
+            log.error('Could not send %s: %s', msgid, e)
+            failed.set()
+            self._outq.unlock(msgid)
+            return
+
+        log.info("Sent %s", msgid)
+
+        try:
+            self._outq.remove(msgid)
+        except OSError:
+            # Left unlocked, rather than locked until it is purged,
+            # so it is sent again by the next run.
+            self._outq.unlock(msgid)
+            raise
+
+    def _compress(self, text):
+        """Return text compressed as configured, and the headers to send."""
+        if self._compression == 'gzip':
+            # Adding 16 to wbits writes a gzip, rather than zlib, header.
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            data = compressor.compress(text) + compressor.flush()
+            return data, {'Content-Encoding': 'gzip'}
+
+        if self._compression == 'zstd':
+            data = zstandard.ZstdCompressor().compress(text)
+            return data, {'Content-Encoding': 'zstd'}
+
+        return text, {}
+
     def _rest_send(self, verb, path, data, headers, expected_response_code):
         """
         Send an HTTPS request to self._dest.
 
-        Will attempt to repeat if expected_response is not returned.
+        The connection to self._dest is reused between requests, and
+        reopened if it fails. Will attempt to repeat if expected_response
+        is not returned.
         """
         attempt_number = 0
+        error = None
 
         while attempt_number < 3:
-            try:
-                attempt_number += 1
+            attempt_number += 1
 
-                conn = httplib.HTTPSConnection(self._dest,
-                                               cert_file=self._cert,
-                                               key_file=self._key,
-                                               strict=False)
+            # Pace requests as the endpoint has asked us to.
+            if self._state.delay > 0:
+                time.sleep(self._state.delay)
 
+            try:
+                conn = self._connect()
                 conn.request(verb, path, data, headers)
-
                 response = conn.getresponse()
-
-                if response.status == expected_response_code:
-                    return response
-                else:
-                    log.warning("Could not connect to endpoint, retrying")
-                    time.sleep(attempt_number)
-                    continue
+                # The response must be read in full
+                # before the connection can be reused.
+                response.read()
 
             except socket.gaierror as e:
                 log.info('socket.gaierror: %s, %s',
                          e.errno, e.strerror)
-                sys.exit(1)
+                self._close()
+                raise SenderError('Could not resolve %s.' % self._dest)
+
+            except (httplib.HTTPException, socket.error) as e:
+                # The connection may have been closed by the endpoint
+                # while idle, so reconnect and try again.
+                log.warning('Connection to endpoint failed, retrying: %s', e)
+                error = e
+                self._close()
+                self._backoff(attempt_number)
+                continue
+
+            if response.will_close:
+                self._close()
+
+            if response.status == expected_response_code:
+                # Speed back up, now the endpoint is accepting requests.
+                self._state.delay = self._state.delay / 2.0
+                if self._state.delay < 0.1:
+                    self._state.delay = 0
+
+                return response
+
+            error = '%s - %s' % (response.status, response.reason)
+
+            if response.status in self.BUSY_RESPONSE_CODES:
+                log.warning('Endpoint is busy (%s), slowing down', error)
+                self._backoff(attempt_number,
+                              response.getheader('Retry-After'))
+            else:
+                log.warning("Could not connect to endpoint, retrying")
+                self._backoff(attempt_number)
 
         # if here, attempt_number has been exceeded
-        log.info('Could not connect to endpoint. Error: %s - %s',
-                 response.status, response.reason)
-        sys.exit(1)
+        log.info('Could not connect to endpoint. Error: %s', error)
+        self._close()
+        raise SenderError('Could not connect to endpoint. Error: %s' % error)
+
+    def _connect(self):
+        """Return the connection to self._dest, opening it if needed."""
+        if self._state.conn is None:
+            self._state.conn = httplib.HTTPSConnection(self._dest,
+                                                       cert_file=self._cert,
+                                                       key_file=self._key,
+                                                       strict=False)
+        return self._state.conn
+
+    def _close(self):
+        """Close the connection to self._dest, if it is open."""
+        if self._state.conn is not None:
+            self._state.conn.close()
+            self._state.conn = None
+
+    def _backoff(self, attempt_number, retry_after=None):
+        """
+        Increase the delay before the next request.
+
+        retry_after is the value of a Retry-After header, which is used
+        instead if it gives a number of seconds.
+        """
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = max(self._state.delay * 2, attempt_number)
+
+        self._state.delay = min(delay, self.MAX_DELAY)
 
 
 def main():
@@ -104,6 +294,7 @@ def main():
 
     Usage:
     sender.py -d DESTINATION -q QUEUE -k KEY -c CERTIFICATE [-v VERSION]
+              [-w WORKERS] [-z {none,gzip,zstd}]
 
     Options:
     -h, --help        show this help message and exit
@@ -124,6 +315,12 @@ def main():
     -v VERSION, --version VERSION
                       Version of the APEL REST API Version, expected to be
                       v1
+    -w WORKERS, --workers WORKERS
+                      The number of messages to send at once, each over
+                      its own connection. Defaults to 1
+    -z {none,gzip,zstd}, --compression {none,gzip,zstd}
+                      How to compress messages before sending them. zstd
+                      requires the zstandard module. Defaults to none
     """
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("-d", "--destination", type=str, required=True,
@@ -149,15 +346,32 @@ def main():
                             help=("Version of the APEL REST API Version, "
                                   "expected to be v1"))
 
+    arg_parser.add_argument("-w", "--workers", type=int, default=1,
+                            help=("The number of messages to send at once, "
+                                  "each over its own connection"))
+
+    arg_parser.add_argument("-z", "--compression", type=str, default="none",
+                            choices=("none", "gzip", "zstd"),
+                            help=("How to compress messages "
+                                  "before sending them"))
+
     args = arg_parser.parse_args()
 
-    sender = Sender(args.destination,
-                    args.queue,
-                    args.certificate,
-                    args.key,
-                    args.version)
+    if args.workers < 1:
+        arg_parser.error("--workers must be at least 1")
+
+    try:
+        sender = Sender(args.destination,
+                        args.queue,
+                        args.certificate,
+                        args.key,
+                        args.version,
+                        args.compression)
 
-    sender.send_all()
+        sender.send_all(args.workers)
+    except SenderError as e:
+        log.error(e)
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()